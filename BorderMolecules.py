@@ -1,6 +1,8 @@
-from PyQt5.QtGui import QPainter, QPen, QBrush
-from PyQt5.QtCore import Qt, QPointF
+from qtcompat import Qt, QPointF, QLineF, QPainter, QPen, QBrush, qcolor
+from itertools import combinations, groupby, product
+from operator import itemgetter
 import math
+from ringbuffer import RingBuffer
 
 ARROW_ANGLE = math.pi / 6
 
@@ -54,9 +56,10 @@ class Border(Object):
         dx, dy = p2.x() - p1.x(), p2.y() - p1.y()
         self.length = (dx**2 + dy**2)**0.5
         self.normal = QPointF(-dy / self.length, dx / self.length)  # Perpendicular unit vector
-        # pressure stack
+        # pressure stack: momentum per length and dt of the last steps, so steps of any dt weigh by their time
         self.current_momentum = 0.
-        self.pressure = [0]
+        self.pressure = RingBuffer(stack_size)
+        self.durations = RingBuffer(stack_size)
         self.stack_size = stack_size
 
     def get_bounds(self) -> tuple:
@@ -68,15 +71,14 @@ class Border(Object):
         self.current_momentum -= p_x * self.normal.x() + p_y * self.normal.y()
 
     def next_time(self, dt: float):
-        # print("add press", self.current_momentum, dt, self.length) 
-        self.pressure.append(self.current_momentum / dt / self.length)
-        if len(self.pressure) > self.stack_size:  # limit history length
-                self.pressure.pop(0)
+        self.pressure.append(self.current_momentum / self.length)  # the buffers keep the last stack_size
+        self.durations.append(dt)
         self.current_momentum = 0.
-        # self.neighbours.clear()
         
     def get_pressure(self):
-        return sum(self.pressure) / len(self.pressure) 
+        # momentum over the time of the stack
+        duration = self.durations.mean()
+        return self.pressure.mean() / duration if duration else 0.
 
     def draw(self, painter):
         painter.setPen(QPen(self.color, 2))
@@ -106,17 +108,19 @@ class Molecule(Object):
         self.x, self.y = x, y
         self.v_x, self.v_y = v_x, v_y
         self.trace = trace
-        self.path = []  # store previous positions
+        self.path = RingBuffer(shape=(2,))  # store previous positions
 
     def move(self, dt: float, add_trace=False, g=0., trace_length=0):
         self.x += self.v_x * dt
         self.y += self.v_y * dt + g * dt*dt/2
         self.v_y += g * dt
         if self.trace and add_trace:
-            self.path.append(QPointF(self.x, self.y))
-            if len(self.path) > trace_length:  # limit history length
-                self.path.pop(0)
-        # self.neighbours.clear()
+            self.add_trace(trace_length)
+
+    def add_trace(self, trace_length: int):
+        if self.path.capacity != trace_length:  # limit history length
+            self.path.resize(trace_length)
+        self.path.append((self.x, self.y))
 
     def draw_velocity(self, painter: QPainter, scale=0.5):
         # print("draw velosity", type(self).__name__)
@@ -140,7 +144,6 @@ class Molecule(Object):
         return self.M() * self.v_y * self.v_y / 2
 
     def W_r(self) -> float:
-        print("W_r in Molecule", type(self).__name__)
         raise NotImplementedError
 
     def W(self) -> float:
@@ -156,9 +159,9 @@ class Molecule(Object):
 
     def draw(self, painter: QPainter):
         if self.trace:
-            painter.setPen(QPen(self.color, 2))
-            for segment in [list(pair) for pair in zip(self.path[::2], self.path[1::2])]:
-                painter.drawLine(*segment)
+            painter.setPen(QPen(qcolor(self.color), 2))
+            points = self.path.view()
+            painter.drawLines([QLineF(*segment) for segment in points[:len(points) // 2 * 2].reshape(-1, 4).tolist()])
         
 
 """ === Spatial Grid === """
@@ -204,3 +207,252 @@ class SpatialGrid:
                             checked.add((id(a), id(b)))
                             collisions.append((a, b))
         return collisions
+
+
+""" === Cell List === """
+KEY_STRIDE = 1 << 32        # cell key = row * KEY_STRIDE + col
+AROUND = [row * KEY_STRIDE + col for row in (-1, 0, 1) for col in (-1, 0, 1)]     # key offsets of the 3 x 3 cells
+BIN_TOLERANCE = 1e-9        # relative: an object a rounding error larger than a cell still fits it
+
+
+class CellList:
+    # sort-based broad phase: every object gets one cell key, objects are sorted by key and each cell
+    # is paired only with its half-neighbourhood (E, SW, S, SE), so every pair comes out once.
+    # Objects larger than a cell (long borders) are paired with the cells around their bounds.
+    def __init__(self, width, height, cell_size):
+        # same signature as SpatialGrid; keys are not bounded by width and height
+        self.cell_size = cell_size
+        self.small = []         # (cell key, object)
+        self.large = []         # (object, (min_row, min_col, max_row, max_col))
+
+    def clear(self):
+        self.small.clear()
+        self.large.clear()
+
+    def add_object(self, obj: Object, margin=0., bounds=None):
+        # margin: the bounds are widened by it on every side; bounds: obj.get_bounds() if known
+        if bounds is None:
+            bounds = obj.get_bounds()
+        if margin:
+            bounds = (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin)
+        fits = self.cell_size * (1 + BIN_TOLERANCE)
+        if bounds[2] - bounds[0] <= fits and bounds[3] - bounds[1] <= fits:
+            row = int((bounds[1] + bounds[3]) / 2 // self.cell_size)
+            col = int((bounds[0] + bounds[2]) / 2 // self.cell_size)
+            self.small.append((row * KEY_STRIDE + col, obj))
+        else:
+            self.large.append((obj, (int(bounds[1] // self.cell_size), int(bounds[0] // self.cell_size),
+                                     int(bounds[3] // self.cell_size), int(bounds[2] // self.cell_size))))
+
+    def runs(self) -> dict:
+        # cell key -> the small objects centred in the cell
+        self.small.sort(key=itemgetter(0))
+        return {key: [item[1] for item in group] for key, group in groupby(self.small, key=itemgetter(0))}
+
+    def cell_occupancy(self) -> list[int]:
+        # occupancy[k]: cells holding k small objects
+        sizes = [len(objects) for objects in self.runs().values()]
+        occupancy = [0] * (max(sizes, default=0) + 1)
+        for size in sizes:
+            occupancy[size] += 1
+        return occupancy
+
+    def get_possible_collisions(self, runs=None):
+        # runs: self.runs() if already made
+        if runs is None:
+            runs = self.runs()
+        collisions = []
+        for key, cell in runs.items():
+            collisions.extend(combinations(cell, 2))
+            for offset in (1, KEY_STRIDE - 1, KEY_STRIDE, KEY_STRIDE + 1):
+                if key + offset in runs:
+                    collisions.extend(product(cell, runs[key + offset]))
+
+        for n, (obj, (min_row, min_col, max_row, max_col)) in enumerate(self.large):
+            for other, (row0, col0, row1, col1) in self.large[n + 1:]:
+                if row0 <= max_row and min_row <= row1 and col0 <= max_col and min_col <= col1:
+                    collisions.append((obj, other))
+            # small objects centred in the cells of the bounds or one cell around them
+            if (max_row - min_row + 3) * (max_col - min_col + 3) < len(runs):
+                keys = [row * KEY_STRIDE + col for row in range(min_row - 1, max_row + 2) for col in range(min_col - 1, max_col + 2)]
+            else:
+                keys = [key for key in runs if min_row - 1 <= (key + KEY_STRIDE // 2) // KEY_STRIDE <= max_row + 1
+                        and min_col - 1 <= key - (key + KEY_STRIDE // 2) // KEY_STRIDE * KEY_STRIDE <= max_col + 1]
+            for key in keys:
+                if key in runs:
+                    collisions.extend((obj, b) for b in runs[key])
+        return collisions
+
+
+""" === Multi-level grid === """
+class LevelGrid:
+    # same interface as CellList. An object of extent up to cell_size * 2**k goes to level k, a CellList
+    # of cells that size, so a few big molecules do not crowd the cells of the many small ones. Pairs
+    # within a level come from its CellList; the objects of a cell are paired with the objects of every
+    # coarser level centred in the 3 x 3 cells around the cell's own there
+    def __init__(self, width, height, cell_size):
+        self.width, self.height = width, height
+        self.cell_size = cell_size
+        self.levels = [CellList(width, height, cell_size)]
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+
+    def add_object(self, obj: Object, margin=0., bounds=None):
+        # bounds: obj.get_bounds() if known
+        if bounds is None:
+            bounds = obj.get_bounds()
+        width, height = bounds[2] - bounds[0], bounds[3] - bounds[1]
+        extent = ((width if width > height else height) + 2 * margin) / (1 + BIN_TOLERANCE)
+        level, cell = 0, self.cell_size
+        while extent > cell:
+            level += 1
+            cell *= 2
+        while level >= len(self.levels):
+            self.levels.append(CellList(self.width, self.height, self.cell_size * 2 ** len(self.levels)))
+        # it fits a cell of its level: a small object there, keyed by its centre
+        self.levels[level].small.append((int((bounds[1] + bounds[3]) / 2 // cell) * KEY_STRIDE
+                                         + int((bounds[0] + bounds[2]) / 2 // cell), obj))
+
+    def cell_occupancy(self) -> list[int]:
+        # all levels together
+        occupancy = []
+        for level in self.levels:
+            for size, count in enumerate(level.cell_occupancy()):
+                if size == len(occupancy):
+                    occupancy.append(0)
+                occupancy[size] += count
+        return occupancy
+
+    def get_possible_collisions(self):
+        filled = [level for level in self.levels if level.small or level.large]
+        if len(filled) <= 1:
+            # one size class: a plain CellList
+            return filled[0].get_possible_collisions() if filled else []
+        collisions = []
+        runs = []
+        for level in self.levels:
+            runs.append(level.runs() if level.small else {})
+            if level in filled:
+                collisions.extend(level.get_possible_collisions(runs[-1]))
+        for k, fine_runs in enumerate(runs):
+            for shift, coarse_runs in enumerate(runs[k + 1:], 1):
+                if fine_runs and coarse_runs:
+                    collisions.extend(self.cross_pairs(fine_runs, coarse_runs, shift))
+        return collisions
+
+    @staticmethod
+    def cross_pairs(fine_runs: dict, coarse_runs: dict, shift: int) -> list:
+        # the cell of level k + shift around cell (row, col) of level k is (row >> shift, col >> shift);
+        # looked up from the side with fewer lookups
+        pairs = []
+        span = 3 << shift
+        if len(coarse_runs) * span * span < len(fine_runs) * len(AROUND):
+            # a few large objects: the fine cells around each coarse cell
+            for key, others in coarse_runs.items():
+                row = (key + KEY_STRIDE // 2) // KEY_STRIDE
+                col = key - row * KEY_STRIDE
+                for fine_row in range((row - 1) << shift, (row + 2) << shift):
+                    start = fine_row * KEY_STRIDE + ((col - 1) << shift)
+                    for fine_key in range(start, start + span):
+                        cell = fine_runs.get(fine_key)
+                        if cell:
+                            pairs.extend(product(cell, others))
+        else:
+            for key, cell in fine_runs.items():
+                row = (key + KEY_STRIDE // 2) // KEY_STRIDE
+                col = key - row * KEY_STRIDE
+                centre = (row >> shift) * KEY_STRIDE + (col >> shift)
+                for offset in AROUND:
+                    others = coarse_runs.get(centre + offset)
+                    if others:
+                        pairs.extend(product(cell, others))
+        return pairs
+
+
+""" === Neighbour (Verlet) lists === """
+LIST_MAX_STRAYS = 8     # molecules that left their skin paired with everything before the lists are rebuilt (python engine)
+
+
+class NeighbourList:
+    # same interface as CellList. Every object keeps in `neighbours` the objects whose bounds were
+    # within `skin` of its own at the last build; the lists are reused while the bounds have moved by
+    # less than skin / 2, so no touch is missed in between. The few molecules that moved more (strays)
+    # are paired with everything until the next build
+    def __init__(self, width, height, cell_size, skin):
+        self.cell_list = LevelGrid(width, height, cell_size + skin)
+        self.skin = skin
+        self.objects = []
+        self.built = []         # the objects of the last build
+        self.bounds = []        # and their bounds then, None for borders
+        self.rebuilds = 0
+
+    def clear(self):
+        self.objects.clear()
+
+    def cell_occupancy(self) -> list[int]:
+        # at the last build
+        return self.cell_list.cell_occupancy()
+
+    def add_object(self, obj: Object, bounds=None):
+        # the bounds are read at the build
+        self.objects.append(obj)
+
+    def strays(self):
+        # the molecules out of their skin, None if the lists must be rebuilt
+        if len(self.objects) != len(self.built) or any(a is not b for a, b in zip(self.objects, self.built)):
+            return None
+        half = self.skin / 2
+        strays = []
+        for obj, old in zip(self.objects, self.bounds):
+            if old is not None:
+                new = obj.get_bounds()
+                if abs(new[0] - old[0]) > half or abs(new[1] - old[1]) > half or \
+                        abs(new[2] - old[2]) > half or abs(new[3] - old[3]) > half:
+                    strays.append(obj)
+                    if len(strays) > LIST_MAX_STRAYS:
+                        return None
+        return strays
+
+    def near(self, a: Object, b: Object) -> bool:
+        # bounds within skin; a ball touches a slanted border a little outside its bounds, so
+        # border pairs get half the molecule size more
+        if isinstance(a, Border) and isinstance(b, Border):
+            return False
+        bounds_a, bounds_b = a.get_bounds(), b.get_bounds()
+        slack = self.skin
+        if isinstance(a, Border) or isinstance(b, Border):
+            bounds = bounds_b if isinstance(a, Border) else bounds_a
+            slack += max(bounds[2] - bounds[0], bounds[3] - bounds[1]) / 2
+        gap_x = max(bounds_a[0] - bounds_b[2], bounds_b[0] - bounds_a[2])
+        gap_y = max(bounds_a[1] - bounds_b[3], bounds_b[1] - bounds_a[3])
+        return max(gap_x, gap_y) <= slack
+
+    def build(self):
+        self.rebuilds += 1
+        grid = self.cell_list
+        grid.clear()
+        for obj in self.objects:
+            obj.neighbours.clear()
+            grid.add_object(obj, self.skin / 2)
+        for a, b in grid.get_possible_collisions():
+            if self.near(a, b):
+                a.neighbours.append(b)
+        self.built = list(self.objects)
+        self.bounds = [None if isinstance(obj, Border) else obj.get_bounds() for obj in self.objects]
+
+    def get_possible_collisions(self):
+        strays = self.strays()
+        if strays is None:
+            self.build()
+            strays = []
+        if not strays:
+            return [(a, b) for a in self.objects for b in a.neighbours]
+        skip = {id(obj) for obj in strays}
+        collisions = [(a, b) for a in self.objects if id(a) not in skip for b in a.neighbours if id(b) not in skip]
+        for obj in strays:
+            skip.discard(id(obj))   # pairs of two strays once
+            collisions.extend((obj, other) for other in self.objects
+                              if other is not obj and id(other) not in skip and self.near(obj, other))
+        return collisions
@@ -3,12 +3,85 @@ from PyQt5.QtWidgets import (
     QWidget, QPushButton, QVBoxLayout, QLabel, QFormLayout
 )
 from PyQt5.QtCore import Qt
+import time
 import numpy as np
-import matplotlib.pyplot as plt
+
+from engine import molecule_columns
+from ringbuffer import RingBuffer
+
+
+MAX_FPS = 20        # redraws per second of a plot window
+HISTOGRAM_BINS = 50
+PERFORMANCE_INTERVAL = 0.5     # seconds between two refreshes of the performance panel
+# label, Profiler.summary key, format
+PERFORMANCE_ROWS = [("steps/s", "steps_per_second", "{:.1f}"), ("move, ms", "move_ms", "{:.3f}"),
+                    ("broad phase, ms", "broad_ms", "{:.3f}"), ("narrow phase, ms", "narrow_ms", "{:.3f}"),
+                    ("reflect, ms", "reflect_ms", "{:.3f}"), ("candidates/step", "candidates", "{:.0f}"),
+                    ("touches/step", "touches", "{:.1f}"), ("frame, ms", "frame_ms", "{:.2f}"),
+                    ("frames/s", "frames_per_second", "{:.1f}")]
+MAX_OCCUPANCY_SHOWN = 8     # cell occupancy histogram entries shown
+
+
+def pyplot():
+    # matplotlib is imported by the first plot or histogram window, not with this module
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def window_func(func) -> callable:
+    # a function of the window, or the name of an observable of its simulation (see observables.py)
+    if isinstance(func, str):
+        return lambda win: win.observables[func]
+    return func
+
+
+class Blitter:
+    """ redraws only the animated artists over the background cached at the last full draw;
+        canvases without blitting get draw_idle """
+    def __init__(self, fig, artists: list):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.artists = artists
+        self.background = None
+        self.last_draw = 0.
+        for artist in artists:
+            artist.set_animated(True)
+        self.canvas.mpl_connect("draw_event", self.on_draw)
+
+    def on_draw(self, event):
+        if getattr(self.canvas, "supports_blit", False):
+            self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+            self.draw_artists()
+
+    def draw_artists(self):
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
+
+    def due(self) -> bool:
+        # the frame-rate cap
+        return time.perf_counter() - self.last_draw >= 1 / MAX_FPS
+
+    def update(self):
+        self.last_draw = time.perf_counter()
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        self.canvas.blit(self.fig.bbox)
+
+    def redraw(self):
+        # axes changed: full draw, the background is taken again
+        self.last_draw = time.perf_counter()
+        self.background = None
+        self.canvas.draw_idle()
 
 
 class HistogramViewer:
-    def __init__(self, win: QWidget, label: str, histogram_func: callable, skip=1, limits = (None, None)):
+    """ histogram with fixed bins: the bar heights are updated and blitted, the bins and the height
+        axis are rebuilt only when the distribution leaves them """
+    def __init__(self, win: QWidget, label: str, histogram_func: callable, skip=1, limits = (None, None), bins=HISTOGRAM_BINS):
+        plt = pyplot()
         self.skip = skip
         self.skip_counter = 0
         self.fig, self.ax = plt.subplots()
@@ -16,6 +89,10 @@ class HistogramViewer:
         self.win = win
         self.histogram_func = histogram_func
         self.limits = limits
+        self.bins = bins
+        self.edges = None
+        self.bars = None
+        self.blitter = None
 
         def handle_close(event):
             self.win.histogram_viewer = None
@@ -23,61 +100,104 @@ class HistogramViewer:
         self.fig.canvas.manager.set_window_title(self.title)
         self.fig.canvas.mpl_connect("close_event", handle_close)
         plt.show()
-        # self.fig.canvas.draw()
         plt.ion()
         self.update_distribution()
 
+    def values(self) -> np.ndarray:
+        # a per-molecule observable by name, else histogram_func on all molecules at once when they are
+        # array-backed balls, else one by one
+        if isinstance(self.histogram_func, str):
+            return np.asarray(self.win.observables[self.histogram_func], dtype=np.float64)
+        molecules = self.win.display.balls if getattr(self.win, "display", None) else self.win.molecules
+        columns = molecule_columns(molecules, getattr(self.win, "engine", None))
+        if columns is not None:
+            try:
+                values = np.broadcast_to(np.asarray(self.histogram_func(columns), dtype=np.float64), (len(molecules),))
+            except Exception:
+                values = None
+            if values is not None:
+                return values
+        return np.fromiter((self.histogram_func(mol) for mol in molecules), dtype=np.float64, count=len(molecules))
+
+    def set_bins(self, values: np.ndarray):
+        # a few outliers (a big ball among small ones) do not stretch the bins
+        low, high = np.percentile(values, [0, 99.5])
+        low = self.limits[0] if self.limits[0] is not None else low
+        high = self.limits[1] if self.limits[1] is not None else high
+        if high <= low:
+            high = low + 1
+        # free ends get a margin, so the bins last while the distribution moves
+        margin = (high - low) / 4
+        if self.limits[0] is None:
+            low = max(low - margin, 0) if low >= 0 else low - margin
+        if self.limits[1] is None:
+            high += margin
+        self.edges = np.linspace(low, high, self.bins + 1)
+        self.ax.cla()
+        self.bars = self.ax.bar(self.edges[:-1], np.zeros(self.bins), width=np.diff(self.edges), align='edge',
+                                color='skyblue', edgecolor='black')
+        self.ax.set_xlim(self.edges[0], self.edges[-1])
+        self.ax.set_title(self.title)
+        self.blitter = Blitter(self.fig, list(self.bars))
+
     def update_distribution(self):
-        if self.skip_counter == 0:
-            print("start update Hist")
-            self.ax.cla()
-            v_values = [self.histogram_func(mol) for mol in self.win.molecules]
-            if np.isnan(v_values).any():
-                print("ERROR: v_values contains NaN!")
-                print(v_values)
-                raise ValueError("v_values contains NaN.")
-
-            if np.isinf(v_values).any():
-                print("ERROR: v_values contains inf or -inf!")
-                print(v_values)
-                raise ValueError("v_values contains inf or -inf.")
-            self.ax.hist(v_values, bins='auto', density=True, color='skyblue', edgecolor='black')
-            print("...done")
-            self.ax.set_xlim(*self.limits)                              # ==== for future =======
-            self.ax.set_title(self.title)
-            # plt.show(block=False)
-            
-            self.fig.canvas.draw_idle()          # .draw_idle
+        if self.skip_counter == 0 and (self.blitter is None or self.blitter.due()):
+            values = self.values()
+            if not np.isfinite(values).all():
+                raise ValueError(f"{self.title}: values contain NaN or inf.")
+            rebuild = self.edges is None
+            if not rebuild and None in self.limits:
+                # more than a percent outside the bins or all in a quarter of them
+                outside = np.count_nonzero((values < self.edges[0]) | (values > self.edges[-1]))
+                spread = (values.max() - values.min()) / (self.edges[-1] - self.edges[0])
+                rebuild = outside > len(values) / 100 or spread < 1/4
+            if rebuild:
+                self.set_bins(values)
+            counts, _ = np.histogram(values, self.edges)
+            heights = counts / len(values) / np.diff(self.edges)      # density
+            for bar, height in zip(self.bars, heights.tolist()):
+                bar.set_height(height)
+            top = self.ax.get_ylim()[1]
+            if rebuild or heights.max() > top or heights.max() < top / 3:
+                self.ax.set_ylim(0, heights.max() * 1.3 or 1)
+                self.blitter.redraw()
+            else:
+                self.blitter.update()
         self.skip_counter += 1
         if self.skip_counter >= self.skip:
             self.skip_counter = 0
-        
 
     def raise_it(self):
         self.fig.canvas.manager.window.raise_()
-        
+
+
 class PlotViewer:
-    def __init__(self, win: QWidget, num_points: int, label: str, functions: list[tuple[str,callable]], t_interval: tuple, func_interval: tuple, step=20):
+    """ averages of the functions over `step` updates in a preallocated ring buffer; the lines are blitted
+        and the time axis jumps by half its width when the curves reach its end """
+    def __init__(self, win: QWidget, num_points: int, label: str, functions: list[tuple[str, callable]], t_interval: tuple, func_interval: tuple, step=20):
         self.win = win
-        self.current_point = 0
         self.num_points = num_points
-        self.functions = functions
-        
-        self.t = np.linspace(*t_interval, num_points)  # Fixed X-axis
-        self.func_values = [np.full(num_points, np.nan) for _ in range(len(functions))]  # Empty Y-values (initialize with NaN)
+        self.functions = [(label, window_func(func)) for label, func in functions]
+        self.t_interval = t_interval
+        self.time = t_interval[0]
+
+        # rows: time, then the function values
+        self.points = RingBuffer(num_points, shape=(1 + len(functions),))
 
         # for accumulation of values 
         self.step = step
         self.count_step = 0
-        self.c_func_values = [0]*len(functions)
+        self.c_func_values = np.zeros(len(functions))
 
         # Create figure and plot
+        plt = pyplot()
         self.fig, self.ax = plt.subplots()
         self.fig.canvas.manager.set_window_title(label)
-        self.lines = [self.ax.plot(self.t, func_val, label=func[0])[0] for func, func_val in zip(self.functions, self.func_values)]
+        self.lines = [self.ax.plot([], [], label=func[0])[0] for func in self.functions]
         self.ax.set_xlim(*t_interval)
         self.ax.set_ylim(*func_interval)
         self.ax.legend()
+        self.blitter = Blitter(self.fig, self.lines)
 
         def handle_close(event):
             self.win.plot_viewer = None
@@ -87,31 +207,27 @@ class PlotViewer:
         plt.show()
 
     def update(self, dt: float):
-        # print("start plot update")
+        self.time += dt
         for i, func in enumerate(self.functions):
-            self.c_func_values[i] += func[1](self.win)  
+            self.c_func_values[i] += func[1](self.win)
              
         self.count_step += 1
         if self.count_step >= self.step:
-            print("plot values:", self.c_func_values)
             self.count_step = 0
-            for i, c_value in enumerate(self.c_func_values):  
-                self.func_values[i][self.current_point] = c_value / self.step
-                self.c_func_values[i] = 0
-                
-            for line, func_value in zip(self.lines, self.func_values):
-                line.set_ydata(func_value)  # Update the plot
-                
-            self.current_point += 1
-            if self.current_point >= self.num_points:
-                self.t = self.t[1:]  # remove the first point
-                self.t = np.append(self.t, self.t[-1] + dt * self.step)  # append new point at end
-                for i in range(len(self.func_values)):
-                    self.func_values[i] = self.func_values[i][1:]
-                    self.func_values[i] = np.append(self.func_values[i], np.nan)
-                self.current_point -= 1
-            # plt.draw()  # Refresh the figure
-            self.fig.canvas.draw_idle()         # .draw_idle
+            self.points.append((self.time, *(self.c_func_values / self.step)))
+            self.c_func_values[:] = 0
+
+        if len(self.points) and self.blitter.due():
+            points = self.points.view()
+            for i, line in enumerate(self.lines):
+                line.set_data(points[:, 0], points[:, i + 1])
+            t_min, t_max = self.ax.get_xlim()
+            if points[-1, 0] > t_max:
+                width = t_max - t_min
+                self.ax.set_xlim(t_min + width / 2, t_max + width / 2)
+                self.blitter.redraw()
+            else:
+                self.blitter.update()
 
     def raise_it(self):
         self.fig.canvas.manager.window.raise_()
@@ -121,7 +237,7 @@ class ParamViewer(QWidget):
     def __init__(self, parent, param_funcs):
         super().__init__()
         self.setWindowTitle("Parameters")
-        self.param_funcs = param_funcs
+        self.param_funcs = [(name, window_func(func)) for name, func in param_funcs]
         self.obj = parent
         self.layout = QFormLayout()
         self.setLayout(self.layout)
@@ -142,6 +258,50 @@ class ParamViewer(QWidget):
                 val = f"Error: {e}"
             self.labels[name].setText(str(val))
 
+class PerformanceViewer(QWidget):
+    """ the summary of the profiler of the window's simulation, see profiling.py;
+        the buttons export the kept steps next to `path` """
+    def __init__(self, win: QWidget, path="profile"):
+        super().__init__()
+        self.setWindowTitle("Performance")
+        self.win = win
+        self.path = path
+        self.last_update = 0.
+        self.layout = QFormLayout()
+        self.setLayout(self.layout)
+        self.labels = {}
+        for name, _, _ in PERFORMANCE_ROWS + [("cell occupancy", None, None)]:
+            label = QLabel("")
+            self.layout.addRow(name + ":", label)
+            self.labels[name] = label
+        for text, suffix, method in (("Export JSON", ".json", "save_json"), ("Export CSV", ".csv", "save_csv"),
+                                     ("Chrome trace", ".trace.json", "save_chrome_trace")):
+            button = QPushButton(text)
+            button.clicked.connect(lambda checked, suffix=suffix, method=method: self.export(suffix, method))
+            self.layout.addRow(button)
+        self.update_performance(force=True)
+
+    def update_performance(self, force=False):
+        profiler = self.win.sim.profiler
+        if profiler is None or not force and time.perf_counter() - self.last_update < PERFORMANCE_INTERVAL:
+            return
+        self.last_update = time.perf_counter()
+        with self.win.physics_lock():
+            summary = profiler.summary()
+        for name, key, form in PERFORMANCE_ROWS:
+            value = summary.get(key)
+            self.labels[name].setText("-" if value is None or np.isnan(value) else form.format(value))
+        # objects per cell: number of cells
+        occupancy = [f"{size}: {count}" for size, count in enumerate(summary["occupancy"]) if size and count]
+        self.labels["cell occupancy"].setText(", ".join(occupancy[:MAX_OCCUPANCY_SHOWN]) + (" ..." if len(occupancy) > MAX_OCCUPANCY_SHOWN else ""))
+
+    def export(self, suffix: str, method: str):
+        profiler = self.win.sim.profiler
+        if profiler is not None:
+            with self.win.physics_lock():
+                getattr(profiler, method)(self.path + suffix)
+
+
 class RightMenu:
     def __init__(self, win: QWidget):
         self.main_layout = QVBoxLayout()
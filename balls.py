@@ -1,7 +1,5 @@
 from BorderMolecules import Border, Molecule
-from PyQt5.QtGui import QPainter, QPen, QBrush
-from PyQt5.QtCore import Qt, QPointF
-from PyQt5.QtGui import QPainter
+from qtcompat import Qt, QPointF, QPainter, QPen, QBrush, qcolor
 
 
 class Ball(Molecule):
@@ -41,12 +39,12 @@ class Ball(Molecule):
         super().draw(painter)
 
         # Ball appearance
-        painter.setBrush(QBrush(self.color))
+        painter.setBrush(QBrush(qcolor(self.color)))
         painter.setPen(QPen(Qt.black))
         painter.drawEllipse(QPointF(self.x, self.y), self.r, self.r)
         
         # Highlighted effect
-        painter.setPen(QPen(self.color))
+        painter.setPen(QPen(qcolor(self.color)))
         painter.setBrush(QBrush(Qt.white))
         painter.drawEllipse(QPointF(self.x - self.r / 3, self.y - self.r / 3), self.r / 4, self.r / 4)
         
@@ -113,7 +111,6 @@ class Ball(Molecule):
             else:
                 return False
         else:
-            print("ball touch other", type(other).__name__)
             return other.touch(self)
 
     def reflect(self, other):
@@ -0,0 +1,292 @@
+""" Benchmark suite: generated and stored scenes stepped by each engine, with move, broad phase, narrow phase
+    and reflect timed apart, plus save/load and offscreen drawing; results go to JSON and can be compared
+    against a stored baseline """
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QImage, QPainter
+
+from BorderMolecules import Border
+from balls import Ball
+from dumbbells import Dumbbell
+from engine import ArrayEngine
+from simulation import Simulation, ENGINES
+from scenegen import Species, generate, make_balls
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SUITES = {
+    "quick": ["startup", "gas-100", "gas-1000", "gas-10000", "mixed-1000", "mixed-10000", "TwoBallons2_", "dumbbells-100", "dumbbells-5000"],
+    "full": ["startup", "gas-100", "gas-1000", "gas-10000", "gas-100000", "gas-1000000", "mixed-1000", "mixed-10000",
+             "mixed-100000", "mixed-1000000", "TwoBallons2_", "dumbbells-100", "dumbbells-1000", "dumbbells-5000"],
+}
+MAX_PYTHON_BALLS = 10000    # larger scenes are not run with the python engine
+RADIUS = 3.
+MIXED_RADIUS = 9.           # every tenth ball of a mixed scene
+PACKING = 0.2               # area fraction of the generated gases
+TEMPERATURE = 1000.
+DRAW_SIZE = 2000            # largest side of the offscreen image in pixels
+PHASES = ("move", "broad", "narrow", "reflect")
+TOLERANCE = 1.25            # slower than the baseline by this factor - a regression
+NOISE_MS = 0.1              # shorter timings are not compared
+# "startup": import times in a fresh interpreter; the physics modules must import without PyQt5 and matplotlib
+STARTUP_MODULES = ("BorderMolecules", "balls", "dumbbells", "simulation", "billiard8_6")
+QT_FREE_MODULES = ("BorderMolecules", "balls", "dumbbells", "simulation", "snapshot", "sweep")
+
+
+def box(width: float, height: float) -> list[Border]:
+    corners = [QPointF(0, 0), QPointF(width, 0), QPointF(width, height), QPointF(0, height)]
+    return [Border(a, b) for a, b in zip(corners, corners[1:] + corners[:1])]
+
+
+def make_scene(name: str, rng) -> Simulation:
+    # "gas-N": N balls of one radius, "mixed-N": every tenth ball three times larger,
+    # "dumbbells-N": N dumbbells, anything else: a scene file next to this one
+    kind, _, count = name.rpartition("-")
+    if not count.isdigit():
+        return Simulation.from_file(os.path.join(HERE, name))
+    n = int(count)
+    radius = MIXED_RADIUS if kind == "mixed" else 2.2 * RADIUS if kind == "dumbbells" else RADIUS
+    side = math.sqrt(n * math.pi * radius * radius / PACKING) + 4 * radius
+    borders = box(side, side)
+    species = [Species(2., radius)]
+    balls = make_balls(generate(borders, species, n, temperature=TEMPERATURE, rng=rng), species)
+    if kind == "mixed":
+        for k, ball in enumerate(balls):
+            if k % 10:
+                ball.r = RADIUS
+    elif kind == "dumbbells":
+        # two touching balls on every site, turned at random
+        molecules = []
+        for ball in balls:
+            angle = rng.uniform(0, 2 * math.pi)
+            dx, dy = 1.1 * RADIUS * math.cos(angle), 1.1 * RADIUS * math.sin(angle)
+            ends = [Ball(1., RADIUS, ball.x + sign * dx, ball.y + sign * dy, ball.v_x, ball.v_y, Qt.red) for sign in (1, -1)]
+            molecules.append(Dumbbell(*ends))
+        balls = molecules
+    elif kind != "gas":
+        raise ValueError(f"unknown scene {name!r}")
+    return Simulation(borders, balls)
+
+
+def engines_for(sim: Simulation, engines: list[str]) -> list[str]:
+    # the array engines take only balls, the rigid engine balls and dumbbells, the python engine only
+    # the smaller scenes
+    only_balls = all(type(mol) is Ball for mol in sim.molecules)
+    rigid = all(type(mol) in (Ball, Dumbbell) for mol in sim.molecules)
+    return [engine for engine in engines if (engine == "python" and len(sim.molecules) <= MAX_PYTHON_BALLS)
+            or (engine == "rigid" and rigid) or (engine not in ("python", "rigid") and only_balls)]
+
+
+def timed_step(sim: Simulation, times: dict):
+    # Simulation.step with the phases timed apart; engines without separate phases time the whole step
+    engine = sim.engine
+    if engine is not None and type(engine).find_touches is not ArrayEngine.find_touches:
+        start = time.perf_counter()
+        sim.step()
+        times["step"].append(time.perf_counter() - start)
+        return
+    marks = [time.perf_counter()]
+    if engine:
+        engine.move(sim.dt, False, sim.g, sim.trace_length)
+    else:
+        for molecule in sim.molecules:
+            molecule.move(sim.dt, False, sim.g, sim.trace_length)
+    marks.append(time.perf_counter())
+    candidates = engine.candidates() if engine else list(sim.candidates())
+    marks.append(time.perf_counter())
+    touches = engine.touches(*candidates) if engine else [pair for pair in candidates if pair[0].touch(pair[1])]
+    marks.append(time.perf_counter())
+    if engine:
+        engine.reflect(touches)
+    else:
+        [pair[0].reflect(pair[1]) for pair in touches]
+    marks.append(time.perf_counter())
+    for brd in sim.borders:
+        brd.next_time(sim.dt)
+    sim.steps += 1
+    sim.time += sim.dt
+    for phase, begin, end in zip(PHASES, marks, marks[1:]):
+        times[phase].append(end - begin)
+    times["step"].append(marks[-1] - marks[0])
+
+
+def best_of(func: callable, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def time_io(sim: Simulation, repeat: int) -> dict:
+    # text scene files and binary snapshots, written and read back
+    with tempfile.TemporaryDirectory() as directory:
+        text, snap = os.path.join(directory, "scene"), os.path.join(directory, "scene.snap")
+        other = Simulation([], [])
+        return {"save_text": best_of(lambda: sim.save_to_file(text + ".txt"), repeat),
+                "load_text": best_of(lambda: other.load_from_file(text), repeat),
+                "save_snapshot": best_of(lambda: sim.save_snapshot(snap), repeat),
+                "load_snapshot": best_of(lambda: other.load_snapshot(snap), repeat)}
+
+
+def time_draw(sim: Simulation, repeat: int) -> float:
+    # one frame of the window: borders and molecules into an offscreen image
+    from movie import ensure_gui
+    from render import SceneRenderer
+    ensure_gui()
+    min_x, min_y, max_x, max_y = sim.bounds()
+    scale = min(1., DRAW_SIZE / max(max_x - min_x, max_y - min_y, 1))
+    image = QImage(int((max_x - min_x) * scale) + 1, int((max_y - min_y) * scale) + 1, QImage.Format_ARGB32_Premultiplied)
+    renderer = SceneRenderer()
+
+    def draw():
+        image.fill(Qt.white)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.scale(scale, scale)
+        painter.translate(-min_x, -min_y)
+        for border in sim.borders:
+            border.draw(painter)
+        renderer.draw(painter, sim.molecules)
+        painter.end()
+
+    draw()      # sprites and groups
+    return best_of(draw, repeat)
+
+
+def time_import(module: str, repeat: int) -> float:
+    # the best of repeat fresh interpreters importing module
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    return min(float(subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True,
+                                    check=True).stdout) for _ in range(repeat))
+
+
+def import_failures(modules: tuple) -> list[str]:
+    # the modules that do not import when PyQt5 and matplotlib are missing
+    code = "import sys; sys.modules.update(dict.fromkeys(('PyQt5', 'matplotlib'))); import "
+    return [module for module in modules
+            if subprocess.run([sys.executable, "-c", code + module], cwd=HERE, capture_output=True).returncode]
+
+
+def run_startup(repeat: int) -> list[dict]:
+    rows = []
+    for module in STARTUP_MODULES:
+        rows.append({"scene": "startup", "molecules": 0, "engine": "-", "phase": "import " + module,
+                     "ms": time_import(module, repeat) * 1000})
+        print(f"import {module}: {rows[-1]['ms']:.1f} ms", flush=True)
+    return rows
+
+
+def run_scene(name: str, engines: list[str], steps: int, warmup: int, repeat: int, seed: int) -> list[dict]:
+    rows = []
+    sim = make_scene(name, np.random.default_rng(seed))
+    n = len(sim.molecules)
+    base = {"scene": name, "molecules": n}
+    for phase, seconds in time_io(sim, repeat).items():
+        rows.append({**base, "engine": "-", "phase": phase, "ms": seconds * 1000})
+    rows.append({**base, "engine": "-", "phase": "draw", "ms": time_draw(sim, repeat) * 1000})
+    for engine in engines_for(sim, engines):
+        sim = make_scene(name, np.random.default_rng(seed))
+        sim.dt = 0.02
+        sim.set_engine(engine)
+        times = {phase: [] for phase in PHASES + ("step",)}
+        for _ in range(warmup):
+            sim.step()
+        for _ in range(steps):
+            timed_step(sim, times)
+        if sim.engine:
+            sim.engine.release()
+        for phase, values in times.items():
+            if values:
+                rows.append({**base, "engine": engine, "phase": phase, "ms": float(np.median(values)) * 1000,
+                             "mean_ms": float(np.mean(values)) * 1000})
+        print(f"{name} {engine}: {rows[-1]['ms']:.2f} ms/step", flush=True)
+    return rows
+
+
+def machine() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "cpus": os.cpu_count(), "commit": commit, "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance=TOLERANCE) -> list[dict]:
+    # the rows slower than the baseline by more than tolerance
+    old = {(row["scene"], row["engine"], row["phase"]): row["ms"] for row in baseline}
+    slower = []
+    print(f"{'scene':<16}{'engine':<10}{'phase':<24}{'baseline':>10}{'now':>10}{'ratio':>8}")
+    for row in results:
+        before = old.get((row["scene"], row["engine"], row["phase"]))
+        if before is None:
+            continue
+        ratio = row["ms"] / before if before > 0 else float("inf")
+        noise = max(row["ms"], before) < NOISE_MS
+        flag = "" if noise else " slower" if ratio > tolerance else " faster" if ratio < 1 / tolerance else ""
+        print(f"{row['scene']:<16}{row['engine']:<10}{row['phase']:<24}{before:>10.2f}{row['ms']:>10.2f}{ratio:>8.2f}{flag}")
+        if ratio > tolerance and not noise:
+            slower.append({**row, "baseline_ms": before, "ratio": ratio})
+    return slower
+
+
+def fastest_engines(results: list[dict]) -> dict:
+    # scene -> the engine with the shortest step
+    best = {}
+    for row in results:
+        if row["phase"] == "step" and (row["scene"] not in best or row["ms"] < best[row["scene"]][1]):
+            best[row["scene"]] = (row["engine"], row["ms"])
+    return {scene: engine for scene, (engine, _) in best.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the physics and drawing of standard scenes.")
+    parser.add_argument("scenes", nargs="*", help="startup, gas-N, mixed-N, dumbbells-N or scene files; the suite by default")
+    parser.add_argument("--suite", choices=list(SUITES), default="quick")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=["python", "numpy", "rigid"])
+    parser.add_argument("--steps", type=int, default=20, help="timed steps per scene and engine")
+    parser.add_argument("--warmup", type=int, default=3, help="untimed steps first (compilation, caches)")
+    parser.add_argument("--repeat", type=int, default=3, help="save/load and drawing: the best of this many")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="benchmark.json", help="results as JSON")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="slowdown factor reported as a regression")
+    args = parser.parse_args(argv)
+
+    results, failures = [], []
+    for name in args.scenes or SUITES[args.suite]:
+        if name == "startup":
+            results += run_startup(args.repeat)
+            failures = import_failures(QT_FREE_MODULES)
+        else:
+            results += run_scene(name, args.engines, args.steps, args.warmup, args.repeat, args.seed)
+    report = {"machine": machine(), "steps": args.steps, "results": results, "fastest": fastest_engines(results)}
+    with open(args.out, 'w') as file:
+        json.dump(report, file, indent=1)
+    print("fastest engine:", ", ".join(f"{scene} {engine}" for scene, engine in report["fastest"].items()))
+    if failures:
+        print("not importable without PyQt5 and matplotlib:", ", ".join(failures))
+        return 1
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            slower = compare(results, json.load(file)["results"], args.tolerance)
+        if slower:
+            print(f"{len(slower)} timings slower than the baseline by more than {args.tolerance}x")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,29 +1,52 @@
 import sys
 import math
 import time
+import traceback
+from contextlib import nullcontext
 from PyQt5.QtWidgets import (
     QWidget, QPushButton, QVBoxLayout, QApplication,
-    QLabel, QFormLayout # , QMainWindow
+    QLabel, QFormLayout, QMessageBox # , QMainWindow
 )
 from PyQt5.QtGui import QPainter, QPen, QBrush, QColor
 from PyQt5.QtCore import Qt, QPointF, QTimer
 # for plots + time 
 import numpy as np
 
-from GraphMenu import ParamViewer, HistogramViewer, PlotViewer, RightMenu
-from BorderMolecules import Border, Molecule, Object, SpatialGrid
+from GraphMenu import ParamViewer, HistogramViewer, PlotViewer, PerformanceViewer, RightMenu
+from BorderMolecules import Border, Molecule, Object
 from balls import Ball
 from dumbbells import Dumbbell
+from simulation import Simulation, TRACE_LENGTH
+from profiling import PROFILE_LENGTH
+from snapshot import SNAPSHOT_SUFFIX
+from replay import Replay, SEEK_STEP
+from render import SceneRenderer
+from engine import BallArrays
+from worker import SimulationWorker
 
 
 # Constants
-TRACE_FREQUENCY = 6
 GRAPH_FREQUENCY = 100
 BORDER_WIDTH = 50
-TRACE_LENGTH = 2500
+
+
+def sim_attribute(name: str):
+    # Envelope attribute kept in its Simulation
+    return property(lambda self: getattr(self.sim, name), lambda self, value: setattr(self.sim, name, value))
 
 
 class Envelope(QWidget):
+    borders = sim_attribute("borders")
+    molecules = sim_attribute("molecules")
+    dt = sim_attribute("dt")
+    g = sim_attribute("g")
+    grid = sim_attribute("grid")
+    engine = sim_attribute("engine")
+    observables = sim_attribute("observables")
+    time_moving = sim_attribute("time_moving")
+    time_grid = sim_attribute("time_grid")
+    time_reflect = sim_attribute("time_reflect")
+
     def __init__(self, points, molecules: list[Molecule], sort_vertex=False, trace_length=TRACE_LENGTH, stack_size=100, arrow_scale=1/2):
         super().__init__()
         self.setWindowTitle("Billiard 8.5  https://t.me/SergeArl")
@@ -37,94 +60,175 @@ class Envelope(QWidget):
             if sort_vertex:
                 cx, cy = self.width() / 2, self.height() / 2  # Center of the window
                 points = sorted(points, key=lambda p: math.atan2(p.y() - cy, p.x() - cx))
-            self.borders = [Border(points[i], points[(i + 1) % len(points)], stack_size=stack_size) for i in range(len(points))]
+            borders = [Border(points[i], points[(i + 1) % len(points)], stack_size=stack_size) for i in range(len(points))]
         else:
-            self.borders = []
-            
-        self.molecules = molecules    
-        # ==== cell size calculation ========
-        # ("grid...")
-        self.grid = SpatialGrid(self.width(), self.height(), self.cell_size())
+            borders = []
+        self.sim = Simulation(borders, molecules, trace_length)
 
         # ==== moving parameters =========
+        self.worker = None      # SimulationWorker when the physics runs on its own thread
+        self.display = None     # BallArrays drawn while the worker steps, see make_display
         self.is_running = False  # State toggle on click
         
-        self.trace_count = 0
-        self.trace_length = trace_length
-        self.dt = 0.05  # default value of dt, specify in start_moving(dt)
-        self.g = 0.
         self.skip_draw_count = 0
         self.skip_draw = 1
         self.timer = QTimer()
         # =========== for buttons and graphics =========
         # print("menu...")
-        self.right_menu = RightMenu(self)
+        self._right_menu = None     # RightMenu, made with the first button
         
         self.param_viewer = None
         self.histogram_viewer = None
         # self.graph_counter = 0
         self.plot_viewer = None       # PlotViewer(100, "test", lambda: math.sin(1), (0, 500), (-2,2))
+        self.performance_viewer = None
         self.file_number = 0
+        self.replay = None      # Replay while a recorded trajectory is played back
+        self.renderer = SceneRenderer()     # None: every molecule draws itself
         
         # =========== temporary for timing =============
-        self.time_moving = 0.
-        self.time_grid = 0.
-        # self.time_check = 0.
-        self.time_reflect = 0.
+        # time_moving, time_grid and time_reflect are kept in self.sim
         self.time_drawing = 0.
         # ==============================================
         self.show()
 
-    def cell_size(self):
-        if len(self.molecules) > 0:
-            bounds = [molecule.get_bounds() for molecule in self.molecules]
-            average_x = 2 * sum([bnd[2] - bnd[0] for bnd in bounds]) / len(self.molecules)
-            average_y = 2 * sum([bnd[3] - bnd[1] for bnd in bounds]) / len(self.molecules)
-            return max([(self.width() * self.height() / len(self.molecules)) ** (1/2), 2 * average_x, 2 * average_y])
-        else:
-            return min([self.width(), self.height()])
+    @property
+    def right_menu(self) -> RightMenu:
+        if self._right_menu is None:
+            self._right_menu = RightMenu(self)
+        return self._right_menu
 
-    def start_moving(self, dt: float, g=0., skip_draw = 1):
+    @property
+    def is_running(self) -> bool:
+        return self._is_running
+
+    @is_running.setter
+    def is_running(self, value: bool):
+        self._is_running = value
+        if self.worker:
+            if value:
+                self.worker.running.set()
+            else:
+                self.worker.running.clear()
+
+    def start_moving(self, dt: float, g=0., skip_draw = 1, engine="python", threaded=False, ratio=None, fps=60, skin=None,
+                     adaptive=False, substeps=0, tune=False):
+        # threaded=True: the physics runs on a worker thread, as fast as it can or at ratio simulation
+        # seconds per real second, and the window is redrawn fps times per second;
+        # skin: Verlet neighbour lists, see Simulation.set_skin; adaptive: steps of at most dt, see Simulation.set_adaptive;
+        # tune: timed tuning of the grid cell, see Simulation.set_tuning
         self.g = g
         self.dt = dt
         self.skip_draw = skip_draw
+        self.sim.set_skin(skin)
+        self.sim.set_tuning(tune)
+        self.sim.set_engine(engine)
+        self.sim.set_adaptive(adaptive, substeps=substeps)
+        if threaded:
+            self.worker = SimulationWorker(self.sim, ratio)
+            self.make_display()
+            self.worker.start()
+            self.is_running = self.is_running
+            self.timer.timeout.connect(self.update_frame)
+            self.timer.start(int(1000 / fps))  # ms
+            return
         self.timer.timeout.connect(self.update_simulation)
         self.timer.start(int(dt*1000))  # ms
 
+    def physics_lock(self):
+        # held while the GUI reads or changes the simulation
+        return self.worker.lock if self.worker else nullcontext()
+
+    def make_display(self):
+        # the GUI's own copy of the balls: the worker's captures are copied into it
+        with self.worker.lock:
+            capture = self.worker.capture
+            columns = capture.columns()
+            snapshot = capture.capture() + (self.sim.time, self.sim.steps)
+        colors = columns.pop("colors")
+        self.display = BallArrays.from_columns(colors, **dict(zip(("x", "y", "v_x", "v_y"), snapshot[:4])), **columns)
+        self.display_traced = [self.display.balls[k] for k in capture.traced]
+        self.display_time = snapshot[5]
+        self.apply_snapshot(snapshot)
+
+    def apply_snapshot(self, snapshot: tuple):
+        state = self.display
+        state.x[:], state.y[:], state.v_x[:], state.v_y[:] = snapshot[:4]
+        for ball, points in zip(self.display_traced, snapshot[4]):
+            if ball.path.capacity != self.sim.trace_length:
+                ball.path.resize(self.sim.trace_length)
+            for point in points:
+                ball.path.append(point)
+        self.display_time = snapshot[5]
+
+    def update_frame(self):
+        if self.worker.error:
+            # a failed step stops the run; raised in a Qt slot it would abort the application
+            error, self.worker.error = self.worker.error, None
+            self.timer.stop()
+            self.is_running = False
+            traceback.print_exception(error)
+            QMessageBox.critical(self, "Simulation stopped", f"{type(error).__name__}: {error}")
+            return
+        snapshot = self.worker.take()
+        if snapshot is None:
+            return
+        sim_dt = snapshot[5] - self.display_time
+        self.apply_snapshot(snapshot)
+        with self.worker.lock:
+            self.update_presentation(sim_dt)
+
+    def start_replay(self, directory: str, speed=1., skip_draw=1, interval=0.03):
+        # play back a trajectory instead of simulating: click - pause, arrows - seek, +/- - speed
+        self.replay = Replay(directory, speed, self.sim.trace_length)
+        self.sim.borders, self.sim.molecules = self.replay.borders, self.replay.molecules
+        self.skip_draw = skip_draw
+        self.last_tick = time.perf_counter()
+        self.right_menu.add_button("<<", lambda: self.seek_replay(-SEEK_STEP))
+        self.right_menu.add_button(">>", lambda: self.seek_replay(SEEK_STEP))
+        self.right_menu.add_button("Slower", lambda: self.replay.slower())
+        self.right_menu.add_button("Faster", lambda: self.replay.faster())
+        self.set_geometry()
+        self.timer.timeout.connect(self.update_replay)
+        self.timer.start(int(interval*1000))  # ms
+
+    def update_replay(self):
+        now = time.perf_counter()
+        wall_dt, self.last_tick = now - self.last_tick, now
+        self.setWindowTitle("Replay " + self.replay.position())
+        if self.is_running and self.replay.advance(wall_dt):
+            self.observables.invalidate()     # the replay moves the molecules, not the simulation steps
+            self.update_presentation()
+
+    def seek_replay(self, dt: float):
+        self.replay.seek_time(self.replay.time + dt * self.replay.speed)
+        self.update()
+
+    def keyPressEvent(self, event):
+        if self.replay is None:
+            return super().keyPressEvent(event)
+        key = event.key()
+        if key == Qt.Key_Space:
+            self.is_running = not self.is_running
+        elif key == Qt.Key_Left:
+            self.seek_replay(-SEEK_STEP)
+        elif key == Qt.Key_Right:
+            self.seek_replay(SEEK_STEP)
+        elif key == Qt.Key_Home:
+            self.replay.seek(0)
+        elif key == Qt.Key_End:
+            self.replay.seek(len(self.replay) - 1)
+        elif key in (Qt.Key_Plus, Qt.Key_Equal):
+            self.replay.faster()
+        elif key == Qt.Key_Minus:
+            self.replay.slower()
+        self.observables.invalidate()
+        self.update()
+
     def update_simulation(self):
         if not self.is_running:
             return
-        self.trace_count = (self.trace_count + 1) % TRACE_FREQUENCY
-        add_trace = True if self.trace_count == 0 else False
-
-        # 1st timer
-        # print("first timer")
-        time_moving_start = time.perf_counter()
-        for molecule in self.molecules:
-            molecule.move(self.dt, add_trace, self.g, self.trace_length)
-        self.time_moving += time.perf_counter() - time_moving_start
-
-        # construct of grid
-        # print("start grid")
-        time_check_grid = time.perf_counter()
-        self.grid.clear()
-        for obj in self.molecules + self.borders:
-            self.grid.add_object(obj)
-        collisions = self.grid.get_possible_collisions()
-        touch_objects = []
-        # print("start grid_check len = ", len(collisions))
-        for pair in collisions:
-            if pair[0].touch(pair[1]):
-                    touch_objects.append(pair)
-        self.time_grid += time.perf_counter() - time_check_grid
-        
-        time_reflect_start = time.perf_counter()
-        [pair[0].reflect(pair[1]) for pair in touch_objects]
-        self.time_reflect += time.perf_counter() - time_reflect_start
-        # print("borders next")
-        for brd in self.borders:
-            brd.next_time(self.dt)
-        # print("drawing...")
+        self.sim.step()
         # update parameters and graphics    
         self.update_presentation()
         
@@ -139,14 +243,24 @@ class Envelope(QWidget):
 
         # Draw molecules and possibly velocity arrows
         # print("draw molecules")
-        for molecule in self.molecules:
-            molecule.draw(painter)
-            if not self.is_running:
+        molecules = self.display.balls if self.display else self.molecules
+        if self.renderer:
+            self.renderer.draw(painter, molecules)
+        else:
+            for molecule in molecules:
+                molecule.draw(painter)
+        if not self.is_running:
+            for molecule in molecules:
                 molecule.draw_velocity(painter, self.arrow_scale)
-        self.time_drawing += time.perf_counter() - time_drawing_start
+        time_drawing_end = time.perf_counter()
+        self.time_drawing += time_drawing_end - time_drawing_start
+        if self.sim.profiler:
+            self.sim.profiler.record_frame(time_drawing_start, time_drawing_end)
 
     def mousePressEvent(self, event):
         self.is_running = not self.is_running
+        if self.worker and not self.timer.isActive():
+            self.timer.start()     # stopped by a failed step
         self.update()
 
     def set_geometry(self):
@@ -154,7 +268,7 @@ class Envelope(QWidget):
         if len(bnd) == 0:
             bnd = [(0, 0, 0, 0)]       
         self.setGeometry(int(min([b[0] for b in bnd])) - BORDER_WIDTH, int(min([b[1] for b in bnd])),
-                         int(max([b[2] for b in bnd])) + BORDER_WIDTH + self.right_menu.width(),
+                         int(max([b[2] for b in bnd])) + BORDER_WIDTH + (self._right_menu.width() if self._right_menu else 0),
                          int(max([b[3] for b in bnd])) + BORDER_WIDTH)
 
     def add_param_button(self, label: str, param_funcs: list[tuple[str, callable]]):
@@ -166,6 +280,19 @@ class Envelope(QWidget):
         self.right_menu.add_button(label, on_click)
         self.set_geometry()
 
+    def add_performance_button(self, label="Performance", path="profile", length=PROFILE_LENGTH):
+        # the simulation is profiled from the first click on, see profiling.py; the panel exports to path.*
+        def on_click():
+            if self.sim.profiler is None:
+                with self.physics_lock():
+                    self.sim.start_profiling(length)
+            if self.performance_viewer is None:
+                self.performance_viewer = PerformanceViewer(self, path)
+            self.performance_viewer.show()
+            self.performance_viewer.raise_()
+        self.right_menu.add_button(label, on_click)
+        self.set_geometry()
+
     def add_histogram_button(self, label: str, histogram_func: callable, skip=GRAPH_FREQUENCY):
         def on_click():
             if self.histogram_viewer is None:
@@ -184,7 +311,8 @@ class Envelope(QWidget):
         self.right_menu.add_button(label, on_click)
         self.set_geometry()
         
-    def update_presentation(self):
+    def update_presentation(self, dt=None):
+        # dt: simulation time since the last call, one step by default
         # print("start update")
         self.skip_draw_count += 1
         if self.skip_draw_count >= self.skip_draw:
@@ -193,32 +321,25 @@ class Envelope(QWidget):
             # parameters and graph output        
             if self.param_viewer:
                 self.param_viewer.update_parameters()
+            if self.performance_viewer:
+                self.performance_viewer.update_performance()
                 
         if self.plot_viewer:
-            self.plot_viewer.update(self.dt)
+            self.plot_viewer.update(self.sim.last_dt if dt is None else dt)
         if self.histogram_viewer:
             self.histogram_viewer.update_distribution()
         
-    def add_save_button(self, file_name: str, file_number=0):
+    def add_save_button(self, file_name: str, file_number=0, binary=False):
+        # binary=True: the scene is saved as a .snap snapshot
         self.file_number = file_number
         def save_to_file():
             self.is_running = False
             # print("file number:", self.file_number)
-            with open(file_name + str(self.file_number) + ".txt", 'w') as file:
-                for bord in self.borders:
-                    red, green, blue, a = QColor(bord.color).getRgb()
-                    file.write(f"Border {red} {green} {blue} {a} {int(bord.teflon)} {bord.p1.x()} {bord.p1.y()} {bord.p2.x()} {bord.p2.y()} {bord.stack_size}\n")
-                for mol in self.molecules:
-                    kind = type(mol).__name__
-                    red, green, blue, a = QColor(mol.color).getRgb()
-                    base = f"{red} {green} {blue} {a} {int(mol.teflon)} {mol.x} {mol.y} {mol.v_x} {mol.v_y} {int(mol.trace)}"
-                    
-                    if kind == "Ball":
-                        file.write(f"Ball {base} {mol.m} {mol.r}\n")
-                    elif kind == "Dummbell":
-                        file.write(f"Dummbell {base} {m.d}\n")
-                    else:
-                        file.write(f"Molecule {base}\n")
+            with self.physics_lock():
+                if binary:
+                    self.sim.save_snapshot(file_name + str(self.file_number) + SNAPSHOT_SUFFIX)
+                else:
+                    self.sim.save_to_file(file_name + str(self.file_number) + ".txt")
             self.file_number += 1
             sender = self.sender()  # Get the button that sent the signal
             self.update()
@@ -229,28 +350,38 @@ class Envelope(QWidget):
         self.right_menu.add_button("Save" + file_name + str(self.file_number), save_to_file)
         self.set_geometry()
 
+    def add_record_button(self, directory: str, every=1):
+        # toggles recording of a trajectory into directory (trajectory.py)
+        def on_click():
+            sender = self.sender()
+            if self.sim.recorders:
+                with self.physics_lock():
+                    self.sim.stop_recording()
+                if sender:
+                    sender.setText("Record")
+            else:
+                with self.physics_lock():
+                    self.sim.start_recording(directory, every)
+                if sender:
+                    sender.setText("Stop")
+        self.right_menu.add_button("Record", on_click)
+        self.set_geometry()
+
+    def closeEvent(self, event):
+        if self.worker:
+            self.worker.stop()
+        self.sim.stop_recording()
+        super().closeEvent(event)
+
     def load_from_file(self, file_name: str):
         self.is_running = False
-        self.borders.clear()
-        self.molecules.clear()
-        with open(file_name + ".txt", 'r') as file:
-            for line in file:
-                kind, red, green, blue, a, teflon, *other = line.strip().split()
-                clr = QColor(int(red), int(green), int(blue), int(a))
-                
-                if kind == "Border":
-                    x1, y1, x2, y2, stack_size = other
-                    self.borders.append(Border(QPointF(int(float(x1)), int(float(y1))), QPointF(int(float(x2)), int(float(y2))), \
-                                                   clr, teflon=bool(int(teflon)), stack_size=int(stack_size)))
-                elif kind == "Ball":
-                    x, y, v_x, v_y, trace, m, r = other
-                    self.molecules.append(Ball(float(m), float(r), float(x), float(y),
-                                                       float(v_x), float(v_y), clr, bool(int(teflon)), bool(int(trace))))
-                elif kind == "Dummbell":
-                    pass
-                    
+        with self.physics_lock():
+            self.sim.load_from_file(file_name)
+            if self.worker:
+                self.worker.reset()
+        if self.worker:
+            self.make_display()
         self.set_geometry()
-        self.grid = SpatialGrid(self.width(), self.height(), self.cell_size())
         self.update()
         
     # def add_load_button(self, file_name: str):
@@ -285,6 +416,7 @@ if __name__ == '__main__':
         )
 
     window.add_save_button("FourBalls")
+    window.add_performance_button()
     
     window.start_moving(dt=0.03, g=10, skip_draw=2)
     sys.exit(app.exec_())
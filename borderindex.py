@@ -0,0 +1,76 @@
+""" Static index of border segments: per-cell segment lists in CSR form, built once for a container
+    and queried by points, so the ball-wall broad phase does not grow with the number of walls """
+import math
+import numpy as np
+
+MAX_CELLS = 1 << 20     # coarser cells for huge containers
+EMPTY_PAIRS = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+
+def segment_distance(px: np.ndarray, py: np.ndarray, x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    # distance from points to segments, elementwise
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    t = np.clip(((px - x1) * dx + (py - y1) * dy) / np.where(length2 > 0, length2, 1), 0, 1)
+    return np.hypot(px - x1 - t * dx, py - y1 - t * dy)
+
+
+class BorderIndex:
+    """ segment k is listed in every cell with a point within `reach` of it; a point asking for
+        at most `reach` gets the segments of its cell, a point asking for more is checked against
+        all segment bounds """
+    def __init__(self, x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray, reach: float, cell=None):
+        self.x1, self.y1, self.x2, self.y2 = (np.asarray(a, dtype=np.float64) for a in (x1, y1, x2, y2))
+        self.reach = reach
+        self.min_x, self.max_x = np.minimum(self.x1, self.x2), np.maximum(self.x1, self.x2)
+        self.min_y, self.max_y = np.minimum(self.y1, self.y2), np.maximum(self.y1, self.y2)
+        if len(self.x1) == 0:
+            self.cols = self.rows = 0
+            self.start, self.segments = np.zeros(1, dtype=np.int64), EMPTY_PAIRS[0]
+            return
+        self.x0, self.y0 = float(self.min_x.min()) - reach, float(self.min_y.min()) - reach
+        width, height = float(self.max_x.max()) + reach - self.x0, float(self.max_y.max()) + reach - self.y0
+        cell = max(cell or reach, math.sqrt(width * height / MAX_CELLS), 1e-9)
+        self.cell = cell
+        self.cols, self.rows = int(width // cell) + 1, int(height // cell) + 1
+
+        # the cells of every widened segment bounds, then only those whose centre is near enough
+        col0 = ((self.min_x - reach - self.x0) // cell).astype(np.int64)
+        row0 = ((self.min_y - reach - self.y0) // cell).astype(np.int64)
+        ncol = ((self.max_x + reach - self.x0) // cell).astype(np.int64) - col0 + 1
+        nrow = ((self.max_y + reach - self.y0) // cell).astype(np.int64) - row0 + 1
+        count = ncol * nrow
+        segment = np.repeat(np.arange(len(count)), count)
+        local = np.arange(int(count.sum())) - np.repeat(np.cumsum(count) - count, count)
+        col, row = col0[segment] + local % ncol[segment], row0[segment] + local // ncol[segment]
+        distance = segment_distance(self.x0 + (col + 0.5) * cell, self.y0 + (row + 0.5) * cell, self.x1[segment],
+                                    self.y1[segment], self.x2[segment], self.y2[segment])
+        near = distance <= reach + cell * math.sqrt(0.5)
+        key = row[near] * self.cols + col[near]
+        order = np.argsort(key, kind="stable")
+        self.segments = segment[near][order]
+        self.start = np.concatenate(([0], np.cumsum(np.bincount(key, minlength=self.rows * self.cols))))
+
+    def __len__(self):
+        return len(self.x1)
+
+    def candidates(self, x: np.ndarray, y: np.ndarray, reach: np.ndarray):
+        # pairs (point, segment) covering every segment within reach of a point
+        if len(self.x1) == 0 or len(x) == 0:
+            return EMPTY_PAIRS
+        col = np.floor((x - self.x0) / self.cell)
+        row = np.floor((y - self.y0) / self.cell)
+        small = reach <= self.reach
+        point = np.nonzero(small & (col >= 0) & (col < self.cols) & (row >= 0) & (row < self.rows))[0]
+        key = row[point].astype(np.int64) * self.cols + col[point].astype(np.int64)
+        begin, count = self.start[key], self.start[key + 1] - self.start[key]
+        total = int(count.sum())
+        first = [np.repeat(point, count)]
+        second = [self.segments[np.repeat(begin, count) + np.arange(total) - np.repeat(np.cumsum(count) - count, count)]]
+        for n in np.nonzero(~small)[0].tolist():
+            # far-reaching points: the widened bounds of all segments
+            near = np.nonzero((x[n] + reach[n] >= self.min_x) & (x[n] - reach[n] <= self.max_x) &
+                              (y[n] + reach[n] >= self.min_y) & (y[n] - reach[n] <= self.max_y))[0]
+            first.append(np.full(len(near), n, dtype=np.int64))
+            second.append(near)
+        return np.concatenate(first), np.concatenate(second)
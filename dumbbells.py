@@ -1,6 +1,4 @@
-from PyQt5.QtGui import QPainter, QPen, QBrush
-from PyQt5.QtCore import Qt, QPointF
-from PyQt5.QtGui import QPainter
+from qtcompat import Qt, QPainter
 from BorderMolecules import Border, Molecule, Object
 from balls import Ball
 import math
@@ -8,7 +6,6 @@ import math
 
 class Dumbbell(Molecule):
     def set_balls_v(self):
-        print("dumbb. set v")
         dx = (self.balls[1].x - self.balls[0].x)
         dy = (self.balls[1].y - self.balls[0].y)
         
@@ -22,12 +19,10 @@ class Dumbbell(Molecule):
         self.v_y = (self.balls[0].m * self.balls[0].v_y + self.balls[1].m * self.balls[1].v_y) / (self.balls[0].m + self.balls[1].m)
 
         self.Lz = self.mu * ( dy * (self.balls[1].v_x - self.balls[0].v_x) - dx * (self.balls[1].v_y - self.balls[0].v_y) )
-        print("dp, Lz:", dp, self.Lz)
 
 
     def set_sin_cos(self, dt: float):
         dphi = dt * self.Lz / self.I
-        print("dphi", dphi)
         self.dcos = math.cos(dphi)
         self.dsin = math.sin(dphi)
         self.moving = True
@@ -39,9 +34,11 @@ class Dumbbell(Molecule):
         d2 = dx * dx + dy * dy
         self.d = d2 ** (1/2)
         self.I = self.mu * d2
+        # the ends from the centre of mass, in units of the end-to-end vector
+        self.c1, self.c2 = self.mu / ball0.m, self.mu / ball1.m
         cm_x, cm_y = (ball0.m * ball0.x + ball1.m * ball1.x) / (ball0.m + ball1.m), (ball0.m * ball0.y + ball1.m * ball1.y) / (ball0.m + ball1.m)
         #print("dumbbell base class...") 
-        super().__init__(cm_x, cm_y, trace=trace)
+        super().__init__(cm_x, cm_y, teflon=teflon, trace=trace)
         self.dcos = 1.
         self.dsin = 0.
         self.Lz = 0.
@@ -55,10 +52,8 @@ class Dumbbell(Molecule):
             self.set_sin_cos(dt)
         
         super().move(dt, add_trace, g, trace_length)
-        
-        c1 =  self.mu / self.balls[0].m
-        c2 =  self.mu / self.balls[1].m
-        
+
+        c1, c2 = self.c1, self.c2
         dx = self.balls[1].x - self.balls[0].x
         dy = self.balls[1].y - self.balls[0].y
         # dphi = dt * self.Lz / self.I
@@ -81,12 +76,10 @@ class Dumbbell(Molecule):
         #print("ball1 res", self.balls[1].touch(other))
         ret = self.balls[0].touch(other) or self.balls[1].touch(other)
         if ret:
-            print("Dumbbell touch", ret)
             self.moving = False
         return ret
 
     def reflect(self, other: Object):
-        print("Dumbbell reflect")
         self.set_balls_v()
         self.moving = True
 
@@ -111,7 +104,6 @@ class Dumbbell(Molecule):
         self.balls[1].draw(painter)
 
     def draw_velocity(self, painter: QPainter, scale=0.5):
-        print("v_draw start")
         super().draw_velocity(painter, scale)
         self.balls[0].draw_velocity(painter, scale)
         self.balls[1].draw_velocity(painter, scale)
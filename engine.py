@@ -0,0 +1,572 @@
+""" Structure-of-arrays engine: Ball state in NumPy arrays, one batched step per tick """
+from collections.abc import Sequence
+import time
+import numpy as np
+from ringbuffer import RingBuffer
+
+from BorderMolecules import Border
+from balls import Ball
+from borderindex import BorderIndex
+import narrow
+
+BALL_FIELDS = ("x", "y", "v_x", "v_y", "m", "r", "teflon", "trace")
+MAX_CELLS_PER_BALL = 8   # dense cell table while the grid is not much larger than the ball count
+MAX_LARGE_BALLS = 32     # so few balls of the coarsest grid levels are checked against everything
+CELL_FACTOR = 2.         # finest grid cell in median ball diameters, tuned during a run if tuning is on
+MIN_CELL_FACTOR, MAX_CELL_FACTOR = 1., 8.
+TUNE_PERIOD = 200        # steps between two trials of the cell size
+TUNE_STEP = 1.25         # the trials: the cell factor this much smaller and larger
+ARRAY_MAX_STRAYS = 32    # balls that left their Verlet skin checked one by one before the lists are rebuilt (numpy engines)
+EMPTY_PAIRS = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+
+_view_classes = {}
+
+
+def _array_property(name: str):
+    def getter(self):
+        return getattr(self.state, name)[self.index].item()
+
+    def setter(self, value):
+        getattr(self.state, name)[self.index] = value
+    return property(getter, setter)
+
+
+def view_class(cls: type) -> type:
+    # subclass of cls whose fields are rows of the state arrays; unbound objects keep plain attributes
+    cls = getattr(cls, "view_base", cls)
+    if cls not in _view_classes:
+        fields = {name: _array_property(name) for name in BALL_FIELDS}
+        _view_classes[cls] = type(cls.__name__, (cls,), {"view_base": cls, **fields})
+    return _view_classes[cls]
+
+
+class BallArrays:
+    """ contiguous x, y, v_x, v_y, m, r, teflon, trace of a list of balls; the balls become views onto the rows """
+    def __init__(self, balls: list[Ball]):
+        self.balls = list(balls)
+        for ball in self.balls:
+            if not isinstance(ball, Ball):
+                raise ValueError("array engine supports only Ball molecules, got " + type(ball).__name__)
+        n = len(self.balls)
+        self.x = np.fromiter((b.x for b in self.balls), dtype=np.float64, count=n)
+        self.y = np.fromiter((b.y for b in self.balls), dtype=np.float64, count=n)
+        self.v_x = np.fromiter((b.v_x for b in self.balls), dtype=np.float64, count=n)
+        self.v_y = np.fromiter((b.v_y for b in self.balls), dtype=np.float64, count=n)
+        self.m = np.fromiter((b.m for b in self.balls), dtype=np.float64, count=n)
+        self.r = np.fromiter((b.r for b in self.balls), dtype=np.float64, count=n)
+        self.teflon = np.fromiter((b.teflon for b in self.balls), dtype=bool, count=n)
+        self.trace = np.fromiter((b.trace for b in self.balls), dtype=bool, count=n)
+        for i, ball in enumerate(self.balls):
+            self.bind(ball, i)
+
+    @classmethod
+    def from_columns(cls, colors: np.ndarray, **columns):
+        # state copied from (possibly memory-mapped) columns; the balls are BallViews made on demand
+        state = cls.__new__(cls)
+        for name in BALL_FIELDS:
+            setattr(state, name, np.array(columns[name], dtype=bool if name in ("teflon", "trace") else np.float64))
+        state.balls = BallViews(state, colors)
+        return state
+
+    def __len__(self):
+        return len(self.x)
+
+    def bind(self, ball: Ball, index: int):
+        for name in BALL_FIELDS:
+            ball.__dict__.pop(name, None)
+        ball.state, ball.index = self, index
+        ball.__class__ = view_class(type(ball))
+
+    def traced(self) -> list[Ball]:
+        return [self.balls[i] for i in np.nonzero(self.trace)[0].tolist()]
+
+    def release(self):
+        # turn the views back into plain objects holding their current values;
+        # BallViews own their state and stay views
+        if isinstance(self.balls, BallViews):
+            return
+        for ball in self.balls:
+            values = {name: getattr(ball, name) for name in BALL_FIELDS}
+            ball.__class__ = type(ball).view_base
+            del ball.state, ball.index
+            ball.__dict__.update(values)
+        self.balls = []
+
+
+class BallViews(Sequence):
+    """ read-only list of Ball views over the rows of a BallArrays, each view is made on first access,
+        so a million-ball scene loads without a million Python objects """
+    def __init__(self, state: BallArrays, colors: np.ndarray):
+        self.state = state
+        self.colors = colors        # (n, 4) rgba
+        self.views = {}
+
+    def __len__(self):
+        return len(self.state)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("ball index out of range")
+        view = self.views.get(index)
+        if view is None:
+            view = object.__new__(view_class(Ball))
+            view.state, view.index = self.state, index
+            view.color = tuple(self.colors[index].tolist())     # rgba, made a QColor when drawn
+            view.path, view.neighbours = RingBuffer(shape=(2,)), []
+            self.views[index] = view
+        return view
+
+
+class BallColumns(Ball):
+    """ all balls of a state at once: the fields are the state columns, so the Ball formulas
+        (M, W, P_x, ...) give arrays """
+    def __init__(self, state: BallArrays):
+        for name in BALL_FIELDS:
+            setattr(self, name, getattr(state, name))
+
+
+def molecule_columns(molecules, engine=None):
+    # BallColumns of the molecules if they are array-backed balls, else None
+    if isinstance(molecules, BallViews):
+        return BallColumns(molecules.state)
+    state = getattr(engine, "balls", None)
+    if isinstance(state, BallArrays) and len(state) == len(molecules):
+        return BallColumns(state)
+    return None
+
+
+def ball_arrays(molecules) -> BallArrays:
+    # lazily loaded scenes already are array state
+    if isinstance(molecules, BallViews):
+        return molecules.state
+    return BallArrays(molecules)
+
+
+def cell_pairs(x: np.ndarray, y: np.ndarray, cell: float):
+    # candidate pairs (i, j) of points in the same or neighbouring cells, each pair once:
+    # points are counting-sorted by cell key and only the half-neighbourhood (E, SW, S, SE) is scanned
+    n = len(x)
+    if n < 2:
+        return EMPTY_PAIRS
+    cx = ((x - x.min()) // cell).astype(np.int64) + 1
+    cy = ((y - y.min()) // cell).astype(np.int64)
+    cols = int(cx.max()) + 2
+    key = cy * cols + cx
+    order = np.argsort(key)
+    skey = key[order]
+    position = np.arange(n)
+    offsets = np.array([1, cols - 1, cols, cols + 1])
+    target = (skey[None, :] + offsets[:, None]).ravel()
+    if skey[-1] + cols + 2 <= MAX_CELLS_PER_BALL * n:
+        # dense table of cell runs
+        count = np.bincount(skey, minlength=int(skey[-1]) + cols + 2)
+        start = np.cumsum(count) - count
+        begin, length = start[target], count[target]
+        run_end = start[skey] + count[skey]
+    else:
+        # sparse: binary search among the occupied cells
+        first = np.concatenate(([0], np.flatnonzero(skey[1:] != skey[:-1]) + 1))
+        cells, count = skey[first], np.diff(np.append(first, n))
+        idx = np.searchsorted(cells, target)
+        idx[idx == len(cells)] = 0
+        begin, length = first[idx], np.where(cells[idx] == target, count[idx], 0)
+        run_end = np.repeat(first + count, count)
+    # same cell: only later points of the sorted run
+    begin = np.concatenate((position + 1, begin))
+    length = np.concatenate((run_end - position - 1, length))
+    total = int(length.sum())
+    if total == 0:
+        return EMPTY_PAIRS
+    shift = np.repeat(np.cumsum(length) - length, length)
+    second = np.repeat(begin, length) + np.arange(total) - shift
+    first = np.repeat(np.tile(position, 5), length)
+    return order[first], order[second]
+
+
+def cross_pairs(xa: np.ndarray, ya: np.ndarray, xb: np.ndarray, yb: np.ndarray, cell: float):
+    # candidate pairs (a, b) of a point of A and a point of B in the same or neighbouring cells:
+    # B is counting-sorted by cell key, every point of A looks up its 3 x 3 cells
+    if len(xa) == 0 or len(xb) == 0:
+        return EMPTY_PAIRS
+    x0, y0 = min(xa.min(), xb.min()), min(ya.min(), yb.min())
+    cols = int((max(xa.max(), xb.max()) - x0) // cell) + 3
+    key_a = ((ya - y0) // cell).astype(np.int64) * cols + ((xa - x0) // cell).astype(np.int64) + cols + 1
+    key_b = ((yb - y0) // cell).astype(np.int64) * cols + ((xb - x0) // cell).astype(np.int64) + cols + 1
+    order = np.argsort(key_b)
+    skey = key_b[order]
+    first = np.concatenate(([0], np.flatnonzero(skey[1:] != skey[:-1]) + 1))
+    cells, count = skey[first], np.diff(np.append(first, len(skey)))
+    offsets = np.array([-cols - 1, -cols, -cols + 1, -1, 0, 1, cols - 1, cols, cols + 1])
+    target = (key_a[None, :] + offsets[:, None]).ravel()
+    idx = np.searchsorted(cells, target)
+    idx[idx == len(cells)] = 0
+    begin, length = first[idx], np.where(cells[idx] == target, count[idx], 0)
+    total = int(length.sum())
+    if total == 0:
+        return EMPTY_PAIRS
+    shift = np.repeat(np.cumsum(length) - length, length)
+    second = np.repeat(begin, length) + np.arange(total) - shift
+    return np.repeat(np.tile(np.arange(len(xa)), 9), length), order[second]
+
+
+def ball_levels(r: np.ndarray, cell: float) -> np.ndarray:
+    # level k: diameters up to cell * 2**k
+    level = np.ceil(np.log2(np.maximum(2 * r / cell, 1))).astype(np.int64)
+    level += 2 * r > cell * 2.0 ** level       # rounding of log2
+    return level
+
+
+def near_pairs(x: np.ndarray, y: np.ndarray, r: np.ndarray, few: np.ndarray, margin=0.):
+    # every ball near one of the few given balls
+    first, second = [EMPTY_PAIRS[0]], [EMPTY_PAIRS[1]]
+    for k in few:
+        reach = r[k] + r + margin
+        near = (np.abs(x - x[k]) <= reach) & (np.abs(y - y[k]) <= reach)
+        near[few[few <= k]] = False    # pairs among the few once, no self pairs
+        idx = np.nonzero(near)[0]
+        first.append(np.full(len(idx), k, dtype=np.int64))
+        second.append(idx)
+    return np.concatenate(first), np.concatenate(second)
+
+
+def level_pairs(x: np.ndarray, y: np.ndarray, r: np.ndarray, cell: float, margin=0., skip_first=False):
+    # multi-level grid: the balls of level k in cells of cell * 2**k, so big balls do not put many
+    # small ones into one cell. Pairs within a level come from cell_pairs, pairs across levels from
+    # cross_pairs in the grid of the coarser one; the coarsest levels, if they hold at most
+    # MAX_LARGE_BALLS, go to near_pairs instead. skip_first: without the pairs within level 0
+    level = ball_levels(r, cell)
+    count = np.bincount(level)
+    few = np.cumsum(count[::-1])[::-1] <= MAX_LARGE_BALLS     # level k and coarser hold few balls
+    few[0] = False
+    grid_levels = int(np.argmax(few)) if few.any() else len(count)
+    members = [np.nonzero(level == k)[0] for k in range(grid_levels)]
+    first, second = [EMPTY_PAIRS[0]], [EMPTY_PAIRS[1]]
+    if grid_levels < len(count):
+        i, j = near_pairs(x, y, r, np.nonzero(level >= grid_levels)[0], margin)
+        first.append(i)
+        second.append(j)
+    for k, fine in enumerate(members):
+        if len(fine) == 0:
+            continue
+        if k or not skip_first:
+            i, j = cell_pairs(x[fine], y[fine], cell * 2**k + margin)
+            first.append(fine[i])
+            second.append(fine[j])
+        for m in range(k + 1, len(members)):
+            coarse = members[m]
+            i, j = cross_pairs(x[fine], y[fine], x[coarse], y[coarse], cell * 2**m + margin)
+            first.append(fine[i])
+            second.append(coarse[j])
+    return np.concatenate(first), np.concatenate(second)
+
+
+def conflict_free(a: np.ndarray, b=None):
+    # split ordered pair indices into batches in which every ball occurs at most once;
+    # applying the batches one by one gives the same result as the sequential loop
+    remaining = np.arange(len(a))
+    while len(remaining):
+        ra = a[remaining]
+        rb = ra if b is None else b[remaining]
+        k = np.arange(len(remaining))
+        first = np.full(int(max(ra.max(), rb.max())) + 1, len(k))
+        np.minimum.at(first, ra, k)
+        np.minimum.at(first, rb, k)
+        selected = (first[ra] == k) & (first[rb] == k)
+        yield remaining[selected]
+        remaining = remaining[~selected]
+
+
+def canonical_touches(i: np.ndarray, j: np.ndarray, bi: np.ndarray, bk: np.ndarray):
+    # sorted (i < j) pairs: the order, and so the result of reflect, does not depend on the broad phase
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    order = np.lexsort((j, i))
+    order_b = np.lexsort((bk, bi))
+    return i[order], j[order], bi[order_b], bk[order_b]
+
+
+class ArrayEngine:
+    """ batched move / collision / reflection over BallArrays, same math as Ball.touch and Ball.reflect """
+    def __init__(self, molecules: list[Ball], borders: list[Border], cell_size=None, narrow_phase="auto", skin=None):
+        # narrow_phase: "numpy" - vectorized, "compiled" - the loops of narrow.py (numba or plain Python),
+        # "auto" - compiled when numba is installed; skin: Verlet lists with this skin, None - a new
+        # broad phase every step
+        if narrow_phase not in ("auto", "numpy", "compiled"):
+            raise ValueError(f"unknown narrow phase {narrow_phase!r}")
+        self.balls = ball_arrays(molecules)
+        self.traced = self.balls.traced()
+        self.cell_size = cell_size  # smallest cell; given - the cell factor is not tuned
+        self.cell_factor = CELL_FACTOR
+        self.tuning = False         # timed trials of the cell factor, see tune; off - the runs are reproducible
+        self.tune_count = 0
+        self.candidates_per_ball = {}   # cell factor -> candidate pairs per ball at the last trial
+        self.profiling = False      # find_touches keeps last_broad, see profiling.py
+        self.last_broad = None      # seconds of the last broad phase and its candidate pairs
+        self.skin = skin
+        self.neighbours = None      # skin, ball pairs and border pairs of the last build
+        self.built = None           # x, y at the last build
+        self.rebuilds = 0
+        self.compiled = narrow_phase == "compiled" or (narrow_phase == "auto" and narrow.HAVE_NUMBA)
+        self.set_borders(borders)
+
+    def set_borders(self, borders: list[Border]):
+        self.borders = list(borders)
+        self.b_x1 = np.array([b.p1.x() for b in self.borders], dtype=np.float64)
+        self.b_y1 = np.array([b.p1.y() for b in self.borders], dtype=np.float64)
+        self.b_x2 = np.array([b.p2.x() for b in self.borders], dtype=np.float64)
+        self.b_y2 = np.array([b.p2.y() for b in self.borders], dtype=np.float64)
+        self.b_cx = np.array([b.center.x() for b in self.borders], dtype=np.float64)
+        self.b_cy = np.array([b.center.y() for b in self.borders], dtype=np.float64)
+        self.b_nx = np.array([b.normal.x() for b in self.borders], dtype=np.float64)
+        self.b_ny = np.array([b.normal.y() for b in self.borders], dtype=np.float64)
+        self.b_length = np.array([b.length for b in self.borders], dtype=np.float64)
+        self.b_teflon = np.array([b.teflon for b in self.borders], dtype=bool)
+        self.border_indexes = {}    # reach -> BorderIndex
+
+    def release(self):
+        self.balls.release()
+
+    def move(self, dt: float, add_trace=False, g=0., trace_length=0, fast=None, substeps=1):
+        # fast: balls moved in substeps of dt / substeps, see substep
+        self.advance(slice(None), dt, g)
+        if fast is not None and substeps > 1:
+            self.substep(fast, dt, substeps, g)
+        if add_trace:
+            for ball in self.traced:
+                ball.add_trace(trace_length)
+
+    def advance(self, rows: slice, dt: float, g: float):
+        s = self.balls
+        s.x[rows] += s.v_x[rows] * dt
+        s.y[rows] += s.v_y[rows] * dt + g * dt*dt/2
+        s.v_y[rows] += g * dt
+
+    def substep(self, fast: np.ndarray, dt: float, substeps: int, g=0.):
+        # the fast balls, moved by dt with the others, go back to the first substep and go on substep by
+        # substep, their touches with all balls and the borders reflected after each one; the last substep
+        # is checked by the step itself. The slow balls wait at the end of the step, less than the
+        # Courant bound away
+        sub = dt / substeps
+        self.advance(fast, sub - dt, g)
+        for _ in range(substeps - 1):
+            self.reflect(self.fast_touches(fast))
+            self.advance(fast, sub, g)
+
+    def fast_touches(self, fast: np.ndarray) -> tuple:
+        return self.touches(self.fast_pairs(fast), self.border_candidates(fast))
+
+    def fast_pairs(self, fast: np.ndarray):
+        # every ball near one of the fast ones, pairs among the fast ones once; one grid when all balls
+        # fit into its cell
+        s = self.balls
+        cell = self.grid_cell()
+        if 2 * s.r.max() > cell:
+            return self.large_pairs(fast)
+        i, j = cross_pairs(s.x[fast], s.y[fast], s.x, s.y, cell)
+        i = fast[i]
+        is_fast = np.zeros(len(s), dtype=bool)
+        is_fast[fast] = True
+        keep = (i != j) & ~(is_fast[j] & (j < i))
+        return i[keep], j[keep]
+
+    def grid_cell(self, factor=None) -> float:
+        # the cell of the finest grid level: cell_factor typical diameters, at least cell_size
+        cell = (factor or self.cell_factor) * 2 * float(np.median(self.balls.r))
+        if self.cell_size is not None:
+            cell = max(cell, self.cell_size)
+        return cell
+
+    def ball_candidates(self, margin=0., factor=None):
+        # margin: also the pairs up to margin apart
+        s = self.balls
+        if len(s) < 2:
+            return EMPTY_PAIRS
+        cell = self.grid_cell(factor)
+        if 2 * s.r.max() <= cell:
+            return cell_pairs(s.x, s.y, cell + margin)
+        return level_pairs(s.x, s.y, s.r, cell, margin)
+
+    def cell_occupancy(self) -> np.ndarray:
+        # occupancy[k]: cells of the finest grid level holding k balls
+        s = self.balls
+        if len(s) == 0:
+            return np.zeros(1, dtype=np.int64)
+        cell = self.grid_cell()
+        fine = 2 * s.r <= cell
+        key = (s.y[fine] // cell) * (1 << 32) + s.x[fine] // cell
+        return np.bincount(np.unique(key, return_counts=True)[1])
+
+    def tune(self):
+        # every TUNE_PERIOD steps the broad phase is timed with the cell factor a step smaller and
+        # larger, the fastest stays; the touches do not depend on the cell, only the time does,
+        # but the cell depends on the machine and its load
+        if not self.tuning:
+            return
+        self.tune_count += 1
+        if self.tune_count < TUNE_PERIOD or self.cell_size is not None or len(self.balls) < 2:
+            return
+        self.tune_count = 0
+        elapsed = {}
+        for factor in (self.cell_factor / TUNE_STEP, self.cell_factor, self.cell_factor * TUNE_STEP):
+            if MIN_CELL_FACTOR <= factor <= MAX_CELL_FACTOR:
+                times = []
+                for _ in range(2):
+                    start = time.perf_counter()
+                    i, _ = self.ball_candidates(factor=factor)
+                    times.append(time.perf_counter() - start)
+                elapsed[factor] = min(times)
+                self.candidates_per_ball[factor] = len(i) / len(self.balls)
+        self.cell_factor = min(elapsed, key=elapsed.get)
+
+    def large_pairs(self, large: np.ndarray, margin=0.):
+        # every ball near one of the given balls
+        s = self.balls
+        return near_pairs(s.x, s.y, s.r, large, margin)
+
+    def border_candidates(self, rows=slice(None), margin=0., cell=None):
+        # balls (of rows, a slice or indices) near a border and margin more, from the border index
+        # of the grid cell; balls reaching further than a cell use a coarser index
+        s = self.balls
+        if len(self.b_x1) == 0 or len(s) == 0:
+            return EMPTY_PAIRS
+        if cell is None:
+            cell = self.grid_cell()
+        # a ball touching a segment is at most r * sqrt(2) from it
+        x, y, reach = s.x[rows], s.y[rows], 1.5 * s.r[rows] + margin
+        base = cell + margin
+        far = reach > base
+        groups = [(np.nonzero(~far)[0], base)]
+        if far.any():
+            groups.append((np.nonzero(far)[0], base * 2.0 ** np.ceil(np.log2(reach.max() / base))))
+        first, second = [EMPTY_PAIRS[0]], [EMPTY_PAIRS[1]]
+        for members, index_reach in groups:
+            index = self.border_indexes.get(index_reach)
+            if index is None:
+                index = self.border_indexes[index_reach] = BorderIndex(self.b_x1, self.b_y1, self.b_x2, self.b_y2, index_reach)
+            i, k = index.candidates(x[members], y[members], reach[members])
+            first.append(members[i])
+            second.append(k)
+        i, k = np.concatenate(first), np.concatenate(second)
+        return (i + (rows.start or 0) if isinstance(rows, slice) else rows[i]), k
+
+    def touch_balls(self, i: np.ndarray, j: np.ndarray):
+        s = self.balls
+        if self.compiled:
+            touch = narrow.touch_balls(s.x, s.y, s.v_x, s.v_y, s.r, s.teflon, i, j)
+            return i[touch], j[touch]
+        dx, dy = s.x[i] - s.x[j], s.y[i] - s.y[j]
+        sum_r = s.r[i] + s.r[j]
+        overlap = np.nonzero(dx * dx + dy * dy <= sum_r * sum_r)[0]
+        i, j, dx, dy = i[overlap], j[overlap], dx[overlap], dy[overlap]
+        apart = (s.v_x[j] - s.v_x[i]) * -dx + (s.v_y[j] - s.v_y[i]) * -dy > 0
+        touch = ~((s.teflon[i] | s.teflon[j]) & apart)
+        return i[touch], j[touch]
+
+    def touch_borders(self, i: np.ndarray, k: np.ndarray):
+        s = self.balls
+        if self.compiled:
+            touch = narrow.touch_borders(s.x, s.y, s.v_x, s.v_y, s.r, s.teflon, self.b_cx, self.b_cy,
+                                         self.b_nx, self.b_ny, self.b_length, self.b_teflon, i, k)
+            return i[touch], k[touch]
+        nx, ny = self.b_nx[k], self.b_ny[k]
+        dx, dy = s.x[i] - self.b_cx[k], s.y[i] - self.b_cy[k]
+        distance = np.abs(dx * nx + dy * ny)            # projection onto normal
+        distance_long = np.abs(dx * ny - dy * nx)
+        hit = (distance <= s.r[i]) & (distance_long <= self.b_length[k]/2 + s.r[i])
+        away = s.v_x[i] * nx + s.v_y[i] * ny > 0
+        touch = hit & ~((s.teflon[i] | self.b_teflon[k]) & away)
+        return i[touch], k[touch]
+
+    def find_touches(self):
+        if not self.profiling:
+            return self.touches(*self.candidates())
+        start = time.perf_counter()
+        pairs, border_pairs = self.candidates()
+        self.last_broad = (time.perf_counter() - start, len(pairs[0]) + len(border_pairs[0]))
+        return self.touches(pairs, border_pairs)
+
+    def candidates(self) -> tuple:
+        # broad phase: ball pairs and (ball, border) pairs that may touch
+        self.tune()
+        if self.skin:
+            return self.neighbour_candidates()
+        return self.ball_candidates(), self.border_candidates()
+
+    def touches(self, pairs: tuple, border_pairs: tuple) -> tuple:
+        # narrow phase
+        return canonical_touches(*self.touch_balls(*pairs), *self.touch_borders(*border_pairs))
+
+    def neighbour_candidates(self):
+        # Verlet lists: the pairs less than skin from touching, reused while the balls have moved less
+        # than skin / 2; the few faster ones (strays) are paired with everything in the meantime
+        s, skin = self.balls, self.skin
+        if self.neighbours is not None and self.neighbours[0] == skin and len(self.built[0]) == len(s):
+            dx, dy = s.x - self.built[0], s.y - self.built[1]
+            strays = np.nonzero(dx * dx + dy * dy > skin * skin / 4)[0]
+            if len(strays) == 0:
+                return self.neighbours[1:]
+            if len(strays) <= ARRAY_MAX_STRAYS:
+                (i, j), (bi, bk) = self.neighbours[1:]
+                stray = np.zeros(len(s), dtype=bool)
+                stray[strays] = True
+                keep, keep_b = ~(stray[i] | stray[j]), ~stray[bi]
+                stray_i, stray_j = self.large_pairs(strays)
+                stray_bi, stray_bk = self.border_candidates(strays, skin)
+                return (np.concatenate((i[keep], stray_i)), np.concatenate((j[keep], stray_j))), \
+                    (np.concatenate((bi[keep_b], stray_bi)), np.concatenate((bk[keep_b], stray_bk)))
+        self.rebuilds += 1
+        i, j = self.ball_candidates(skin)
+        dx, dy = s.x[i] - s.x[j], s.y[i] - s.y[j]
+        reach = s.r[i] + s.r[j] + skin
+        near = dx * dx + dy * dy <= reach * reach
+        self.neighbours = (skin, (i[near], j[near]), self.border_candidates(margin=skin))
+        self.built = (s.x.copy(), s.y.copy())
+        return self.neighbours[1:]
+
+    def reflect(self, touches):
+        i, j, bi, bk = touches
+        if self.compiled:
+            s = self.balls
+            narrow.reflect_balls(s.x, s.y, s.v_x, s.v_y, s.m, i, j)
+            momentum = np.zeros(len(self.borders))
+            narrow.reflect_borders(s.v_x, s.v_y, s.m, self.b_nx, self.b_ny, bi, bk, momentum)
+            self.add_momentum(momentum)
+            return
+        for batch in conflict_free(i, j):
+            self.reflect_balls(i[batch], j[batch])
+        for batch in conflict_free(bi):
+            self.reflect_borders(bi[batch], bk[batch])
+
+    def reflect_balls(self, a: np.ndarray, b: np.ndarray):
+        # the same solution as Ball.reflect_ball
+        s = self.balls
+        ma, mb = s.m[a], s.m[b]
+        dx, dy = s.x[a] - s.x[b], s.y[a] - s.y[b]
+        dx2, dxy, dy2 = dx * dx, dx * dy, dy * dy
+        dist = (dx2 + dy2) * (ma + mb)
+        dvx0 = s.v_x[b] - s.v_x[a]
+        dvy0 = s.v_y[b] - s.v_y[a]
+        same = dist == 0
+        dvx = np.where(same, dvx0, dx2 * dvx0 + dxy * dvy0)
+        dvy = np.where(same, dvy0, dxy * dvx0 + dy2 * dvy0)
+        dist = np.where(same, ma + mb, dist)
+        s.v_x[a] += 2 * mb * dvx / dist
+        s.v_y[a] += 2 * mb * dvy / dist
+        s.v_x[b] -= 2 * ma * dvx / dist
+        s.v_y[b] -= 2 * ma * dvy / dist
+
+    def reflect_borders(self, i: np.ndarray, k: np.ndarray):
+        # the same as Ball.reflect_border, momentum goes to Border.current_momentum
+        s = self.balls
+        nx, ny = self.b_nx[k], self.b_ny[k]
+        dot = s.v_x[i] * nx + s.v_y[i] * ny
+        s.v_x[i] -= 2 * dot * nx
+        s.v_y[i] -= 2 * dot * ny
+        self.add_momentum(np.bincount(k, weights=-2 * s.m[i] * dot, minlength=len(self.borders)))
+
+    def add_momentum(self, momentum: np.ndarray):
+        for n in np.nonzero(momentum)[0]:
+            self.borders[n].current_momentum += momentum[n]
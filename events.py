@@ -0,0 +1,314 @@
+""" Event-driven engine: exact collision times in a priority queue, jumps from event to event.
+    Cell-crossing scheme: every ball keeps its own time and moves only when it takes part in an event;
+    collisions are predicted against the balls of the neighbouring cells and the borders listed for the
+    cell, and a ball leaving its cell is an event that predicts against the newly adjacent cells """
+import heapq
+import itertools
+import math
+import numpy as np
+
+from BorderMolecules import Border
+from balls import Ball
+from borderindex import BorderIndex, segment_distance
+from engine import ball_arrays
+
+MAX_LARGE_BALLS = 32    # balls larger than a cell: not members of the cells, every ball checks them
+CELL_BALLS = 1.         # balls per cell on average: larger cells, fewer crossings, more neighbours
+QUEUE_FACTOR = 8        # the queue is cleaned of invalidated events when it holds this many per ball
+EPS = 1e-9
+
+BALL, BORDER, CELL = 0, 1, 2
+EXITS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+MOTION = ("x", "y", "v_x", "v_y")
+
+
+def inward_roots(a: float, b: float, c: float) -> list:
+    # times t > EPS at which a t^2 + b t + c falls through 0
+    if abs(a) < EPS:
+        return [-c / b] if b < 0 and -c / b > EPS else []
+    disc = b * b - 4 * a * c
+    if disc < 0:
+        return []
+    root = math.sqrt(disc)
+    return [t for t in ((-b - root) / (2 * a), (-b + root) / (2 * a)) if t > EPS and 2 * a * t + b < 0]
+
+
+def block(c: tuple, k: int) -> set:
+    # the cells at most k away from c
+    return {(c[0] + dx, c[1] + dy) for dy in range(-k, k + 1) for dx in range(-k, k + 1)}
+
+
+class EventEngine:
+    """ exact hard-disc dynamics with constant gravity; borders are the same strips as in Ball.touch.
+        cell_size: the cell of the neighbour grid, by default holding CELL_BALLS balls on average and at
+        least the diameter of all but the MAX_LARGE_BALLS largest balls; a larger ball looks as many
+        cells around as its radius needs. While moving, the state is in Python lists, written back
+        into the arrays at the end of every move """
+    def __init__(self, molecules: list[Ball], borders: list[Border], cell_size=None):
+        self.balls = ball_arrays(molecules)
+        self.traced = self.balls.traced()
+        self.borders = list(borders)
+        self.border_params = [(b.center.x(), b.center.y(), b.normal.x(), b.normal.y(), b.length) for b in self.borders]
+        self.time = 0.
+        self.g = None
+        self.queue = []
+        self.seq = 0
+        s = self.balls
+        n = len(s)
+        self.counts = [0] * n       # collisions of every ball, events of older trajectories are skipped
+        self.local = [0.] * n       # the time of every ball's x, y, v_x, v_y
+        self.x, self.y, self.v_x, self.v_y = ([] for _ in MOTION)
+        self.r, self.m = s.r.tolist(), s.m.tolist()
+        self.events = 0     # processed collisions
+        self.crossings = 0  # processed cell crossings
+
+        cell = cell_size
+        if cell is None and n:
+            diameter = np.sort(2 * s.r)
+            area = float((s.x.max() - s.x.min()) * (s.y.max() - s.y.min()))
+            cell = max(float(diameter[-MAX_LARGE_BALLS - 1]) if n > MAX_LARGE_BALLS else float(diameter[-1]),
+                       math.sqrt(CELL_BALLS * area / n))
+        cell = max(cell or 1., EPS)
+        small_r = float(s.r[2 * s.r <= cell].max(initial=0.))
+        self.ends = np.array([(b.p1.x(), b.p1.y(), b.p2.x(), b.p2.y()) for b in self.borders], dtype=np.float64).reshape(-1, 4).T
+        self.border_index = None
+        self.x0 = self.y0 = 0.
+        if self.borders:
+            # a ball touching a segment is at most r * sqrt(2) from it; the grid is the one of the index
+            self.border_index = BorderIndex(*self.ends, 1.5 * small_r, cell=cell)
+            cell, self.x0, self.y0 = self.border_index.cell, self.border_index.x0, self.border_index.y0
+        self.cell = cell
+        self.is_large = (2 * s.r > cell).tolist()
+        self.large = [i for i, large in enumerate(self.is_large) if large]
+        self.large_reach = 1.5 * float(s.r.max(initial=0.))
+        # cells around a ball to check: its radius and the largest small one fit
+        self.rings = [1 if not large else math.ceil((r + small_r) / cell) for r, large in zip(self.r, self.is_large)]
+        self.cell_of = [None] * n
+        self.members = {}               # cell -> indices of its small balls
+        self.border_cache = ({}, {})    # cell -> borders within reach of it, for the small and the large balls
+
+    def release(self):
+        self.balls.release()
+
+    def move(self, dt: float, add_trace=False, g=0., trace_length=0):
+        s = self.balls
+        self.x, self.y, self.v_x, self.v_y = (getattr(s, name).tolist() for name in MOTION)
+        if g != self.g:
+            self.g = g
+            self.predict_all()
+        target = self.time + dt
+        while self.queue and self.queue[0][0] <= target:
+            t, _, kind, i, j, count_i, count_j = heapq.heappop(self.queue)
+            if self.counts[i] != count_i or (kind == BALL and self.counts[j] != count_j):
+                continue        # lazily invalidated
+            self.time = t
+            if kind == BALL:
+                self.collide_balls(i, j)
+                self.predict(i)
+                self.predict(j, skip=i)
+            elif kind == BORDER:
+                self.collide_border(i, j)
+                self.predict(i)
+            else:
+                self.cross(i, EXITS[j])
+        self.time = target
+        self.drift_all()
+        if len(self.queue) > QUEUE_FACTOR * len(s) + 64:
+            self.clean_queue()
+        if add_trace:
+            for ball in self.traced:
+                ball.add_trace(trace_length)
+
+    def find_touches(self):
+        # collisions are resolved inside move
+        return None
+
+    def reflect(self, touches):
+        pass
+
+    def sync(self, i: int):
+        # ball i to the current time
+        tau = self.time - self.local[i]
+        if tau:
+            self.x[i] += self.v_x[i] * tau
+            self.y[i] += self.v_y[i] * tau + self.g * tau*tau/2
+            self.v_y[i] += self.g * tau
+            self.local[i] = self.time
+
+    def drift_all(self):
+        # all balls to the current time, back into the arrays
+        s = self.balls
+        for name in MOTION:
+            getattr(s, name)[:] = getattr(self, name)
+        tau = self.time - np.array(self.local)
+        s.x += s.v_x * tau
+        s.y += s.v_y * tau + self.g * tau*tau/2
+        s.v_y += self.g * tau
+        self.local = [self.time] * len(s)
+
+    def push(self, t: float, kind: int, i: int, j: int):
+        self.seq += 1
+        heapq.heappush(self.queue, (self.time + t, self.seq, kind, i, j, self.counts[i], self.counts[j] if kind == BALL else 0))
+
+    def clean_queue(self):
+        # drop the invalidated events
+        counts = self.counts
+        self.queue = [event for event in self.queue
+                      if counts[event[3]] == event[5] and (event[2] != BALL or counts[event[4]] == event[6])]
+        heapq.heapify(self.queue)
+
+    # ======== cells ========
+    def cell_at(self, x: float, y: float) -> tuple:
+        return int((x - self.x0) // self.cell), int((y - self.y0) // self.cell)
+
+    def cell_members(self, cells) -> list:
+        return list(itertools.chain.from_iterable(self.members.get(c, ()) for c in cells))
+
+    def cell_borders(self, c: tuple, large=False) -> tuple:
+        # the small balls: the cell of the border index; the large ones: the borders near the cell
+        cache = self.border_cache[large]
+        borders = cache.get(c)
+        if borders is None:
+            index, (col, row) = self.border_index, c
+            if index is None:
+                borders = ()
+            elif large:
+                centre_x, centre_y = self.x0 + (col + 0.5) * self.cell, self.y0 + (row + 0.5) * self.cell
+                near = segment_distance(centre_x, centre_y, *self.ends) <= self.large_reach + self.cell * math.sqrt(0.5)
+                borders = tuple(np.nonzero(near)[0].tolist())
+            elif 0 <= col < index.cols and 0 <= row < index.rows:
+                key = row * index.cols + col
+                borders = tuple(index.segments[index.start[key]:index.start[key + 1]].tolist())
+            else:
+                borders = ()
+            cache[c] = borders
+        return borders
+
+    def cross(self, i: int, step: tuple):
+        # ball i goes over to the next cell: only the newly adjacent cells and borders are new
+        old = self.cell_of[i]
+        new = (old[0] + step[0], old[1] + step[1])
+        large = self.is_large[i]
+        if not large:
+            self.members[old].discard(i)
+            self.members.setdefault(new, set()).add(i)
+        self.cell_of[i] = new
+        rings = self.rings[i]
+        self.predict_balls(i, self.cell_members(block(new, rings) - block(old, rings)))
+        old_borders = self.cell_borders(old, large)
+        self.predict_borders(i, [k for k in self.cell_borders(new, large) if k not in old_borders])
+        self.predict_crossing(i)
+        self.crossings += 1
+
+    # ======== prediction ========
+    def predict_all(self):
+        self.queue.clear()
+        self.members = {}
+        for i, (x, y) in enumerate(zip(self.x, self.y)):
+            self.local[i] = self.time
+            self.cell_of[i] = self.cell_at(x, y)
+            if not self.is_large[i]:
+                self.members.setdefault(self.cell_of[i], set()).add(i)
+        for i in range(len(self.balls)):
+            self.predict(i, only_later=True)
+
+    def predict(self, i: int, skip=-1, only_later=False):
+        # push the collisions of ball i with its neighbours and the borders near it and its cell exit
+        c = self.cell_of[i]
+        others = self.cell_members(block(c, self.rings[i])) + self.large
+        self.predict_balls(i, [j for j in others if j != i and j != skip and (j > i or not only_later)])
+        self.predict_borders(i, self.cell_borders(c, self.is_large[i]))
+        self.predict_crossing(i)
+
+    def predict_balls(self, i: int, others):
+        # approaching pairs: in contact already or closing the gap at the smaller root
+        self.sync(i)
+        xs, ys, vxs, vys, rs, local = self.x, self.y, self.v_x, self.v_y, self.r, self.local
+        x, y, v_x, v_y, r = xs[i], ys[i], vxs[i], vys[i], rs[i]
+        time, g = self.time, self.g
+        for j in others:
+            tau = time - local[j]
+            dx = xs[j] + vxs[j] * tau - x
+            dy = ys[j] + vys[j] * tau + g * tau*tau/2 - y
+            dvx, dvy = vxs[j] - v_x, vys[j] + g * tau - v_y     # gravity cancels in relative motion
+            b = dx * dvx + dy * dvy
+            if b >= 0:
+                continue
+            sum_r = rs[j] + r
+            c = dx * dx + dy * dy - sum_r * sum_r
+            if c <= 0:
+                self.push(0., BALL, i, j)
+                continue
+            a = dvx * dvx + dvy * dvy
+            disc = b * b - a * c
+            if disc >= 0:
+                self.push((-b - math.sqrt(disc)) / a, BALL, i, j)
+
+    def predict_borders(self, i: int, borders):
+        for k, t_k in self.border_times(i, borders):
+            self.push(t_k, BORDER, i, k)
+
+    def predict_crossing(self, i: int):
+        # the first time ball i leaves its cell: x is linear, y a parabola
+        self.sync(i)
+        x, y, v_x, v_y = self.x[i], self.y[i], self.v_x[i], self.v_y[i]
+        col, row = self.cell_of[i]
+        low_x, low_y = self.x0 + col * self.cell, self.y0 + row * self.cell
+        times = (inward_roots(0., -v_x, low_x + self.cell - x), inward_roots(0., v_x, x - low_x),
+                 inward_roots(-self.g / 2, -v_y, low_y + self.cell - y), inward_roots(self.g / 2, v_y, y - low_y))
+        t, exit = min((min(t, default=math.inf), k) for k, t in enumerate(times))
+        if t < math.inf:
+            self.push(t, CELL, i, exit)
+
+    def border_times(self, i: int, borders):
+        # the first contact with every border: the centre comes to r from the line, moving towards it
+        # from either side, at a point of the strip
+        self.sync(i)
+        x, y, v_x, v_y, r = self.x[i], self.y[i], self.v_x[i], self.v_y[i], self.r[i]
+        for k in borders:
+            cx, cy, nx, ny, length = self.border_params[k]
+            s0 = (x - cx) * nx + (y - cy) * ny
+            v_n = v_x * nx + v_y * ny
+            a = self.g * ny / 2
+            side = 1. if s0 > 0 or (s0 == 0 and v_n < 0) else -1.
+            # side * distance - r falls through 0 along the parabola; in contact and approaching is now
+            times = [0.] if side * s0 - r <= 0 and side * v_n < 0 else []
+            times += sorted(inward_roots(side * a, side * v_n, side * s0 - r) + inward_roots(-side * a, -side * v_n, -side * s0 - r))
+            for t in times:
+                x_t = x + v_x * t
+                y_t = y + v_y * t + self.g * t*t/2
+                if abs((x_t - cx) * ny - (y_t - cy) * nx) <= length/2 + r:
+                    yield k, t
+                    break
+
+    # ======== collisions ========
+    def collide_balls(self, a: int, b: int):
+        # the same solution as Ball.reflect_ball at the moment of contact
+        self.sync(a)
+        self.sync(b)
+        x, y, v_x, v_y, m = self.x, self.y, self.v_x, self.v_y, self.m
+        dx, dy = x[a] - x[b], y[a] - y[b]
+        dist = (dx * dx + dy * dy) * (m[a] + m[b])
+        dvx, dvy = v_x[b] - v_x[a], v_y[b] - v_y[a]
+        if dist != 0:
+            dvx, dvy = dx * dx * dvx + dx * dy * dvy, dx * dy * dvx + dy * dy * dvy
+        else:
+            dist = m[a] + m[b]
+        v_x[a] += 2 * m[b] * dvx / dist
+        v_y[a] += 2 * m[b] * dvy / dist
+        v_x[b] -= 2 * m[a] * dvx / dist
+        v_y[b] -= 2 * m[a] * dvy / dist
+        self.counts[a] += 1
+        self.counts[b] += 1
+        self.events += 1
+
+    def collide_border(self, i: int, k: int):
+        # the same as Ball.reflect_border
+        self.sync(i)
+        nx, ny = self.border_params[k][2:4]
+        dot = self.v_x[i] * nx + self.v_y[i] * ny
+        self.v_x[i] -= 2 * dot * nx
+        self.v_y[i] -= 2 * dot * ny
+        self.borders[k].current_momentum -= 2 * self.m[i] * dot
+        self.counts[i] += 1
+        self.events += 1
@@ -0,0 +1,163 @@
+""" Offscreen movies of a Simulation: frames are painted into a QImage on a worker thread and piped
+    to ffmpeg (.mp4, .mkv, .webm, .avi) or saved as numbered PNG files; works without a display """
+import os
+import queue
+import subprocess
+import threading
+import numpy as np
+from PyQt5.QtCore import Qt, QPointF
+from PyQt5.QtGui import QGuiApplication, QImage, QPainter, QPen, QColor
+
+from qtcompat import qcolor
+from render import TraceCache, SceneCapture, merge_traces, paint_ball, sprite_size
+from ringbuffer import RingBuffer
+
+VIDEO_SUFFIXES = (".mp4", ".mkv", ".webm", ".avi", ".mov")
+MARGIN = 20             # pixels around the scene
+
+_app = None
+
+
+def ensure_gui():
+    # QImage painting needs a QGuiApplication; without a display the offscreen platform is used
+    global _app
+    if QGuiApplication.instance() is None:
+        if not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"):
+            os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        _app = QGuiApplication([])
+
+
+def ball_image(color: QColor, r: float, scale: float) -> QImage:
+    # Ball.draw as a QImage: QPixmap may only be used in the GUI thread
+    size = sprite_size(r, scale)
+    return paint_ball(QImage(size, size, QImage.Format_ARGB32_Premultiplied), color, r, scale)
+
+
+def ffmpeg_command(path: str, width: int, height: int, fps: float) -> list[str]:
+    return ["ffmpeg", "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "bgra", "-s", f"{width}x{height}",
+            "-r", str(fps), "-i", "-", "-pix_fmt", "yuv420p", path]
+
+
+class MovieWriter:
+    """ a Simulation recorder: every `every` steps the physics thread copies ball positions and new trace
+        points, the worker thread paints and encodes them. With drop_frames a full queue drops the frame
+        instead of waiting for the encoder """
+    def __init__(self, path: str, sim, every=1, scale=1., fps=30, max_frames=8, drop_frames=True, command=None):
+        ensure_gui()
+        self.path = path
+        self.every = every
+        self.scale = scale
+        self.drop_frames = drop_frames
+        self.borders = list(sim.borders)
+
+        self.scene = SceneCapture(sim)
+        self.balls = self.scene.balls
+        self.groups = {}
+        for k, ball in enumerate(self.balls):
+            self.groups.setdefault((qcolor(ball.color).rgba(), ball.r), []).append(k)
+        self.groups = {key: np.array(index) for key, index in self.groups.items()}
+        self.traced = self.scene.traced
+        self.paths = [RingBuffer(sim.trace_length, shape=(2,)) for _ in self.traced]
+        self.trace_caches = [TraceCache() for _ in self.traced]
+
+        min_x, min_y, max_x, max_y = sim.bounds()
+        self.origin = (min_x - MARGIN / scale, min_y - MARGIN / scale)
+        # even sizes for yuv420p
+        self.width = (int((max_x - min_x) * scale) + 2 * MARGIN + 1) // 2 * 2
+        self.height = (int((max_y - min_y) * scale) + 2 * MARGIN + 1) // 2 * 2
+
+        self.video = path.lower().endswith(VIDEO_SUFFIXES)
+        if self.video:
+            command = command or ffmpeg_command(path, self.width, self.height, fps)
+            self.encoder = subprocess.Popen(command, stdin=subprocess.PIPE)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.encoder = None
+
+        self.frames = 0
+        self.dropped = 0
+        self.pending = None
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_frames)
+        self.thread = threading.Thread(target=self.paint_frames, daemon=True)
+        self.thread.start()
+        self.add_frame(sim)
+
+    def __call__(self, sim):
+        if sim.steps % self.every == 0:
+            self.add_frame(sim)
+
+    def add_frame(self, sim):
+        # physics thread: copy what the worker needs
+        if self.error:
+            raise self.error
+        x, y, _, _, traces = self.scene.capture()
+        if self.pending:
+            traces = merge_traces(self.pending, traces)
+            self.pending = None
+        frame = (x, y, traces)
+        if self.drop_frames:
+            try:
+                self.queue.put_nowait(frame)
+            except queue.Full:
+                self.pending = traces   # the trace points of a dropped frame go with the next one
+                self.dropped += 1
+        else:
+            self.queue.put(frame)
+
+    def paint_frames(self):
+        sprites = {key: ball_image(QColor.fromRgba(key[0]), key[1], self.scale) for key in self.groups}
+        image = QImage(self.width, self.height, QImage.Format_RGB32)
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                return
+            if self.error:
+                continue
+            try:
+                self.paint(image, sprites, *frame)
+                self.write(image)
+            except Exception as error:
+                self.error = error
+
+    def paint(self, image: QImage, sprites: dict, x: np.ndarray, y: np.ndarray, traces: list):
+        image.fill(Qt.white)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.scale(self.scale, self.scale)
+        painter.translate(-self.origin[0], -self.origin[1])
+        for border in self.borders:
+            border.draw(painter)
+        for n, k in enumerate(self.traced):
+            for point in traces[n]:
+                self.paths[n].append(point)
+            self.trace_caches[n].update(self.paths[n])
+            painter.setPen(QPen(qcolor(self.balls[k].color), 2))
+            self.trace_caches[n].draw(painter)
+        # sprites are in pixels: positions are mapped by hand
+        painter.resetTransform()
+        sx, sy = (x - self.origin[0]) * self.scale, (y - self.origin[1]) * self.scale
+        for key, index in self.groups.items():
+            sprite = sprites[key]
+            half = sprite.width() / 2
+            for px, py in zip((sx[index] - half).tolist(), (sy[index] - half).tolist()):
+                painter.drawImage(QPointF(px, py), sprite)
+        painter.end()
+
+    def write(self, image: QImage):
+        if self.encoder:
+            bits = image.constBits()
+            bits.setsize(image.byteCount())
+            self.encoder.stdin.write(bits.asstring())
+        else:
+            image.save(os.path.join(self.path, f"frame{self.frames:06d}.png"))
+        self.frames += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.encoder:
+            self.encoder.stdin.close()
+            self.encoder.wait()
+        if self.error:
+            raise self.error
@@ -0,0 +1,86 @@
+""" Narrow phase kernels over arrays of candidate index pairs, compiled with numba when it is installed """
+import functools
+import importlib.util
+import numpy as np
+
+# numba is imported and the kernels compiled on their first call, not on import
+HAVE_NUMBA = importlib.util.find_spec("numba") is not None
+
+
+def njit(**options):
+    # numba.njit(**options) applied on the first call; without numba the kernels run as plain loops
+    def decorate(func):
+        kernel = None
+
+        @functools.wraps(func)
+        def call(*args):
+            nonlocal kernel
+            if kernel is None:
+                if HAVE_NUMBA:
+                    import numba
+                    kernel = numba.njit(**options)(func)
+                else:
+                    kernel = func
+            return kernel(*args)
+        return call
+    return decorate
+
+
+@njit(cache=True)
+def touch_balls(x, y, v_x, v_y, r, teflon, i, j):
+    # the test of Ball.touch for Ball pairs
+    touch = np.zeros(len(i), dtype=np.bool_)
+    for k in range(len(i)):
+        a, b = i[k], j[k]
+        dx, dy = x[a] - x[b], y[a] - y[b]
+        sum_r = r[a] + r[b]
+        if dx * dx + dy * dy <= sum_r * sum_r:
+            if (teflon[a] or teflon[b]) and (v_x[b] - v_x[a]) * -dx + (v_y[b] - v_y[a]) * -dy > 0:
+                continue
+            touch[k] = True
+    return touch
+
+
+@njit(cache=True)
+def reflect_balls(x, y, v_x, v_y, m, i, j):
+    # Ball.reflect_ball for every pair, in order
+    for k in range(len(i)):
+        a, b = i[k], j[k]
+        dx, dy = x[a] - x[b], y[a] - y[b]
+        dist = (dx * dx + dy * dy) * (m[a] + m[b])
+        dvx, dvy = v_x[b] - v_x[a], v_y[b] - v_y[a]
+        if dist != 0:
+            dvx, dvy = dx * dx * dvx + dx * dy * dvy, dx * dy * dvx + dy * dy * dvy
+        else:
+            dist = m[a] + m[b]
+        v_x[a] += 2 * m[b] * dvx / dist
+        v_y[a] += 2 * m[b] * dvy / dist
+        v_x[b] -= 2 * m[a] * dvx / dist
+        v_y[b] -= 2 * m[a] * dvy / dist
+
+
+@njit(cache=True)
+def touch_borders(x, y, v_x, v_y, r, teflon, cx, cy, nx, ny, length, b_teflon, i, k):
+    # the test of Ball.touch for Border
+    touch = np.zeros(len(i), dtype=np.bool_)
+    for n in range(len(i)):
+        a, b = i[n], k[n]
+        dx, dy = x[a] - cx[b], y[a] - cy[b]
+        distance = abs(dx * nx[b] + dy * ny[b])
+        distance_long = abs(dx * ny[b] - dy * nx[b])
+        if distance <= r[a] and distance_long <= length[b]/2 + r[a]:
+            if (teflon[a] or b_teflon[b]) and v_x[a] * nx[b] + v_y[a] * ny[b] > 0:
+                continue
+            touch[n] = True
+    return touch
+
+
+@njit(cache=True)
+def reflect_borders(v_x, v_y, m, nx, ny, i, k, momentum):
+    # Ball.reflect_border for every pair, in order; the border momentum is summed into momentum
+    for n in range(len(i)):
+        a, b = i[n], k[n]
+        dot = v_x[a] * nx[b] + v_y[a] * ny[b]
+        v_x[a] -= 2 * dot * nx[b]
+        v_y[a] -= 2 * dot * ny[b]
+        momentum[b] -= 2 * m[a] * dot
@@ -0,0 +1,110 @@
+""" Named observables of a Simulation: vectorized over the array state, computed at most once per step
+    and shared by the viewers of GraphMenu and the headless exporters """
+import numpy as np
+
+from engine import molecule_columns
+
+OBSERVABLES = {}    # name -> (function of Observables, "scene" | "molecule" | "border", description)
+
+
+def observable(name: str, per="scene", description=""):
+    def register(func):
+        OBSERVABLES[name] = (func, per, description)
+        return func
+    return register
+
+
+class Observables:
+    """ obs["name"] - the value of a registered observable for the current step of sim; values are cached
+        until the step count, the molecule list or the engine changes (or invalidate() after editing the state) """
+    def __init__(self, sim):
+        self.sim = sim
+        self.key = None
+        self.cache = {}
+        self.columns = None     # BallColumns of array-backed balls, None for other molecules
+
+    def __getitem__(self, name: str):
+        # "pressure[3]" - one entry of a per-border or per-molecule observable
+        if name.endswith("]"):
+            name, index = name[:-1].split("[")
+            return self[name][int(index)].item()
+        key = (self.sim.steps, id(self.sim.molecules), len(self.sim.molecules), id(self.sim.engine))
+        if key != self.key:
+            self.key = key
+            self.cache = {}
+            self.columns = molecule_columns(self.sim.molecules, self.sim.engine)
+        if name not in self.cache:
+            if name not in OBSERVABLES:
+                raise KeyError(f"unknown observable {name!r}, expected one of {list(OBSERVABLES)}")
+            self.cache[name] = OBSERVABLES[name][0](self)
+        return self.cache[name]
+
+    def invalidate(self):
+        self.key = None
+
+    def per_molecule(self, func: callable) -> np.ndarray:
+        # func of a molecule; array-backed balls give it BallColumns, so the Ball formulas run on whole columns
+        molecules = self.sim.molecules
+        if self.columns is not None:
+            return np.broadcast_to(np.asarray(func(self.columns), dtype=np.float64), (len(molecules),))
+        return np.fromiter((func(mol) for mol in molecules), dtype=np.float64, count=len(molecules))
+
+    def column(self, name: str) -> np.ndarray:
+        return self.per_molecule(lambda mol: getattr(mol, name))
+
+
+@observable("mass", "molecule")
+def mass(obs: Observables) -> np.ndarray:
+    return obs.per_molecule(lambda mol: mol.M())
+
+
+@observable("kinetic_energy", "molecule", "translational and rotational energy of every molecule")
+def kinetic_energy(obs: Observables) -> np.ndarray:
+    return obs.per_molecule(lambda mol: mol.W())
+
+
+@observable("speed", "molecule")
+def speed(obs: Observables) -> np.ndarray:
+    return np.hypot(obs.column("v_x"), obs.column("v_y"))
+
+
+@observable("kinetic_energy_total", "scene")
+def kinetic_energy_total(obs: Observables) -> float:
+    return float(obs["kinetic_energy"].sum())
+
+
+@observable("potential_energy", "scene", "-g sum m y, y grows downwards")
+def potential_energy(obs: Observables) -> float:
+    return -obs.sim.g * float((obs["mass"] * obs.column("y")).sum())
+
+
+@observable("energy", "scene")
+def energy(obs: Observables) -> float:
+    return obs["kinetic_energy_total"] + obs["potential_energy"]
+
+
+@observable("temperature", "scene", "mean kinetic energy per molecule (2D, k = 1)")
+def temperature(obs: Observables) -> float:
+    n = len(obs.sim.molecules)
+    return obs["kinetic_energy_total"] / n if n else 0.
+
+
+@observable("momentum_x", "scene")
+def momentum_x(obs: Observables) -> float:
+    return float(obs.per_molecule(lambda mol: mol.P_x()).sum())
+
+
+@observable("momentum_y", "scene")
+def momentum_y(obs: Observables) -> float:
+    return float(obs.per_molecule(lambda mol: mol.P_y()).sum())
+
+
+@observable("pressure", "border", "mean pressure of every border over its stack")
+def pressure(obs: Observables) -> np.ndarray:
+    return np.array([brd.get_pressure() for brd in obs.sim.borders])
+
+
+@observable("mean_pressure", "scene", "length weighted mean pressure of all borders")
+def mean_pressure(obs: Observables) -> float:
+    lengths = np.array([brd.length for brd in obs.sim.borders])
+    return float((obs["pressure"] * lengths).sum() / lengths.sum()) if len(lengths) else 0.
@@ -0,0 +1,135 @@
+""" Multi-core stepping of the array engine: the ball state lives in shared memory, worker processes
+    move index ranges and find the touches of spatial strips, the main process reflects """
+import ctypes
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from BorderMolecules import Border
+from balls import Ball
+from engine import ArrayEngine, BallArrays, BALL_FIELDS, EMPTY_PAIRS, cell_pairs, canonical_touches, level_pairs
+
+MIN_PARALLEL_BALLS = 20000      # smaller scenes step in the main process
+STRIP_SAMPLE = 65536            # positions sampled to place the strip edges
+
+_worker = None      # worker process: an ArrayEngine over the shared state
+
+
+def shared_column(column: np.ndarray):
+    # a copy of column in shared memory, inherited by the worker processes
+    raw = multiprocessing.RawArray(ctypes.c_char, max(column.nbytes, 1))
+    shared = np.frombuffer(raw, dtype=column.dtype, count=len(column))
+    shared[:] = column
+    return raw, shared
+
+
+def _attach(columns: dict, n: int, borders: dict, cell_size, compiled: bool):
+    global _worker
+    engine = ArrayEngine.__new__(ArrayEngine)
+    engine.balls = BallArrays.__new__(BallArrays)
+    for name, (raw, dtype) in columns.items():
+        setattr(engine.balls, name, np.frombuffer(raw, dtype=dtype, count=n))
+    engine.__dict__.update(borders)
+    engine.border_indexes = {}
+    engine.cell_size = cell_size
+    engine.compiled = compiled
+    _worker = engine
+
+
+def _advance(rows: slice, dt: float, g: float):
+    _worker.advance(rows, dt, g)
+
+
+def _find_touches(strip: tuple, cell: float, rows: slice):
+    # touching pairs whose left ball lies in the strip [low, high) - the strip and a halo of one cell
+    # on its right see all of them - and the border touches of the balls in rows
+    engine = _worker
+    s = engine.balls
+    bi, bk = engine.touch_borders(*engine.border_candidates(rows, cell=cell))
+    if strip is None:
+        return EMPTY_PAIRS + (bi, bk)
+    low, high = strip
+    strip = np.nonzero((s.x >= low) & (s.x <= high + cell) & (2 * s.r <= cell))[0]
+    i, j = cell_pairs(s.x[strip], s.y[strip], cell)
+    i, j = strip[i], strip[j]
+    left = np.minimum(s.x[i], s.x[j])
+    owned = (left >= low) & (left < high)
+    return engine.touch_balls(i[owned], j[owned]) + (bi, bk)
+
+
+class ParallelEngine(ArrayEngine):
+    """ ArrayEngine with move and collision detection spread over worker processes. Strips along x have
+        edges on multiples of the grid cell and about the same number of balls; a pair of small balls
+        belongs to the strip of its left ball and the strip's halo of one cell reaches its partner.
+        Balls larger than a cell (the coarser grid levels) are paired in the main process. The touches are merged in the canonical
+        order and reflected in the main process, so the result is the same as ArrayEngine's """
+    def __init__(self, molecules: list[Ball], borders: list[Border], cell_size=None, narrow_phase="auto",
+                 workers=None, min_balls=MIN_PARALLEL_BALLS):
+        super().__init__(molecules, borders, cell_size, narrow_phase)
+        self.workers = workers or os.cpu_count()
+        self.min_balls = min_balls
+        self.private = {}       # the columns as they were before, given back by release()
+        self.pool = None
+        if len(self.balls) >= min_balls:
+            self.share()
+
+    def share(self):
+        s = self.balls
+        columns = {}
+        for name in BALL_FIELDS:
+            column = getattr(s, name)
+            self.private[name] = column
+            raw, shared = shared_column(column)
+            setattr(s, name, shared)
+            columns[name] = (raw, column.dtype)
+        borders = {name: value for name, value in vars(self).items() if name.startswith("b_")}
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_attach,
+                                        initargs=(columns, len(s), borders, self.cell_size, self.compiled))
+        ends = np.linspace(0, len(s), self.workers + 1).astype(int).tolist()
+        self.rows = [slice(a, b) for a, b in zip(ends[:-1], ends[1:])]
+
+    def set_borders(self, borders: list[Border]):
+        if getattr(self, "pool", None) is not None:
+            raise ValueError("borders of a ParallelEngine are fixed, make a new engine")
+        super().set_borders(borders)
+
+    def release(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            for name, column in self.private.items():
+                column[:] = getattr(self.balls, name)
+                setattr(self.balls, name, column)
+            self.private = {}
+        super().release()
+
+    def advance(self, rows: slice, dt: float, g: float):
+        # a few given balls (the substeps of the fast ones) in the main process
+        if self.pool is None or isinstance(rows, np.ndarray):
+            return super().advance(rows, dt, g)
+        for future in [self.pool.submit(_advance, part, dt, g) for part in self.rows]:
+            future.result()
+
+    def strips(self, cell: float) -> list[tuple]:
+        # (low, high) between quantiles of x rounded to cell multiples; fewer strips than workers
+        # when the balls crowd into a few cells
+        x = self.balls.x
+        sample = x[::max(len(x) // STRIP_SAMPLE, 1)]
+        edges = np.unique(np.round(np.quantile(sample, np.linspace(0, 1, self.workers + 1)[1:-1]) / cell) * cell)
+        edges = [-np.inf] + edges.tolist() + [np.inf]
+        return list(zip(edges[:-1], edges[1:]))
+
+    def find_touches(self):
+        if self.pool is None:
+            return super().find_touches()
+        self.tune()
+        cell = self.grid_cell()
+        futures = [self.pool.submit(_find_touches, strip, cell, rows)
+                   for strip, rows in itertools.zip_longest(self.strips(cell), self.rows, fillvalue=None)]
+        parts = [future.result() for future in futures]
+        s = self.balls
+        if 2 * s.r.max() > cell:
+            parts.append(self.touch_balls(*level_pairs(s.x, s.y, s.r, cell, skip_first=True)) + EMPTY_PAIRS)
+        return canonical_touches(*(np.concatenate([part[k] for part in parts]) for k in range(4)))
@@ -0,0 +1,129 @@
+""" Per-step profiling of a Simulation: phase timings and counters of every step in a ring buffer,
+    exported as JSON, CSV or a Chrome trace (chrome://tracing, ui.perfetto.dev); a Simulation without
+    a profiler does not pay for it """
+import csv
+import json
+import math
+import time
+import numpy as np
+
+from ringbuffer import RingBuffer
+
+PROFILE_LENGTH = 10000      # steps and frames kept
+OCCUPANCY_EVERY = 100       # steps between two cell occupancy histograms
+# one row per step; times in seconds, start from the creation of the profiler
+STEP_FIELDS = ("step", "start", "move", "broad", "narrow", "reflect", "candidates", "touches", "molecules")
+PHASES = ("move", "broad", "narrow", "reflect")
+COUNTS = ("step", "candidates", "touches", "molecules")
+
+
+def touch_count(touches) -> int:
+    # python engine: a list of pairs; array engines: ball pairs and border pairs as index arrays
+    if touches is None:
+        return 0
+    if isinstance(touches, tuple):
+        return len(touches[0]) + len(touches[2])
+    return len(touches)
+
+
+class Profiler:
+    """ rows of STEP_FIELDS for the last `length` steps and (start, duration) of the last frames drawn.
+        broad and narrow are NaN, and candidates too, when the engine does not tell them apart; the
+        grid phase then is in narrow """
+    def __init__(self, length=PROFILE_LENGTH, occupancy_every=OCCUPANCY_EVERY):
+        self.origin = time.perf_counter()
+        self.steps = RingBuffer(length, shape=(len(STEP_FIELDS),))
+        self.frames = RingBuffer(length, shape=(2,))
+        self.occupancy_every = occupancy_every
+        self.occupancy = []     # occupancy[k]: grid cells holding k objects, at the last sample
+
+    def record_step(self, sim, marks: tuple, broad, touches):
+        # marks: perf_counter at the start, after move, after the touches and after reflect;
+        # broad: (seconds, candidate pairs) or None
+        move, grid, reflect = marks[1] - marks[0], marks[2] - marks[1], marks[3] - marks[2]
+        broad_time, candidates = broad if broad else (math.nan, math.nan)
+        narrow = grid - broad_time if broad else grid
+        self.steps.append((sim.steps, marks[0] - self.origin, move, broad_time, narrow, reflect,
+                           candidates, touch_count(touches), len(sim.molecules)))
+        if self.occupancy_every and sim.steps % self.occupancy_every == 0:
+            grid = sim.engine if hasattr(sim.engine, "cell_occupancy") else sim.grid if sim.engine is None else None
+            if grid is not None:
+                self.occupancy = [int(count) for count in grid.cell_occupancy()]
+
+    def record_frame(self, start: float, end: float):
+        self.frames.append((start - self.origin, end - start))
+
+    def rows(self) -> list[list]:
+        # the kept steps, counts as int and NaN as None
+        rows = self.steps.view().tolist()
+        for row in rows:
+            for k, name in enumerate(STEP_FIELDS):
+                if math.isnan(row[k]):
+                    row[k] = None
+                elif name in COUNTS:
+                    row[k] = int(row[k])
+        return rows
+
+    def columns(self) -> dict[str, np.ndarray]:
+        rows = self.steps.view()
+        return {name: rows[:, k] for k, name in enumerate(STEP_FIELDS)}
+
+    def summary(self) -> dict:
+        # means over the kept steps and frames; times in ms
+        rows, frames = self.columns(), self.frames.view()
+        result = {"steps": len(self.steps), "frames": len(frames)}
+        if len(self.steps) > 1:
+            result["steps_per_second"] = (len(self.steps) - 1) / max(rows["start"][-1] - rows["start"][0], 1e-9)
+        for name in PHASES:
+            result[name + "_ms"] = float(np.mean(rows[name])) * 1000 if len(self.steps) else math.nan
+        for name in ("candidates", "touches"):
+            result[name] = float(np.mean(rows[name])) if len(self.steps) else math.nan
+        if len(frames):
+            result["frame_ms"] = float(frames[:, 1].mean()) * 1000
+        if len(frames) > 1:
+            result["frames_per_second"] = (len(frames) - 1) / max(frames[-1, 0] - frames[0, 0], 1e-9)
+        result["occupancy"] = self.occupancy
+        return result
+
+    def save_csv(self, path: str):
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(STEP_FIELDS)
+            writer.writerows(self.rows())
+
+    def save_json(self, path: str):
+        # NaN becomes null
+        summary = {name: None if isinstance(value, float) and math.isnan(value) else value
+                   for name, value in self.summary().items()}
+        with open(path, 'w') as file:
+            json.dump({"summary": summary, "fields": STEP_FIELDS,
+                       "steps": self.rows(),
+                       "frames": self.frames.view().tolist()}, file)
+
+    def save_chrome_trace(self, path: str):
+        # complete events ("X") of the phases on a physics thread and of the frames on a draw thread,
+        # counters ("C") of candidates and touches; microseconds
+        events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "physics"}},
+                  {"name": "thread_name", "ph": "M", "pid": 1, "tid": 2, "args": {"name": "draw"}}]
+        for row in self.rows():
+            values = dict(zip(STEP_FIELDS, row))
+            start = values["start"]
+            for name in PHASES:
+                duration = values[name]
+                if duration is None:
+                    continue
+                events.append({"name": name, "ph": "X", "pid": 1, "tid": 1, "ts": start * 1e6, "dur": duration * 1e6,
+                               "args": {"step": values["step"]}})
+                start += duration
+            counters = {name: values[name] for name in ("candidates", "touches") if values[name] is not None}
+            events.append({"name": "pairs", "ph": "C", "pid": 1, "ts": values["start"] * 1e6, "args": counters})
+        for start, duration in self.frames.view().tolist():
+            events.append({"name": "frame", "ph": "X", "pid": 1, "tid": 2, "ts": start * 1e6, "dur": duration * 1e6})
+        with open(path, 'w') as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    def save(self, prefix: str):
+        # prefix.json, prefix.csv and prefix.trace.json
+        self.save_json(prefix + ".json")
+        self.save_csv(prefix + ".csv")
+        self.save_chrome_trace(prefix + ".trace.json")
@@ -0,0 +1,35 @@
+""" The Qt names of the physics modules (BorderMolecules, balls, dumbbells): from PyQt5 when it is installed,
+    else plain stand-ins, so scenes can be built and stepped without PyQt5; drawing needs PyQt5 """
+try:
+    from PyQt5.QtCore import Qt, QPointF, QLineF
+    from PyQt5.QtGui import QPainter, QPen, QBrush, QColor
+    HAVE_QT = True
+except ImportError:
+    HAVE_QT = False
+    QLineF = QPainter = QPen = QBrush = QColor = None
+
+    class _Colors:
+        # Qt.red, Qt.darkGreen, ...: the color names
+        def __getattr__(self, name: str) -> str:
+            return name
+
+    Qt = _Colors()
+
+    class QPointF:
+        """ the part of QPointF the physics uses """
+        def __init__(self, x=0., y=0.):
+            self._x, self._y = float(x), float(y)
+
+        def x(self) -> float:
+            return self._x
+
+        def y(self) -> float:
+            return self._y
+
+        def __repr__(self):
+            return f"QPointF({self._x}, {self._y})"
+
+
+def qcolor(color) -> "QColor":
+    # a QColor of a Qt colour, a QColor or an (r, g, b, a) row of the colour columns
+    return QColor(*color) if isinstance(color, tuple) else QColor(color)
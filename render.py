@@ -0,0 +1,181 @@
+""" Batched drawing of molecules: balls as cached sprites grouped by colour and radius,
+    traces as cached QPainterPath chunks extended by the new points only """
+from collections import deque
+import numpy as np
+from PyQt5.QtCore import Qt, QPointF, QRectF
+from PyQt5.QtGui import QPainter, QPen, QBrush, QColor, QPixmap, QPainterPath
+
+from balls import Ball
+from qtcompat import qcolor
+from engine import BallViews
+from ringbuffer import RingBuffer
+
+SPRITE_MARGIN = 2       # pixels around the ball for the antialiased edge
+MAX_SPRITES = 256       # more colour/radius groups are drawn ball by ball
+TRACE_CHUNK = 64        # points per cached trace path, even: a dash never crosses two chunks
+
+
+def sprite_size(r: float, scale=1.) -> int:
+    # side in pixels of the sprite of a ball of radius r drawn at scale
+    return int(2 * r * scale + 2 * SPRITE_MARGIN + 1)
+
+
+def paint_ball(device, color: QColor, r: float, scale=1.):
+    # the picture of Ball.draw at scale, centred in a square QPixmap or QImage of sprite_size(r, scale)
+    device.fill(Qt.transparent)
+    painter = QPainter(device)
+    painter.setRenderHint(QPainter.Antialiasing)
+    painter.translate(device.width() / 2, device.height() / 2)
+    painter.scale(scale, scale)
+    painter.setBrush(QBrush(color))
+    painter.setPen(QPen(Qt.black))
+    painter.drawEllipse(QPointF(0, 0), r, r)
+    painter.setPen(QPen(color))
+    painter.setBrush(QBrush(Qt.white))
+    painter.drawEllipse(QPointF(-r / 3, -r / 3), r / 4, r / 4)
+    painter.end()
+    return device
+
+
+def ball_sprite(color: QColor, r: float) -> QPixmap:
+    size = sprite_size(r)
+    return paint_ball(QPixmap(size, size), color, r)
+
+
+class TraceCache:
+    """ the dashed trace of one molecule as QPainterPath chunks of TRACE_CHUNK points;
+        point k of the trace (counted over the whole run) is joined to point k + 1 for even k """
+    def __init__(self):
+        self.chunks = deque()   # [first point, end point, QPainterPath]
+        self.end = 0            # points up to end are in the chunks
+
+    def update(self, path: RingBuffer):
+        # path.count: points added so far, the last len(path) of them are kept
+        count = path.count
+        first = count - len(path)
+        if count < self.end or first > self.end:
+            self.chunks.clear()     # cleared or jumped: start again
+            self.end = first
+        while self.chunks and self.chunks[0][1] <= first:
+            self.chunks.popleft()
+        if self.chunks and self.chunks[0][0] < first:
+            # the oldest chunk lost some points: rebuild it from the kept ones
+            chunk_end = self.chunks[0][1]
+            self.chunks[0] = [first, first, QPainterPath()]
+            for k, (x, y) in enumerate(path[:chunk_end - first].tolist(), first):
+                self.add_point(self.chunks[0], k, x, y)
+        for k, (x, y) in enumerate(path[self.end - first:].tolist(), self.end):
+            if not self.chunks or k % TRACE_CHUNK == 0:
+                self.chunks.append([k, k, QPainterPath()])
+            self.add_point(self.chunks[-1], k, x, y)
+        self.end = count
+
+    @staticmethod
+    def add_point(chunk: list, k: int, x: float, y: float):
+        if k % 2 == 0:
+            chunk[2].moveTo(x, y)
+        elif k > chunk[0]:
+            chunk[2].lineTo(x, y)
+        chunk[1] = k + 1
+
+    def draw(self, painter: QPainter):
+        for chunk in self.chunks:
+            painter.drawPath(chunk[2])
+
+
+class SceneRenderer:
+    """ draws a list of molecules like their draw methods, in a few batched calls """
+    def __init__(self):
+        self.sprites = {}       # (rgba, r) -> QPixmap
+        self.traces = {}        # molecule -> TraceCache
+        self.key = None
+        self.groups = {}        # (rgba, r) -> balls, their state arrays or None, their rows
+        self.others = []        # molecules drawing themselves
+
+    def regroup(self, molecules):
+        groups, self.others = {}, []
+        for mol in molecules:
+            if isinstance(mol, Ball) and type(mol).draw is Ball.draw:
+                key = (qcolor(mol.color).rgba(), mol.r)
+                if key in groups or len(groups) < MAX_SPRITES:
+                    groups.setdefault(key, []).append(mol)
+                    continue
+            self.others.append(mol)
+        self.groups = {}
+        for key, balls in groups.items():
+            # views of one state: positions are read from the arrays
+            state = getattr(balls[0], "state", None)
+            if state is not None and all(getattr(ball, "state", None) is state for ball in balls):
+                self.groups[key] = (balls, state, [ball.index for ball in balls])
+            else:
+                self.groups[key] = (balls, None, None)
+            if key not in self.sprites:
+                self.sprites[key] = ball_sprite(QColor.fromRgba(key[0]), key[1])
+        self.traces = {mol: self.traces.get(mol) or TraceCache() for balls in groups.values() for mol in balls if mol.trace}
+
+    def draw(self, painter: QPainter, molecules):
+        # groups are rebuilt when the molecule list changes; colours and radii are taken as fixed
+        key = (id(molecules), len(molecules))
+        if key != self.key or any(getattr(balls[0], "state", None) is not state for balls, state, _ in self.groups.values()):
+            self.key = key
+            self.regroup(molecules)
+
+        for mol, trace in self.traces.items():
+            trace.update(mol.path)
+            painter.setPen(QPen(qcolor(mol.color), 2))
+            trace.draw(painter)
+
+        for key, (balls, state, index) in self.groups.items():
+            sprite = self.sprites[key]
+            source = QRectF(sprite.rect())
+            if state is not None:
+                points = zip(state.x[index].tolist(), state.y[index].tolist())
+            else:
+                points = ((ball.x, ball.y) for ball in balls)
+            painter.drawPixmapFragments([QPainter.PixmapFragment.create(QPointF(x, y), source) for x, y in points], sprite)
+
+        for mol in self.others:
+            mol.draw(painter)
+
+
+class SceneCapture:
+    """ what drawing needs from a running Simulation, copied so that another thread can paint it:
+        x, y, v_x, v_y of all balls (the balls of composite molecules included) and the trace points
+        added since the previous capture """
+    def __init__(self, sim):
+        self.balls = [ball for mol in sim.molecules for ball in getattr(mol, "balls", [mol]) if isinstance(ball, Ball)]
+        state = getattr(sim.engine, "balls", None)
+        if state is None and isinstance(sim.molecules, BallViews):
+            state = sim.molecules.state
+        self.state = state if state is not None and len(state) == len(self.balls) else None
+        self.traced = [k for k, ball in enumerate(self.balls) if ball.trace]
+        self.sent = [self.balls[k].path.count for k in self.traced]
+
+    def columns(self) -> dict:
+        # the fixed columns, for BallArrays.from_columns
+        n = len(self.balls)
+        return {"colors": np.array([qcolor(ball.color).getRgb() for ball in self.balls], dtype=np.uint8).reshape(n, 4),
+                **{name: np.fromiter((getattr(ball, name) for ball in self.balls), dtype=np.float64, count=n)
+                   for name in ("m", "r")},
+                **{name: np.fromiter((getattr(ball, name) for ball in self.balls), dtype=bool, count=n)
+                   for name in ("teflon", "trace")}}
+
+    def capture(self) -> tuple:
+        # x, y, v_x, v_y and the new trace points of every traced ball
+        if self.state is not None:
+            columns = tuple(getattr(self.state, name).copy() for name in ("x", "y", "v_x", "v_y"))
+        else:
+            columns = tuple(np.fromiter((getattr(ball, name) for ball in self.balls), dtype=np.float64, count=len(self.balls))
+                            for name in ("x", "y", "v_x", "v_y"))
+        traces = []
+        for n, k in enumerate(self.traced):
+            path = self.balls[k].path
+            new = min(path.count - self.sent[n], len(path))
+            traces.append(path[len(path) - new:].copy())
+            self.sent[n] = path.count
+        return columns + (traces,)
+
+
+def merge_traces(older: list, newer: list) -> list:
+    # the trace points of two captures, when the older one was not drawn
+    return [np.concatenate(pair) for pair in zip(older, newer)]
@@ -0,0 +1,112 @@
+""" Playback of recorded trajectories: frames are copied into the scene of the recording, nothing is simulated """
+import argparse
+import math
+import sys
+
+from engine import BallViews
+from trajectory import Trajectory
+
+SPEEDS = (1/8, 1/4, 1/2, 1, 2, 4, 8, 16, 32)
+SEEK_STEP = 5.      # seconds of simulation time per seek
+
+
+class Replay:
+    """ the current frame of a trajectory shown in its start scene; time runs at speed x wall-clock time,
+        frames falling between two ticks are skipped """
+    def __init__(self, directory: str, speed=1., trace_length=0):
+        self.trajectory = Trajectory(directory)
+        self.borders, self.molecules = self.trajectory.scene()
+        if isinstance(self.molecules, BallViews):
+            self.traced = self.molecules.state.traced()
+        else:
+            self.traced = [mol for mol in self.molecules if mol.trace]
+        self.speed = speed
+        self.trace_length = trace_length
+        self.frame = -1
+        self.time = 0.
+        self.seek(0)
+
+    def __len__(self):
+        return len(self.trajectory)
+
+    def seek(self, frame: int):
+        # jump to a frame; traces of the old position are dropped
+        if len(self.trajectory) == 0:
+            return
+        self.frame = min(max(frame, 0), len(self.trajectory) - 1)
+        self.time = self.trajectory.time[self.frame].item()
+        for molecule in self.traced:
+            molecule.path.clear()
+        self.show_frame()
+
+    def seek_time(self, t: float):
+        self.seek(self.trajectory.frame_at(t))
+
+    def advance(self, wall_dt: float) -> bool:
+        # True if another frame is shown
+        if len(self.trajectory) == 0:
+            return False
+        self.time += self.speed * wall_dt
+        if self.time > self.trajectory.time[-1]:
+            self.trajectory.refresh()       # the run may still be recording
+            self.time = min(self.time, self.trajectory.time[-1].item())
+        frame = self.trajectory.frame_at(self.time)
+        if frame == self.frame:
+            return False
+        self.frame = frame
+        self.show_frame()
+        if self.trace_length:
+            for molecule in self.traced:
+                molecule.add_trace(self.trace_length)
+        return True
+
+    def show_frame(self):
+        frame = self.trajectory[self.frame]
+        x, y, v_x, v_y = frame[:4]
+        if isinstance(self.molecules, BallViews):
+            state = self.molecules.state
+            state.x[:], state.y[:], state.v_x[:], state.v_y[:] = x, y, v_x, v_y
+            return
+        # molecules given by the centre of mass: dumbbell ends are placed on their axis at phi,
+        # older trajectories without phi only move them with the centre
+        phi = frame[4].tolist() if "phi" in self.trajectory.fields else [None] * len(x)
+        for mol, mol_x, mol_y, mol_v_x, mol_v_y, mol_phi in zip(self.molecules, x.tolist(), y.tolist(), v_x.tolist(),
+                                                                v_y.tolist(), phi):
+            balls = getattr(mol, "balls", ())
+            if balls and mol_phi is not None:
+                axis_x, axis_y = mol.d * math.cos(mol_phi), mol.d * math.sin(mol_phi)
+                balls[0].x, balls[0].y = mol_x - mol.c1 * axis_x, mol_y - mol.c1 * axis_y
+                balls[1].x, balls[1].y = mol_x + mol.c2 * axis_x, mol_y + mol.c2 * axis_y
+            else:
+                for ball in balls:
+                    ball.x += mol_x - mol.x
+                    ball.y += mol_y - mol.y
+            mol.x, mol.y, mol.v_x, mol.v_y = mol_x, mol_y, mol_v_x, mol_v_y
+
+    def faster(self):
+        self.speed = next((s for s in SPEEDS if s > self.speed), self.speed)
+
+    def slower(self):
+        self.speed = next((s for s in reversed(SPEEDS) if s < self.speed), self.speed)
+
+    def position(self) -> str:
+        return f"{self.frame + 1}/{len(self.trajectory)}  t={self.time:.2f}  x{self.speed:g}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play back a recorded trajectory.")
+    parser.add_argument("trajectory", help="trajectory directory written by --record or the Record button")
+    parser.add_argument("--speed", type=float, default=1., help="simulation seconds per second")
+    parser.add_argument("--skip-draw", type=int, default=1, help="draw every N-th tick")
+    args = parser.parse_args(argv)
+
+    from PyQt5.QtWidgets import QApplication
+    from billiard8_6 import Envelope
+    app = QApplication(sys.argv)
+    window = Envelope([], [])
+    window.start_replay(args.trajectory, speed=args.speed, skip_draw=args.skip_draw)
+    return app.exec_()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
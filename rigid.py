@@ -0,0 +1,238 @@
+""" Rigid-body engine: balls and dumbbells in NumPy arrays, a dumbbell is a rigid dimer of two end spheres
+    turning about its centre of mass; the broad and narrow phases of ArrayEngine run over the spheres """
+import math
+import numpy as np
+
+from BorderMolecules import Border, Molecule
+from balls import Ball
+from dumbbells import Dumbbell
+from engine import ArrayEngine, conflict_free
+
+MOTION = ("x", "y", "v_x", "v_y")
+
+_rigid_classes = {}
+
+
+def _sphere_property(name: str):
+    # a sphere is placed by its body: setting it moves (or speeds up) the whole body by the difference
+    def getter(self):
+        return getattr(self.rigid, name)[self.sphere].item()
+
+    def setter(self, value):
+        rigid = self.rigid
+        body = rigid.body[self.sphere]
+        getattr(rigid, "body_" + name)[body] += value - getattr(rigid, name)[self.sphere]
+        rigid.place(body)
+    return property(getter, setter)
+
+
+def _body_property(name: str):
+    def getter(self):
+        return getattr(self.rigid, "body_" + name)[self.body].item()
+
+    def setter(self, value):
+        getattr(self.rigid, "body_" + name)[self.body] = value
+        self.rigid.place(self.body)
+    return property(getter, setter)
+
+
+def _angular_momentum(self):
+    # Dumbbell.Lz is clockwise on the screen, omega counter-clockwise
+    return -self.I * self.rigid.body_omega[self.body].item()
+
+
+def _set_angular_momentum(self, value):
+    self.rigid.body_omega[self.body] = -value / self.I
+    self.rigid.place(self.body)
+
+
+def rigid_class(cls: type, kind: str) -> type:
+    # kind "sphere": x, y, v_x, v_y are the rows of the spheres; "body": of the bodies, with Lz
+    cls = getattr(cls, "view_base", cls)
+    if (cls, kind) not in _rigid_classes:
+        make = _sphere_property if kind == "sphere" else _body_property
+        fields = {name: make(name) for name in MOTION}
+        if kind == "body":
+            fields["Lz"] = property(_angular_momentum, _set_angular_momentum)
+        _rigid_classes[cls, kind] = type(cls.__name__, (cls,), {"view_base": cls, **fields})
+    return _rigid_classes[cls, kind]
+
+
+class RigidArrays:
+    """ bodies: centre of mass body_x, body_y, its velocity, the angle body_phi of the axis from the first
+        end to the second, angular velocity body_omega, mass and moment of inertia (0 for a ball);
+        spheres (the balls and the dumbbell ends, in molecule order): body, arm - signed distance from the
+        centre of mass along the axis, m, r, teflon, trace and x, y, v_x, v_y placed from the bodies.
+        The molecules and their balls become views; m, r, teflon and trace are read once """
+    def __init__(self, molecules: list[Molecule]):
+        self.molecules = list(molecules)
+        bodies, spheres = [], []
+        for n, mol in enumerate(self.molecules):
+            if isinstance(mol, Dumbbell):
+                ball0, ball1 = mol.balls
+                mass = ball0.m + ball1.m
+                phi = math.atan2(ball1.y - ball0.y, ball1.x - ball0.x)
+                bodies.append((mol.x, mol.y, mol.v_x, mol.v_y, phi, -mol.Lz / mol.I, mass, mol.I))
+                spheres += [(n, -mol.d * ball1.m / mass, ball0), (n, mol.d * ball0.m / mass, ball1)]
+            elif isinstance(mol, Ball):
+                bodies.append((mol.x, mol.y, mol.v_x, mol.v_y, 0., 0., mol.m, 0.))
+                spheres.append((n, 0., mol))
+            else:
+                raise ValueError("rigid engine supports only Ball and Dumbbell molecules, got " + type(mol).__name__)
+        columns = np.array(bodies, dtype=np.float64).reshape(-1, 8).T
+        (self.body_x, self.body_y, self.body_v_x, self.body_v_y, self.body_phi, self.body_omega,
+         self.body_m, self.body_inertia) = (column.copy() for column in columns)
+        self.body_inverse_inertia = np.divide(1., self.body_inertia, out=np.zeros(len(bodies)), where=self.body_inertia > 0)
+        self.balls = [ball for _, _, ball in spheres]
+        n = len(spheres)
+        self.body = np.fromiter((body for body, _, _ in spheres), dtype=np.int64, count=n)
+        self.arm = np.fromiter((arm for _, arm, _ in spheres), dtype=np.float64, count=n)
+        self.first = np.searchsorted(self.body, np.arange(len(bodies) + 1))     # spheres of body k: first[k]:first[k + 1]
+        self.m = np.fromiter((b.m for b in self.balls), dtype=np.float64, count=n)
+        self.r = np.fromiter((b.r for b in self.balls), dtype=np.float64, count=n)
+        self.teflon = np.fromiter((b.teflon for b in self.balls), dtype=bool, count=n)
+        self.trace = np.fromiter((b.trace for b in self.balls), dtype=bool, count=n)
+        self.x, self.y, self.v_x, self.v_y = (np.empty(n) for _ in MOTION)
+        self.place()
+        for k, ball in enumerate(self.balls):
+            for name in MOTION:
+                ball.__dict__.pop(name, None)
+            ball.rigid, ball.sphere = self, k
+            ball.__class__ = rigid_class(type(ball), "sphere")
+        for k, mol in enumerate(self.molecules):
+            if isinstance(mol, Dumbbell):
+                for name in MOTION + ("Lz",):
+                    mol.__dict__.pop(name, None)
+                mol.rigid, mol.body = self, k
+                mol.__class__ = rigid_class(type(mol), "body")
+
+    def __len__(self):
+        return len(self.x)
+
+    def place(self, body=None):
+        # positions and velocities of the spheres (of one body) from the bodies: one rotation for all
+        rows = slice(None) if body is None else slice(self.first[body], self.first[body + 1])
+        b = self.body[rows]
+        phi, omega = self.body_phi[b], self.body_omega[b]
+        arm_x, arm_y = self.arm[rows] * np.cos(phi), self.arm[rows] * np.sin(phi)
+        self.x[rows] = self.body_x[b] + arm_x
+        self.y[rows] = self.body_y[b] + arm_y
+        self.v_x[rows] = self.body_v_x[b] - omega * arm_y
+        self.v_y[rows] = self.body_v_y[b] + omega * arm_x
+
+    def traced(self) -> list[Molecule]:
+        # molecules with a trace and traced dumbbell ends
+        return [mol for mol in self.molecules if mol.trace] + \
+            [self.balls[k] for k in np.nonzero(self.trace)[0].tolist() if self.arm[k] != 0]
+
+    def kinetic_energy(self) -> float:
+        return float((self.body_m * (self.body_v_x ** 2 + self.body_v_y ** 2) + self.body_inertia * self.body_omega ** 2).sum() / 2)
+
+    def release(self):
+        # turn the views back into plain objects holding their current values
+        values = [{name: getattr(ball, name) for name in MOTION} for ball in self.balls]
+        bodies = {k: {name: getattr(mol, name) for name in MOTION + ("Lz",)}
+                  for k, mol in enumerate(self.molecules) if isinstance(mol, Dumbbell)}
+        for ball, ball_values in zip(self.balls, values):
+            ball.__class__ = type(ball).view_base
+            del ball.rigid, ball.sphere
+            ball.__dict__.update(ball_values)
+        for k, body_values in bodies.items():
+            mol = self.molecules[k]
+            mol.__class__ = type(mol).view_base
+            del mol.rigid, mol.body
+            mol.__dict__.update(body_values)
+            mol.moving = False      # Dumbbell.move turns it by the new Lz
+        self.balls, self.molecules = [], []
+
+
+class RigidEngine(ArrayEngine):
+    """ balls and rigid dumbbells: the bodies move and turn in one batch, the spheres are found touching
+        as by ArrayEngine (the ends of one dumbbell never touch each other) and reflected by an impulse
+        along the line of centres that changes the velocity and the rotation; elastic, so energy and
+        momentum are kept. A teflon contact that became separating after an earlier impulse of the same
+        step is not reflected again """
+    def __init__(self, molecules: list[Molecule], borders: list[Border], cell_size=None, narrow_phase="auto", skin=None):
+        super().__init__([], borders, cell_size, narrow_phase, skin)
+        self.balls = RigidArrays(molecules)
+        self.traced = self.balls.traced()
+
+    def advance(self, rows: slice, dt: float, g: float):
+        # the bodies of the spheres in rows: all of them (slice(None)) or of a few given spheres
+        s = self.balls
+        bodies = rows if isinstance(rows, slice) else np.unique(s.body[rows])
+        s.body_x[bodies] += s.body_v_x[bodies] * dt
+        s.body_y[bodies] += s.body_v_y[bodies] * dt + g * dt*dt/2
+        s.body_v_y[bodies] += g * dt
+        s.body_phi[bodies] += s.body_omega[bodies] * dt
+        s.place()
+
+    def substep(self, fast: np.ndarray, dt: float, substeps: int, g=0.):
+        # a fast end takes its dumbbell along: all spheres of the fast bodies are checked
+        s = self.balls
+        super().substep(np.nonzero(np.isin(s.body, s.body[fast]))[0], dt, substeps, g)
+
+    def touches(self, pairs: tuple, border_pairs: tuple) -> tuple:
+        i, j = pairs
+        other = self.balls.body[i] != self.balls.body[j]
+        return super().touches((i[other], j[other]), border_pairs)
+
+    def reflect(self, touches):
+        i, j, bi, bk = touches
+        s = self.balls
+        for batch in conflict_free(s.body[i], s.body[j]):
+            self.reflect_spheres(i[batch], j[batch])
+        for batch in conflict_free(s.body[bi]):
+            self.reflect_borders(bi[batch], bk[batch])
+        s.place()
+
+    def contact_velocity(self, a: np.ndarray) -> tuple:
+        # offset of the spheres from the centres of mass and the velocity of the bodies there
+        s = self.balls
+        body = s.body[a]
+        arm_x, arm_y = s.x[a] - s.body_x[body], s.y[a] - s.body_y[body]
+        omega = s.body_omega[body]
+        return arm_x, arm_y, s.body_v_x[body] - omega * arm_y, s.body_v_y[body] + omega * arm_x
+
+    def push(self, a: np.ndarray, impulse: np.ndarray, nx: np.ndarray, ny: np.ndarray, lever: np.ndarray):
+        # impulse * n at the sphere: the body speeds up by impulse / m and turns by impulse * lever / I
+        s = self.balls
+        body = s.body[a]
+        s.body_v_x[body] += impulse * nx / s.body_m[body]
+        s.body_v_y[body] += impulse * ny / s.body_m[body]
+        s.body_omega[body] += impulse * lever * s.body_inverse_inertia[body]
+
+    def reflect_spheres(self, a: np.ndarray, b: np.ndarray):
+        # bodies of a batch are all different; for two balls the same as Ball.reflect_ball
+        s = self.balls
+        body_a, body_b = s.body[a], s.body[b]
+        arm_ax, arm_ay, v_ax, v_ay = self.contact_velocity(a)
+        arm_bx, arm_by, v_bx, v_by = self.contact_velocity(b)
+        dvx, dvy = v_ax - v_bx, v_ay - v_by
+        nx, ny = s.x[a] - s.x[b], s.y[a] - s.y[b]
+        # spheres at one point: along the relative velocity
+        same = (nx == 0) & (ny == 0)
+        nx, ny = np.where(same, -dvx, nx), np.where(same, -dvy, ny)
+        length = np.hypot(nx, ny)
+        length[length == 0] = np.inf
+        nx, ny = nx / length, ny / length
+        lever_a, lever_b = arm_ax * ny - arm_ay * nx, arm_bx * ny - arm_by * nx
+        approach = dvx * nx + dvy * ny
+        mass = 1 / s.body_m[body_a] + 1 / s.body_m[body_b] + \
+            lever_a * lever_a * s.body_inverse_inertia[body_a] + lever_b * lever_b * s.body_inverse_inertia[body_b]
+        impulse = np.where((s.teflon[a] | s.teflon[b]) & (approach > 0), 0., -2 * approach / mass)
+        self.push(a, impulse, nx, ny, lever_a)
+        self.push(b, -impulse, nx, ny, lever_b)
+
+    def reflect_borders(self, i: np.ndarray, k: np.ndarray):
+        # a border does not move; for a ball the same as Ball.reflect_border, momentum goes to Border.current_momentum
+        s = self.balls
+        body = s.body[i]
+        arm_x, arm_y, v_x, v_y = self.contact_velocity(i)
+        nx, ny = self.b_nx[k], self.b_ny[k]
+        dot = v_x * nx + v_y * ny
+        lever = arm_x * ny - arm_y * nx
+        mass = 1 / s.body_m[body] + lever * lever * s.body_inverse_inertia[body]
+        impulse = np.where((s.teflon[i] | self.b_teflon[k]) & (dot > 0), 0., -2 * dot / mass)
+        self.push(i, impulse, nx, ny, lever)
+        self.add_momentum(np.bincount(k, weights=impulse, minlength=len(self.borders)))
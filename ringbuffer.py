@@ -0,0 +1,71 @@
+""" Fixed-capacity NumPy ring buffer for traces and pressure stacks """
+import math
+import numpy as np
+
+
+class RingBuffer:
+    """ the last `capacity` values; every value is stored twice, at i and i + capacity, so the kept values
+        are always one contiguous slice (view()). The running sum makes mean() O(1). Memory is taken on
+        the first append, so untraced molecules cost nothing """
+    def __init__(self, capacity=0, shape=(), dtype=np.float64):
+        self.capacity = capacity
+        self.shape = shape
+        self.dtype = dtype
+        self.data = None
+        self.start = 0
+        self.length = 0
+        self.count = 0          # values appended so far, including the dropped ones
+        self.total = 0.         # running sum, resynchronised every `capacity` appends against drift
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.view()[index]
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def view(self) -> np.ndarray:
+        if self.data is None:
+            return np.empty((0,) + self.shape, dtype=self.dtype)
+        return self.data[self.start:self.start + self.length]
+
+    def append(self, value):
+        capacity = self.capacity
+        if capacity == 0:
+            return
+        if self.data is None:
+            self.data = np.zeros((2 * capacity,) + self.shape, dtype=self.dtype)
+        if self.length == capacity:
+            if not self.shape:
+                self.total -= self.data[self.start].item()
+            self.start = self.start + 1 if self.start + 1 < capacity else 0
+        else:
+            self.length += 1
+        end = self.start + self.length - 1
+        if end >= capacity:
+            end -= capacity
+        self.data[end] = self.data[end + capacity] = value
+        self.count += 1
+        if not self.shape:
+            self.total += float(value)
+            if self.count % capacity == 0:
+                self.total = math.fsum(self.view().tolist())
+
+    def mean(self) -> float:
+        return self.total / self.length if self.length else 0.
+
+    def clear(self):
+        self.start = self.length = 0
+        self.total = 0.
+
+    def resize(self, capacity: int):
+        # keeps the newest values
+        kept = self.view()[-capacity:].copy() if capacity else self.view()[:0]
+        count = self.count
+        self.capacity, self.data = capacity, None
+        self.clear()
+        for value in kept:
+            self.append(value)
+        self.count = count
@@ -10,6 +10,7 @@ def reverse_v(win: Envelope):
     for molecule in win.molecules:
         molecule.v_x *= -1
         molecule.v_y *= -1
+    win.observables.invalidate()
     win.update()
 
 
@@ -30,15 +31,13 @@ window.add_param_button(
 window.add_save_button("TwoBallons", file_number=4)
 window.add_plot_button("Pressure", 
                        [
-                           ("top left", lambda w: w.borders[0].get_pressure()),
-                           ("bottom left", lambda w: w.borders[10].get_pressure()),
-                           ("top right", lambda w: w.borders[4].get_pressure()),
-                           ("bottom right", lambda w: w.borders[6].get_pressure())
+                           ("top left", "pressure[0]"),
+                           ("bottom left", "pressure[10]"),
+                           ("top right", "pressure[4]"),
+                           ("bottom right", "pressure[6]")
                        ], func_interval=(0,150), t_interval=(0,200))
 window.right_menu.add_button("Reverse", lambda: reverse_v(window))
-window.add_histogram_button(label = "Energy", histogram_func=lambda mol: mol.W()
-                            # - mol.M() * mol.y * GRAVITY
-                            , skip=20)
+window.add_histogram_button(label = "Energy", histogram_func="kinetic_energy", skip=20)
 
-window.start_moving(dt=0.02, g=10, skip_draw=2)
+window.start_moving(dt=0.02, g=10, skip_draw=2, engine="numpy")
 sys.exit(app.exec_())
@@ -0,0 +1,265 @@
+""" Start states: N non-overlapping balls of one or more species inside a container of borders at a packing
+    fraction, Maxwell velocities with zero total momentum; as Ball objects for Envelope, as columns or as a
+    scene file / snapshot. Random sequential addition in batches over a cell grid, or a triangular lattice
+    with jitter for dense starts; 10^6 balls take seconds """
+import argparse
+import math
+import numpy as np
+
+from BorderMolecules import Border
+from balls import Ball
+from borderindex import BorderIndex, segment_distance
+from engine import cell_pairs
+from qtcompat import Qt, QPointF
+
+SPECIES_COLORS = (Qt.blue, Qt.red, Qt.darkGreen, Qt.magenta, Qt.darkYellow, Qt.cyan)
+MAX_RANDOM_PACKING = 0.4    # "auto": random addition up to this packing (it jams at about 0.55), denser - the lattice
+BATCH_FACTOR = 2.           # random addition: candidates per missing ball in one round
+MAX_ROUNDS = 200
+LATTICE_SHRINK = 0.97       # lattice spacing step while the sites are too few
+
+
+class Species:
+    """ balls of mass m and radius r, `fraction` of the generated ones """
+    def __init__(self, m: float, r: float, fraction=1., color=None, teflon=True):
+        self.m, self.r, self.fraction = m, r, fraction
+        self.color, self.teflon = color, teflon
+
+
+def polygon_borders(points: list[tuple], stack_size=100) -> list[Border]:
+    # the closed polygon of Envelope(points, ...)
+    points = [QPointF(*p) for p in points]
+    return [Border(points[i], points[(i + 1) % len(points)], stack_size=stack_size) for i in range(len(points))]
+
+
+def border_arrays(borders: list[Border]) -> tuple:
+    return tuple(np.array([getattr(getattr(b, p), c)() for b in borders], dtype=np.float64)
+                 for p, c in (("p1", "x"), ("p1", "y"), ("p2", "x"), ("p2", "y")))
+
+
+def polygon_area(borders: list[Border]) -> float:
+    # shoelace over the segments; closed loops, nested ones subtract by their orientation
+    x1, y1, x2, y2 = border_arrays(borders)
+    return abs(float((x1 * y2 - x2 * y1).sum())) / 2
+
+
+def inside_polygon(x: np.ndarray, y: np.ndarray, borders: list[Border]) -> np.ndarray:
+    # even-odd rule; points sorted by y, so every segment looks only at the points of its y range
+    inside = np.zeros(len(x), dtype=bool)
+    order = np.argsort(y, kind="stable")
+    sorted_y = y[order]
+    for x1, y1, x2, y2 in zip(*(column.tolist() for column in border_arrays(borders))):
+        if y1 == y2:
+            continue
+        # the crossing test (y1 > y) != (y2 > y) holds for min <= y < max
+        rows = order[np.searchsorted(sorted_y, min(y1, y2), "left"):np.searchsorted(sorted_y, max(y1, y2), "left")]
+        x_cross = x1 + (y[rows] - y1) * (x2 - x1) / (y2 - y1)
+        inside[rows] ^= x[rows] < x_cross
+    return inside
+
+
+def clear_of_walls(x: np.ndarray, y: np.ndarray, reach: np.ndarray, index: BorderIndex) -> np.ndarray:
+    # points farther than reach from every segment
+    i, k = index.candidates(x, y, reach)
+    near = segment_distance(x[i], y[i], index.x1[k], index.y1[k], index.x2[k], index.y2[k]) <= reach[i]
+    clear = np.ones(len(x), dtype=bool)
+    clear[i[near]] = False
+    return clear
+
+
+def species_counts(species: list[Species], n: int) -> np.ndarray:
+    # n split by the fractions, largest remainders first
+    share = np.array([s.fraction for s in species], dtype=np.float64)
+    share = n * share / share.sum()
+    counts = np.floor(share).astype(np.int64)
+    counts[np.argsort(counts - share)[:n - counts.sum()]] += 1
+    return counts
+
+
+def ball_count(borders: list[Border], species: list[Species], packing: float) -> int:
+    # balls covering `packing` of the container
+    fraction = np.array([s.fraction for s in species], dtype=np.float64)
+    area = np.array([math.pi * s.r * s.r for s in species])
+    return int(packing * polygon_area(borders) * fraction.sum() / (fraction * area).sum())
+
+
+def random_sites(borders: list[Border], r: np.ndarray, rng) -> tuple:
+    # random sequential addition, largest balls first; every round draws candidates in the bounds and drops
+    # those outside, near a wall or on a placed ball, and the later one of two overlapping candidates.
+    # Placed balls are kept in a dense grid of cells so small that each holds at most one centre
+    x1, y1, x2, y2 = border_arrays(borders)
+    low_x, low_y = min(x1.min(), x2.min()), min(y1.min(), y2.min())
+    high_x, high_y = max(x1.max(), x2.max()), max(y1.max(), y2.max())
+    index = BorderIndex(x1, y1, x2, y2, float(r.max()))
+    cell = math.sqrt(2) * float(r.min())
+    r_max = float(r.max())
+    # padded by the widest reach, so neighbouring cells of a point in the bounds are never out of the grid
+    pad = math.ceil(2 * r_max / cell) + 1
+    cols, rows = int((high_x - low_x) // cell) + 1 + 2 * pad, int((high_y - low_y) // cell) + 1 + 2 * pad
+    owner = np.full(rows * cols, -1, dtype=np.int64)
+    x, y = np.empty(len(r)), np.empty(len(r))
+    placed = 0
+    for radius in np.unique(r)[::-1].tolist():
+        slots = np.nonzero(r == radius)[0]
+        # the cells that may hold the centre of a placed ball touching a candidate, nearest first
+        reach = math.ceil((radius + r_max) / cell)
+        offsets = sorted((math.hypot(dc, dr), dr * cols + dc) for dc in range(-reach, reach + 1) for dr in range(-reach, reach + 1)
+                         if cell * math.hypot(max(abs(dc) - 1, 0), max(abs(dr) - 1, 0)) < radius + r_max)
+        filled, rounds = 0, 0
+        while filled < len(slots):
+            rounds += 1
+            if rounds > MAX_ROUNDS:
+                raise ValueError(f"only {placed + filled} of {len(r)} balls placed at random, try the lattice")
+            missing = len(slots) - filled
+            draw = int(BATCH_FACTOR * missing) + 16
+            cx, cy = rng.uniform(low_x, high_x, draw), rng.uniform(low_y, high_y, draw)
+            key = ((cy - low_y) // cell).astype(np.int64) * cols + ((cx - low_x) // cell).astype(np.int64) + pad * (cols + 1)
+            # placed balls first: most candidates fall out at the nearest cells
+            for _, shift in offsets:
+                other = owner[key + shift]
+                near = np.nonzero(other >= 0)[0]
+                if len(near):
+                    other = other[near]
+                    free = np.ones(len(key), dtype=bool)
+                    free[near[np.hypot(cx[near] - x[other], cy[near] - y[other]) < radius + r[other]]] = False
+                    cx, cy, key = cx[free], cy[free], key[free]
+            ok = inside_polygon(cx, cy, borders)
+            cx, cy, key = cx[ok], cy[ok], key[ok]
+            ok = clear_of_walls(cx, cy, np.full(len(cx), radius), index)
+            cx, cy, key = cx[ok], cy[ok], key[ok]
+            keep = np.ones(len(cx), dtype=bool)
+            i, j = cell_pairs(cx, cy, 2 * radius)
+            keep[np.maximum(i, j)[np.hypot(cx[i] - cx[j], cy[i] - cy[j]) < 2 * radius]] = False
+            keep = np.nonzero(keep)[0][:missing]
+            new = slots[filled:filled + len(keep)]
+            x[new], y[new] = cx[keep], cy[keep]
+            owner[key[keep]] = new
+            filled += len(keep)
+        placed += len(slots)
+    return x, y
+
+
+def lattice_sites(borders: list[Border], r: np.ndarray, rng) -> tuple:
+    # random sites of a triangular lattice, as coarse as gives enough sites half a spacing away from
+    # the walls; a ball of radius r moves up to spacing / 2 - r off its site, so no two can overlap
+    n, r_max = len(r), float(r.max())
+    x1, y1, x2, y2 = border_arrays(borders)
+    low_x, low_y = min(x1.min(), x2.min()), min(y1.min(), y2.min())
+    high_x, high_y = max(x1.max(), x2.max()), max(y1.max(), y2.max())
+    spacing = math.sqrt(2 * polygon_area(borders) / (math.sqrt(3) * n))
+    index = BorderIndex(x1, y1, x2, y2, spacing / 2)
+    ok = np.zeros(0, dtype=bool)
+    while True:
+        if spacing < 2 * r_max:
+            raise ValueError(f"only {int(ok.sum())} places for {n} balls of radius up to {r_max}")
+        rows = np.arange(low_y + spacing / 2, high_y, spacing * math.sqrt(3) / 2)
+        gx, gy = np.meshgrid(np.arange(low_x + spacing / 2, high_x, spacing), rows)
+        gx = gx + (np.arange(len(rows)) % 2)[:, None] * spacing / 2
+        sx, sy = gx.ravel(), gy.ravel()
+        ok = inside_polygon(sx, sy, borders)
+        ok[ok] = clear_of_walls(sx[ok], sy[ok], np.full(int(ok.sum()), spacing / 2), index)
+        if ok.sum() >= n:
+            break
+        spacing *= LATTICE_SHRINK
+    sites = rng.choice(np.nonzero(ok)[0], n, replace=False)
+    jitter = (spacing / 2 - r) * np.sqrt(rng.uniform(size=n))
+    angle = rng.uniform(0, 2 * math.pi, n)
+    return sx[sites] + jitter * np.cos(angle), sy[sites] + jitter * np.sin(angle)
+
+
+def maxwell_velocities(m: np.ndarray, temperature: float, rng) -> tuple:
+    # Maxwell velocities (k = 1) with zero total momentum
+    v = rng.normal(size=(len(m), 2)) * np.sqrt(temperature / m)[:, None]
+    v -= (m[:, None] * v).sum(axis=0) / m.sum()
+    return v[:, 0].copy(), v[:, 1].copy()
+
+
+def generate(borders: list[Border], species: list[Species], n=None, packing=None, temperature=1000., rng=None,
+             method="auto") -> dict[str, np.ndarray]:
+    # columns x, y, v_x, v_y, m, r and species (index into species) of n balls, or of as many as cover
+    # `packing` of the container; method: "random", "lattice" or "auto" - by the packing
+    rng = np.random.default_rng(rng)
+    if method not in ("auto", "random", "lattice"):
+        raise ValueError(f"unknown method {method!r}")
+    if n is None:
+        if packing is None:
+            raise ValueError("give the number of balls or the packing fraction")
+        n = ball_count(borders, species, packing)
+    kind = rng.permutation(np.repeat(np.arange(len(species)), species_counts(species, n)))
+    m = np.array([s.m for s in species], dtype=np.float64)[kind]
+    r = np.array([s.r for s in species], dtype=np.float64)[kind]
+    if n == 0:
+        x = y = np.empty(0)
+    else:
+        if method == "auto":
+            covered = float((np.pi * r * r).sum()) / polygon_area(borders)
+            method = "random" if covered <= MAX_RANDOM_PACKING else "lattice"
+        x, y = (random_sites if method == "random" else lattice_sites)(borders, r, rng)
+    v_x, v_y = maxwell_velocities(m, temperature, rng) if n else (np.empty(0), np.empty(0))
+    return {"x": x, "y": y, "v_x": v_x, "v_y": v_y, "m": m, "r": r, "species": kind}
+
+
+def species_colors(species: list[Species]) -> list:
+    return [s.color if s.color is not None else SPECIES_COLORS[k % len(SPECIES_COLORS)] for k, s in enumerate(species)]
+
+
+def make_balls(columns: dict[str, np.ndarray], species: list[Species]) -> list[Ball]:
+    # Ball objects, e.g. the molecules of Envelope(points, molecules)
+    colors, teflon = species_colors(species), [s.teflon for s in species]
+    return [Ball(m, r, x, y, v_x, v_y, color=colors[k], teflon=teflon[k]) for x, y, v_x, v_y, m, r, k in zip(
+        *(columns[name].tolist() for name in ("x", "y", "v_x", "v_y", "m", "r", "species")))]
+
+
+def save_scene(path: str, borders: list[Border], columns: dict[str, np.ndarray], species: list[Species]):
+    # a snapshot (path ending with .snap) or a text scene file, without making Ball objects
+    from PyQt5.QtGui import QColor
+    import snapshot
+    from simulation import Simulation
+    kind = columns["species"]
+    colors = np.array([QColor(color).getRgb() for color in species_colors(species)], dtype=np.uint8).reshape(-1, 4)[kind]
+    teflon = np.array([s.teflon for s in species], dtype=bool)[kind]
+    if path.endswith(snapshot.SNAPSHOT_SUFFIX):
+        scene = snapshot.scene_columns(borders, [])
+        for name in snapshot.BALL_COLUMNS:
+            scene["ball/" + name] = columns[name]
+        scene.update({"ball/teflon": teflon, "ball/trace": np.zeros(len(kind), dtype=bool), "ball/color": colors})
+        snapshot.write_snapshot(path, scene)
+        return
+    Simulation(borders, []).save_to_file(path)
+    # the lines of Simulation.save_to_file: Ball r g b a teflon x y v_x v_y trace m r
+    table = np.column_stack((colors, teflon, columns["x"], columns["y"], columns["v_x"], columns["v_y"],
+                             np.zeros(len(kind)), columns["m"], columns["r"]))
+    with open(path, 'a') as file:
+        np.savetxt(file, table, fmt="Ball %d %d %d %d %d %.17g %.17g %.17g %.17g %d %.17g %.17g")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill a container with non-overlapping balls.")
+    parser.add_argument("container", nargs="?", help="scene file whose borders are the container (.txt may be omitted)")
+    parser.add_argument("--box", nargs=2, type=float, metavar=("WIDTH", "HEIGHT"), help="a rectangular container instead")
+    parser.add_argument("-n", type=int, help="number of balls")
+    parser.add_argument("--packing", type=float, help="area fraction covered by balls, instead of -n")
+    parser.add_argument("--species", nargs=3, type=float, action="append", metavar=("M", "R", "FRACTION"),
+                        help="mass, radius and fraction of a species; repeat for more species")
+    parser.add_argument("--temperature", type=float, default=1000.)
+    parser.add_argument("--method", choices=("auto", "random", "lattice"), default="auto")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="scene.snap", help="scene file: .snap - a snapshot, else text")
+    args = parser.parse_args(argv)
+    if args.box:
+        width, height = args.box
+        borders = polygon_borders([(0, 0), (width, 0), (width, height), (0, height)])
+    elif args.container:
+        from simulation import Simulation
+        borders = Simulation.from_file(args.container).borders
+    else:
+        parser.error("give a container scene or --box")
+    species = [Species(m, r, fraction) for m, r, fraction in args.species or [(2., 5., 1.)]]
+
+    columns = generate(borders, species, args.n, args.packing, args.temperature, args.seed, args.method)
+    save_scene(args.out, borders, columns, species)
+    print(f"{len(columns['x'])} balls written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
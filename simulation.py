@@ -0,0 +1,475 @@
+""" GUI-free simulation core: the state and the step of Envelope, usable without widgets or a display """
+import argparse
+import itertools
+import os
+import sys
+import time
+import numpy as np
+
+from BorderMolecules import Border, Molecule, LevelGrid, NeighbourList
+from balls import Ball
+from borderindex import BorderIndex
+from dumbbells import Dumbbell
+from engine import ArrayEngine, BallViews
+from events import EventEngine
+from observables import Observables, OBSERVABLES
+from parallel import ParallelEngine
+from profiling import Profiler, PROFILE_LENGTH
+from qtcompat import QPointF, qcolor
+from rigid import RigidEngine
+import snapshot
+from trajectory import TrajectoryWriter
+
+# Constants
+TRACE_FREQUENCY = 6
+TRACE_LENGTH = 2500
+COURANT = 0.5           # adaptive steps: a ball moves at most this part of the smallest radius (or cell) per step
+MAX_FAST_BALLS = 32     # adaptive steps with substeps: so many fastest balls may be substepped
+ENGINES = {"python": None, "numpy": ArrayEngine, "events": EventEngine, "parallel": ParallelEngine, "rigid": RigidEngine}
+
+
+class Simulation:
+    def __init__(self, borders: list[Border], molecules: list[Molecule], trace_length=TRACE_LENGTH):
+        self.borders = borders
+        self.molecules = molecules
+
+        self.trace_count = 0
+        self.trace_length = trace_length
+        self.dt = 0.05  # default value of dt; with adaptive steps the largest one
+        self.last_dt = self.dt
+        self.adaptive = False   # dt of every step from the speeds, see set_adaptive
+        self.courant = COURANT
+        self.substeps = 0
+        self.g = 0.
+        self.time = 0.
+        self.steps = 0
+        self.engine_name = "python"
+        self.engine = None   # None: per-object Python stepping
+        self.recorders = []  # called after every step
+        self.skin = None     # Verlet lists with this skin, None - a new broad phase every step
+        self.tuning = False  # timed tuning of the grid cell of the array engines, see set_tuning
+        self.profiler = None    # Profiler of every step, see start_profiling
+        self.observables = Observables(self)
+        self.reset_grid()
+
+        # =========== timing =============
+        self.time_moving = 0.
+        self.time_grid = 0.
+        self.time_reflect = 0.
+
+    @classmethod
+    def from_file(cls, file_name: str, **kwargs):
+        sim = cls([], [], **kwargs)
+        sim.load_from_file(file_name)
+        return sim
+
+    def bounds(self) -> tuple:
+        bnd = [obj.get_bounds() for obj in self.borders]
+        if isinstance(self.molecules, BallViews):
+            s = self.molecules.state
+            if len(s):
+                bnd.append((float((s.x - s.r).min()), float((s.y - s.r).min()), float((s.x + s.r).max()), float((s.y + s.r).max())))
+        else:
+            bnd += [mol.get_bounds() for mol in self.molecules]
+        if len(bnd) == 0:
+            return (0, 0, 0, 0)
+        return (min([b[0] for b in bnd]), min([b[1] for b in bnd]), max([b[2] for b in bnd]), max([b[3] for b in bnd]))
+
+    def cell_size(self):
+        # the finest level of the grid: cells fit all but the largest molecules, but not more than
+        # two typical ones; larger molecules go to the coarser levels
+        if len(self.molecules) > 0:
+            if isinstance(self.molecules, BallViews):
+                extents = 2 * self.molecules.state.r
+            else:
+                extents = np.array([max(bnd[2] - bnd[0], bnd[3] - bnd[1]) for bnd in (mol.get_bounds() for mol in self.molecules)])
+            return max(min(float(np.percentile(extents, 99, method="lower")), 2 * float(np.median(extents))), 1)
+        else:
+            min_x, min_y, max_x, max_y = self.bounds()
+            return max(min([max_x - min_x, max_y - min_y]), 1)
+
+    def reset_grid(self):
+        # the molecule grid; borders go into a static index built on first use
+        min_x, min_y, max_x, max_y = self.bounds()
+        cell = self.cell_size()
+        if self.skin:
+            self.grid = NeighbourList(max_x, max_y, cell, self.skin)
+        else:
+            self.grid = LevelGrid(max_x, max_y, cell)
+        self.grid_cell = cell
+        self.border_index = None
+
+    @property
+    def borders(self) -> list[Border]:
+        return self._borders
+
+    @borders.setter
+    def borders(self, borders: list[Border]):
+        # a new border list drops the border index; borders are replaced by assigning a new list
+        self._borders = borders
+        self.border_index = None
+
+    def border_pairs(self, bounds=None) -> list:
+        # (molecule, border) pairs that may touch; a molecule reaches at most its bounds diagonal from its centre;
+        # bounds: of the molecules, if known
+        if self.border_index is None:
+            ends = np.array([(b.p1.x(), b.p1.y(), b.p2.x(), b.p2.y()) for b in self.borders], dtype=np.float64).reshape(-1, 4)
+            self.border_index = BorderIndex(*ends.T, 1.5 * self.grid_cell)
+        if bounds is None:
+            bounds = [mol.get_bounds() for mol in self.molecules]
+        bounds = np.fromiter(itertools.chain.from_iterable(bounds), dtype=np.float64, count=4 * len(bounds)).reshape(-1, 4)
+        i, k = self.border_index.candidates((bounds[:, 0] + bounds[:, 2]) / 2, (bounds[:, 1] + bounds[:, 3]) / 2,
+                                            np.hypot(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1]))
+        return [(self.molecules[a], self.borders[b]) for a, b in zip(i.tolist(), k.tolist())]
+
+    def candidates(self):
+        # broad phase of the python engine: molecule pairs from the grid, (molecule, border) pairs from the border index
+        self.grid.clear()
+        bounds = [obj.get_bounds() for obj in self.molecules]
+        for obj, obj_bounds in zip(self.molecules, bounds):
+            self.grid.add_object(obj, bounds=obj_bounds)
+        return itertools.chain(self.grid.get_possible_collisions(), self.border_pairs(bounds))
+
+    def set_engine(self, engine: str):
+        if engine not in ENGINES:
+            raise ValueError(f"unknown engine {engine!r}, expected one of {list(ENGINES)}")
+        if self.engine is not None:
+            self.engine.release()
+        self.engine_name = engine
+        self.make_engine()
+
+    def make_engine(self):
+        # an engine of engine_name for the current scene, with the skin and the profiling of the simulation
+        engine = ENGINES[self.engine_name]
+        self.engine = engine(self.molecules, self.borders) if engine else None
+        if hasattr(self.engine, "skin"):
+            self.engine.skin = self.skin
+        if hasattr(self.engine, "tuning"):
+            self.engine.tuning = self.tuning
+        if hasattr(self.engine, "profiling"):
+            self.engine.profiling = self.profiler is not None
+
+    def start_profiling(self, length=PROFILE_LENGTH, **kwargs) -> Profiler:
+        # phase timings and counters of the last `length` steps, see profiling.py
+        self.profiler = Profiler(length, **kwargs)
+        if hasattr(self.engine, "profiling"):
+            self.engine.profiling = True
+        return self.profiler
+
+    def stop_profiling(self):
+        self.profiler = None
+        if hasattr(self.engine, "profiling"):
+            self.engine.profiling = False
+
+    def set_skin(self, skin):
+        # Verlet lists for the python and numpy engines: pairs less than skin apart are kept and
+        # checked until a molecule has moved by skin / 2; None - a new broad phase every step
+        self.skin = skin
+        self.reset_grid()
+        if hasattr(self.engine, "skin"):
+            self.engine.skin = skin
+
+    def set_tuning(self, tuning=True):
+        # numpy, parallel and rigid engines: every TUNE_PERIOD steps (engine.py) the broad phase is timed with a smaller
+        # and a larger grid cell and the fastest is kept; off - a fixed cell, the same run on every machine
+        self.tuning = tuning
+        if hasattr(self.engine, "tuning"):
+            self.engine.tuning = tuning
+
+    def set_adaptive(self, adaptive=True, courant=COURANT, substeps=0):
+        # adaptive: every step is as long as the fastest ball allows, at most dt; substeps: the up to
+        # MAX_FAST_BALLS fastest balls go in up to this many substeps of a step instead (numpy, parallel
+        # and rigid engines), so the step follows the slower rest
+        self.adaptive, self.courant, self.substeps = adaptive, courant, substeps
+
+    def speeds(self) -> tuple:
+        # speed and radius of every ball and dumbbell end
+        state = getattr(self.engine, "balls", None)
+        if state is not None:
+            return np.hypot(state.v_x, state.v_y), state.r
+        balls = [ball for mol in self.molecules for ball in getattr(mol, "balls", [mol])]
+        columns = np.array([(ball.v_x, ball.v_y, ball.r) for ball in balls], dtype=np.float64).reshape(-1, 3)
+        return np.hypot(columns[:, 0], columns[:, 1]), columns[:, 2]
+
+    def plan_step(self) -> tuple:
+        # (dt, fast balls, substeps) of the next step: no ball moves more than courant times the smallest
+        # radius or the broad phase cell in a step (or a substep), so none skips through a border or
+        # another ball. The event engine finds collisions at their times and keeps dt
+        if not self.adaptive or isinstance(self.engine, EventEngine) or not self.molecules:
+            return self.dt, None, 1
+        speed, r = self.speeds()
+        cell = self.engine.grid_cell() if self.engine else self.grid_cell
+        reach = self.courant * min(float(r.min()), cell)
+        speed = speed + abs(self.g) * self.dt    # the speed at the end of the step
+        fastest = float(speed.max())
+        if fastest * self.dt <= reach or reach <= 0:
+            return self.dt, None, 1
+        if self.substeps < 2 or not hasattr(self.engine, "substep") or len(speed) <= MAX_FAST_BALLS:
+            return reach / fastest, None, 1
+        # the slow balls set the step, the fast ones get substeps, as many as the fastest needs
+        slow = float(np.partition(speed, len(speed) - MAX_FAST_BALLS - 1)[-MAX_FAST_BALLS - 1])
+        dt = min(self.dt, reach / slow if slow > 0 else self.dt, self.substeps * reach / fastest)
+        fast = np.nonzero(speed * dt > reach)[0]
+        return dt, fast, min(int(np.ceil(fastest * dt / reach)), self.substeps)
+
+    def step(self):
+        self.trace_count = (self.trace_count + 1) % TRACE_FREQUENCY
+        add_trace = True if self.trace_count == 0 else False
+        dt, fast, substeps = self.plan_step()
+
+        time_moving_start = time.perf_counter()
+        if fast is not None and len(fast):
+            self.engine.move(dt, add_trace, self.g, self.trace_length, fast, substeps)
+        elif self.engine:
+            self.engine.move(dt, add_trace, self.g, self.trace_length)
+        else:
+            for molecule in self.molecules:
+                molecule.move(dt, add_trace, self.g, self.trace_length)
+        self.time_moving += time.perf_counter() - time_moving_start
+
+        time_check_grid = time.perf_counter()
+        broad = None    # seconds and candidate pairs of the broad phase, for the profiler
+        if self.engine:
+            touches = self.engine.find_touches()
+            broad = getattr(self.engine, "last_broad", None)
+        elif self.profiler:
+            candidates = list(self.candidates())
+            broad = (time.perf_counter() - time_check_grid, len(candidates))
+            touches = [pair for pair in candidates if pair[0].touch(pair[1])]
+        else:
+            touches = [pair for pair in self.candidates() if pair[0].touch(pair[1])]
+        self.time_grid += time.perf_counter() - time_check_grid
+
+        time_reflect_start = time.perf_counter()
+        if self.engine:
+            self.engine.reflect(touches)
+        else:
+            [pair[0].reflect(pair[1]) for pair in touches]
+        time_reflect_end = time.perf_counter()
+        self.time_reflect += time_reflect_end - time_reflect_start
+
+        for brd in self.borders:
+            brd.next_time(dt)
+        self.steps += 1
+        self.time += dt
+        self.last_dt = dt
+        if self.profiler:
+            self.profiler.record_step(self, (time_moving_start, time_check_grid, time_reflect_start, time_reflect_end),
+                                      broad, touches)
+        for recorder in self.recorders:
+            recorder(self)
+
+    def start_recording(self, directory: str, every=1, **kwargs) -> TrajectoryWriter:
+        # frames every `every` steps into a trajectory directory, see trajectory.py
+        recorder = TrajectoryWriter(directory, self, every, **kwargs)
+        self.recorders.append(recorder)
+        return recorder
+
+    def start_movie(self, path: str, every=1, **kwargs):
+        # offscreen movie, see movie.py; closed by stop_recording
+        from movie import MovieWriter
+        recorder = MovieWriter(path, self, every, **kwargs)
+        self.recorders.append(recorder)
+        return recorder
+
+    def stop_recording(self):
+        for recorder in self.recorders:
+            recorder.close()
+        self.recorders = []
+
+    def run(self, steps: int, callback=None):
+        for _ in range(steps):
+            self.step()
+            if callback:
+                callback(self)
+
+    # ======== observables ========
+    # computed once per step by self.observables, see observables.py
+    def kinetic_energy(self) -> float:
+        return self.observables["kinetic_energy_total"]
+
+    def potential_energy(self) -> float:
+        return self.observables["potential_energy"]
+
+    # ======== scene files ========
+    def save_to_file(self, path: str):
+        from PyQt5.QtGui import QColor
+        with open(path, 'w') as file:
+            for bord in self.borders:
+                red, green, blue, a = QColor(bord.color).getRgb()
+                file.write(f"Border {red} {green} {blue} {a} {int(bord.teflon)} {bord.p1.x()} {bord.p1.y()} {bord.p2.x()} {bord.p2.y()} {bord.stack_size}\n")
+            for mol in self.molecules:
+                kind = type(mol).__name__
+                red, green, blue, a = qcolor(mol.color_arrow if kind == "Dumbbell" else mol.color).getRgb()
+                base = f"{red} {green} {blue} {a} {int(mol.teflon)} {mol.x} {mol.y} {mol.v_x} {mol.v_y} {int(mol.trace)}"
+
+                if kind == "Ball":
+                    file.write(f"Ball {base} {mol.m} {mol.r}\n")
+                elif kind == "Dumbbell":
+                    # both end balls, the centre of mass and the rotation follow from them
+                    ends = []
+                    for ball in mol.balls:
+                        ball_red, ball_green, ball_blue, ball_a = qcolor(ball.color).getRgb()
+                        ends.append(f"{ball_red} {ball_green} {ball_blue} {ball_a} {ball.m} {ball.r} {ball.x} {ball.y} {ball.v_x} {ball.v_y}")
+                    file.write(f"Dummbell {base} {' '.join(ends)}\n")
+                else:
+                    file.write(f"Molecule {base}\n")
+
+    def set_molecules(self, molecules: list[Molecule]):
+        # a new molecule list (the scene may hold an immutable BallViews), with a new grid and engine
+        if self.engine:
+            self.engine.release()
+        self.molecules = list(molecules)
+        self.reset_grid()
+        self.observables.invalidate()
+        if self.engine:
+            self.make_engine()
+
+    def save_snapshot(self, path: str):
+        snapshot.write_snapshot(path, snapshot.scene_columns(self.borders, self.molecules))
+
+    def load_snapshot(self, path: str):
+        if self.engine:
+            self.engine.release()
+        self.borders, self.molecules = snapshot.scene_from_columns(snapshot.read_snapshot(path))
+        self.reset_grid()
+        if self.engine:
+            self.make_engine()
+
+    def load_from_file(self, file_name: str):
+        # text scene: file_name without .txt; a binary snapshot: the full name ending with .snap
+        if file_name.endswith(snapshot.SNAPSHOT_SUFFIX):
+            self.load_snapshot(file_name)
+            return
+        from PyQt5.QtGui import QColor
+        if self.engine:
+            self.engine.release()
+        self.borders, self.molecules = [], []
+        with open(file_name + ".txt", 'r') as file:
+            for line in file:
+                kind, red, green, blue, a, teflon, *other = line.strip().split()
+                clr = QColor(int(red), int(green), int(blue), int(a))
+
+                if kind == "Border":
+                    x1, y1, x2, y2, stack_size = other
+                    self.borders.append(Border(QPointF(int(float(x1)), int(float(y1))), QPointF(int(float(x2)), int(float(y2))),
+                                               clr, teflon=bool(int(teflon)), stack_size=int(stack_size)))
+                elif kind == "Ball":
+                    x, y, v_x, v_y, trace, m, r = other
+                    self.molecules.append(Ball(float(m), float(r), float(x), float(y),
+                                               float(v_x), float(v_y), clr, bool(int(teflon)), bool(int(trace))))
+                elif kind in ("Dummbell", "Dumbbell"):
+                    x, y, v_x, v_y, trace, *ends = other
+                    balls = []
+                    for end in (ends[:10], ends[10:]):
+                        ball_clr = QColor(*[int(c) for c in end[:4]])
+                        m, r, ball_x, ball_y, ball_v_x, ball_v_y = [float(v) for v in end[4:]]
+                        balls.append(Ball(m, r, ball_x, ball_y, ball_v_x, ball_v_y, ball_clr))
+                    self.molecules.append(Dumbbell(*balls, color_arrow=clr, teflon=bool(int(teflon)), trace=bool(int(trace))))
+        self.reset_grid()
+        if self.engine:
+            self.make_engine()
+
+
+""" === headless batch runs === """
+# CSV column -> observable; per-border and per-molecule observables give one column each
+WRITER_COLUMNS = {"kinetic": "kinetic_energy_total", "potential": "potential_energy", "pressure": "pressure"}
+
+
+class ObservableWriter:
+    # one CSV row every `every` steps: step, time and the observables of `columns`
+    def __init__(self, path: str, sim: Simulation, every=1, columns=WRITER_COLUMNS):
+        self.file = open(path, 'w')
+        self.every = every
+        self.columns = columns
+        header = ["step", "time"]
+        for name, observable in columns.items():
+            value = sim.observables[observable]
+            header += [f"{name}_{n}" for n in range(len(value))] if np.ndim(value) else [name]
+        self.file.write(",".join(header) + "\n")
+
+    def __call__(self, sim: Simulation):
+        if sim.steps % self.every == 0:
+            values = [sim.steps, sim.time]
+            for observable in self.columns.values():
+                value = sim.observables[observable]
+                values += value.tolist() if np.ndim(value) else [value]
+            self.file.write(",".join(str(v) for v in values) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a billiard scene without a display.")
+    parser.add_argument("scene", help="scene file written by the Save button (.txt may be omitted) or a .snap snapshot")
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--dt", type=float, default=0.02, help="step, with --adaptive the largest step")
+    parser.add_argument("--adaptive", action="store_true", help="every step as long as the fastest ball allows")
+    parser.add_argument("--courant", type=float, default=COURANT, help="adaptive steps: the part of the smallest "
+                        "radius a ball may move per step")
+    parser.add_argument("--substeps", type=int, default=0, metavar="K", help="adaptive steps: up to K substeps for "
+                        f"the {MAX_FAST_BALLS} fastest balls (numpy, parallel and rigid engines)")
+    parser.add_argument("--g", type=float, default=0.)
+    parser.add_argument("--engine", choices=list(ENGINES), default="numpy")
+    parser.add_argument("--skin", type=float, help="Verlet neighbour lists with this skin (python, numpy and rigid engines)")
+    parser.add_argument("--tune", action="store_true", help="tune the grid cell by timing the broad phase "
+                        "(numpy, parallel and rigid engines; the runs are then not reproducible)")
+    parser.add_argument("--out", default="run", help="output directory")
+    parser.add_argument("--every", type=int, default=10, help="observables every N steps")
+    parser.add_argument("--observe", nargs="*", default=[], metavar="NAME",
+                        help="more observables.csv columns: " + ", ".join(OBSERVABLES))
+    parser.add_argument("--snapshot-every", type=int, default=0, help="scene snapshot every N steps, 0 - only the last one")
+    parser.add_argument("--record", type=int, default=0, metavar="K", help="trajectory frame every K steps, 0 - no trajectory")
+    parser.add_argument("--movie", help="movie file (.mp4, .mkv, .webm, .avi - needs ffmpeg) or a directory for PNG frames")
+    parser.add_argument("--movie-every", type=int, default=5, metavar="K", help="movie frame every K steps")
+    parser.add_argument("--movie-scale", type=float, default=1., help="pixels per scene unit")
+    parser.add_argument("--profile", action="store_true", help="phase timings of every step into profile.json, "
+                        "profile.csv and profile.trace.json (Chrome trace)")
+    parser.add_argument("--binary", action="store_true", help="snapshots in the binary " + snapshot.SNAPSHOT_SUFFIX + " format")
+    args = parser.parse_args(argv)
+
+    scene = args.scene[:-4] if args.scene.endswith(".txt") else args.scene
+    sim = Simulation.from_file(scene)
+    sim.dt, sim.g = args.dt, args.g
+    sim.set_skin(args.skin)
+    sim.set_tuning(args.tune)
+    sim.set_engine(args.engine)
+    sim.set_adaptive(args.adaptive, args.courant, args.substeps)
+    os.makedirs(args.out, exist_ok=True)
+    columns = {**WRITER_COLUMNS, **{name: name for name in args.observe}}
+    observables = ObservableWriter(os.path.join(args.out, "observables.csv"), sim, args.every, columns)
+
+    def save(sim: Simulation):
+        if args.binary:
+            sim.save_snapshot(os.path.join(args.out, f"snapshot{sim.steps}{snapshot.SNAPSHOT_SUFFIX}"))
+        else:
+            sim.save_to_file(os.path.join(args.out, f"snapshot{sim.steps}.txt"))
+
+    def callback(sim: Simulation):
+        observables(sim)
+        if args.snapshot_every and sim.steps % args.snapshot_every == 0:
+            save(sim)
+
+    if args.profile:
+        sim.start_profiling(args.steps)
+    if args.record:
+        sim.start_recording(os.path.join(args.out, "trajectory"), args.record)
+    if args.movie:
+        sim.start_movie(args.movie, args.movie_every, scale=args.movie_scale)
+    start = time.perf_counter()
+    sim.run(args.steps, callback)
+    elapsed = time.perf_counter() - start
+    sim.stop_recording()
+    observables.close()
+    save(sim)
+    if sim.profiler:
+        sim.profiler.save(os.path.join(args.out, "profile"))
+    print(f"{sim.steps} steps of {len(sim.molecules)} molecules in {elapsed:.2f} s ({sim.steps / elapsed:.1f} steps/s), "
+          f"move {sim.time_moving:.2f} s, grid {sim.time_grid:.2f} s, reflect {sim.time_reflect:.2f} s")
+    if args.adaptive and sim.steps:
+        print(f"mean step {sim.time / sim.steps:.4g}, simulated time {sim.time:.4g}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+""" Binary scene snapshots: a JSON header and 64-byte aligned column blocks, read back with np.memmap
+
+    layout: MAGIC, uint32 version, uint32 header length, header, padding, column blocks
+    header: {"version": 1, "columns": {name: {"dtype": ..., "shape": [...], "offset": ...}}}
+    offsets are counted from the first block; column names are "<table>/<field>" for the tables
+    "border", "ball" and "dumbbell" (fields with suffix 0 / 1 belong to the two ends of a dumbbell),
+    "molecule/dumbbell" keeps the order of balls and dumbbells in the molecule list
+"""
+import argparse
+import json
+import sys
+import numpy as np
+
+from BorderMolecules import Border
+from balls import Ball
+from dumbbells import Dumbbell
+from engine import BallArrays, BallViews
+from qtcompat import QPointF, qcolor
+
+MAGIC = b"BILLIARD"
+VERSION = 1
+ALIGN = 64
+SNAPSHOT_SUFFIX = ".snap"
+BALL_COLUMNS = ("x", "y", "v_x", "v_y", "m", "r")
+
+
+def rgba(color) -> tuple:
+    return qcolor(color).getRgb()
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def scene_columns(borders: list[Border], molecules) -> dict[str, np.ndarray]:
+    columns = {
+        "border/x1": np.array([b.p1.x() for b in borders], dtype=np.float64),
+        "border/y1": np.array([b.p1.y() for b in borders], dtype=np.float64),
+        "border/x2": np.array([b.p2.x() for b in borders], dtype=np.float64),
+        "border/y2": np.array([b.p2.y() for b in borders], dtype=np.float64),
+        "border/color": np.array([rgba(b.color) for b in borders], dtype=np.uint8).reshape(-1, 4),
+        "border/teflon": np.array([b.teflon for b in borders], dtype=bool),
+        "border/stack_size": np.array([b.stack_size for b in borders], dtype=np.int32),
+    }
+    if isinstance(molecules, BallViews):
+        # straight from the array state
+        state = molecules.state
+        for name in BALL_COLUMNS + ("teflon", "trace"):
+            columns["ball/" + name] = getattr(state, name)
+        columns["ball/color"] = np.asarray(molecules.colors, dtype=np.uint8)
+        return columns
+
+    balls = [mol for mol in molecules if isinstance(mol, Ball)]
+    for name in BALL_COLUMNS:
+        columns["ball/" + name] = np.array([getattr(b, name) for b in balls], dtype=np.float64)
+    columns["ball/teflon"] = np.array([b.teflon for b in balls], dtype=bool)
+    columns["ball/trace"] = np.array([b.trace for b in balls], dtype=bool)
+    columns["ball/color"] = np.array([rgba(b.color) for b in balls], dtype=np.uint8).reshape(-1, 4)
+
+    dumbbells = [mol for mol in molecules if isinstance(mol, Dumbbell)]
+    for end in (0, 1):
+        for name in BALL_COLUMNS:
+            columns[f"dumbbell/{name}{end}"] = np.array([getattr(d.balls[end], name) for d in dumbbells], dtype=np.float64)
+        columns[f"dumbbell/color{end}"] = np.array([rgba(d.balls[end].color) for d in dumbbells], dtype=np.uint8).reshape(-1, 4)
+    columns["dumbbell/color_arrow"] = np.array([rgba(d.color_arrow) for d in dumbbells], dtype=np.uint8).reshape(-1, 4)
+    columns["dumbbell/teflon"] = np.array([d.teflon for d in dumbbells], dtype=bool)
+    columns["dumbbell/trace"] = np.array([d.trace for d in dumbbells], dtype=bool)
+    # the molecule order: True where the next molecule is a dumbbell
+    columns["molecule/dumbbell"] = np.array([isinstance(mol, Dumbbell) for mol in molecules
+                                             if isinstance(mol, (Ball, Dumbbell))], dtype=bool)
+    return columns
+
+
+def write_snapshot(path: str, columns: dict[str, np.ndarray]):
+    entries, offset = {}, 0
+    for name, column in columns.items():
+        column = np.ascontiguousarray(column)
+        entries[name] = {"dtype": column.dtype.str, "shape": list(column.shape), "offset": offset}
+        offset = _align(offset + column.nbytes)
+    header = json.dumps({"version": VERSION, "columns": entries}).encode()
+    start = _align(len(MAGIC) + 8 + len(header))
+    with open(path, 'wb') as file:
+        file.write(MAGIC + np.array([VERSION, len(header)], dtype="<u4").tobytes() + header)
+        for name, column in columns.items():
+            file.seek(start + entries[name]["offset"])
+            file.write(np.ascontiguousarray(column).tobytes())
+
+
+def read_snapshot(path: str) -> dict[str, np.ndarray]:
+    # columns are read-only memory maps, nothing is read until it is used
+    with open(path, 'rb') as file:
+        magic = file.read(len(MAGIC))
+        version, length = np.frombuffer(file.read(8), dtype="<u4")
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a billiard snapshot")
+        if version > VERSION:
+            raise ValueError(f"{path} has snapshot version {version}, this version reads up to {VERSION}")
+        header = json.loads(file.read(int(length)))
+    start = _align(len(MAGIC) + 8 + int(length))
+    columns = {}
+    for name, entry in header["columns"].items():
+        shape, dtype = tuple(entry["shape"]), np.dtype(entry["dtype"])
+        if np.prod(shape) == 0:
+            columns[name] = np.empty(shape, dtype=dtype)
+        else:
+            columns[name] = np.memmap(path, dtype=dtype, mode='r', offset=start + entry["offset"], shape=shape)
+    return columns
+
+
+def scene_from_columns(columns: dict[str, np.ndarray]) -> tuple[list[Border], list]:
+    # borders and dumbbells are built as objects, balls are BallViews over an array state
+    from PyQt5.QtGui import QColor
+    borders = [Border(QPointF(x1, y1), QPointF(x2, y2), QColor(*color), teflon=teflon, stack_size=stack_size)
+               for x1, y1, x2, y2, color, teflon, stack_size in zip(
+                   columns["border/x1"].tolist(), columns["border/y1"].tolist(), columns["border/x2"].tolist(),
+                   columns["border/y2"].tolist(), columns["border/color"].tolist(), columns["border/teflon"].tolist(),
+                   columns["border/stack_size"].tolist())]
+    state = BallArrays.from_columns(columns["ball/color"], **{name: columns["ball/" + name] for name in BALL_COLUMNS + ("teflon", "trace")})
+    if len(columns.get("dumbbell/teflon", ())) == 0:
+        return borders, state.balls
+
+    dumbbells = []
+    for k in range(len(columns["dumbbell/teflon"])):
+        ends = [Ball(*[columns[f"dumbbell/{name}{end}"][k].item() for name in ("m", "r", "x", "y", "v_x", "v_y")],
+                     color=QColor(*columns[f"dumbbell/color{end}"][k].tolist())) for end in (0, 1)]
+        dumbbells.append(Dumbbell(*ends, color_arrow=QColor(*columns["dumbbell/color_arrow"][k].tolist()),
+                                  teflon=bool(columns["dumbbell/teflon"][k]), trace=bool(columns["dumbbell/trace"][k])))
+    if "molecule/dumbbell" not in columns:
+        # older snapshots: balls first
+        return borders, list(state.balls) + dumbbells
+    balls, dumbbells = iter(state.balls), iter(dumbbells)
+    return borders, [next(dumbbells) if is_dumbbell else next(balls) for is_dumbbell in columns["molecule/dumbbell"].tolist()]
+
+
+def main(argv=None):
+    # converter of text scene files
+    parser = argparse.ArgumentParser(description="Convert a text scene file to a binary snapshot.")
+    parser.add_argument("scene", help="text scene file (.txt may be omitted)")
+    parser.add_argument("out", nargs="?", help="snapshot file, the scene name with " + SNAPSHOT_SUFFIX + " by default")
+    args = parser.parse_args(argv)
+
+    from simulation import Simulation
+    scene = args.scene[:-4] if args.scene.endswith(".txt") else args.scene
+    sim = Simulation.from_file(scene)
+    out = args.out or scene + SNAPSHOT_SUFFIX
+    write_snapshot(out, scene_columns(sim.borders, sim.molecules))
+    print(f"{out}: {len(sim.borders)} borders, {len(sim.molecules)} molecules")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
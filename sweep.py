@@ -0,0 +1,126 @@
+""" Parameter sweeps: many independent headless runs of one container over a process pool """
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from scenegen import Species, generate, make_balls
+from simulation import Simulation, ENGINES
+
+# defaults of the swept parameters
+DEFAULTS = {"dt": 0.02, "g": 0., "n": 500, "radius": 5., "mass": 2., "mass_ratio": 1., "temperature": 1000.}
+
+
+def expand_grid(grid: dict) -> list[dict]:
+    # every combination of the listed values, missing parameters take DEFAULTS
+    names = list(grid)
+    return [{**DEFAULTS, **dict(zip(names, values))} for values in itertools.product(*[grid[name] for name in names])]
+
+
+def run_id(params: dict) -> str:
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def run_seed(params: dict) -> int:
+    # per-run seed: the same parameters always give the same start state
+    return int(run_id(params), 16) % 2**32
+
+
+def sweep_species(params: dict) -> list[Species]:
+    # two species of one radius, by mass
+    return [Species(params["mass"], params["radius"]), Species(params["mass"] * params["mass_ratio"], params["radius"])]
+
+
+def run_one(scene: str, params: dict, steps: int, every: int, equilibrate: int, engine: str, out: str) -> dict:
+    sim = Simulation.from_file(scene)
+    rng = np.random.default_rng(run_seed(params))
+    species = sweep_species(params)
+    sim.set_molecules(make_balls(generate(sim.borders, species, int(params["n"]), temperature=params["temperature"], rng=rng), species))
+    sim.dt, sim.g = params["dt"], params["g"]
+    sim.set_engine(engine)
+
+    energy, pressure = [], []
+    start = time.perf_counter()
+    for _ in range(steps):
+        sim.step()
+        if sim.steps % every == 0:
+            obs = sim.observables
+            energy.append((sim.time, obs["kinetic_energy_total"], obs["potential_energy"]))
+            pressure.append(obs["pressure"])
+    elapsed = time.perf_counter() - start
+    energy, pressure = np.array(energy).reshape(-1, 3), np.array(pressure).reshape(len(energy), len(sim.borders))
+    np.savez(os.path.join(out, "runs", run_id(params) + ".npz"), energy=energy, pressure=pressure)
+
+    settled = energy[:, 0] >= equilibrate * params["dt"]
+    row = {"run_id": run_id(params), **params, "seed": run_seed(params), "steps": steps, "elapsed": elapsed}
+    row["kinetic"] = energy[settled, 1].mean() if settled.any() else float("nan")
+    row["temperature_measured"] = row["kinetic"] / len(sim.molecules)      # 2D, k = 1: <W> = kT
+    for k in range(len(sim.borders)):
+        row[f"pressure_{k}"] = pressure[settled, k].mean() if settled.any() else float("nan")
+    return row
+
+
+def finished_runs(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline='') as file:
+        return {row["run_id"] for row in csv.DictReader(file)}
+
+
+def run_sweep(scene: str, grid: dict, steps: int, out: str, every=10, equilibrate=0, engine="numpy", replicas=1, workers=None):
+    # runs already in out/results.csv are skipped, so an interrupted sweep continues where it stopped
+    os.makedirs(os.path.join(out, "runs"), exist_ok=True)
+    results = os.path.join(out, "results.csv")
+    done = finished_runs(results)
+    tasks = [{**params, "replica": replica} for params in expand_grid(grid) for replica in range(replicas)]
+    tasks = [params for params in tasks if run_id(params) not in done]
+    print(f"{len(done)} runs done, {len(tasks)} to go")
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(run_one, scene, params, steps, every, equilibrate, engine, out) for params in tasks]
+        for future in as_completed(futures):
+            row = future.result()
+            new_file = not os.path.exists(results)
+            with open(results, 'a', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=list(row))
+                if new_file:
+                    writer.writeheader()
+                writer.writerow(row)
+            print(f"run {row['run_id']} finished in {row['elapsed']:.1f} s")
+
+
+def parse_values(text: str) -> tuple[str, list]:
+    name, values = text.split("=")
+    if name not in DEFAULTS:
+        raise argparse.ArgumentTypeError(f"unknown parameter {name}, expected one of {list(DEFAULTS)}")
+    return name, [float(v) for v in values.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep parameters of a container over all cores.")
+    parser.add_argument("scene", help="scene file whose borders are the container (.txt may be omitted)")
+    parser.add_argument("--set", type=parse_values, action="append", default=[], metavar="NAME=V1,V2,...",
+                        help="values of one parameter: " + ", ".join(DEFAULTS))
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--every", type=int, default=10, help="history sample every N steps")
+    parser.add_argument("--equilibrate", type=int, default=0, help="steps left out of the averages")
+    parser.add_argument("--replicas", type=int, default=1, help="runs with different seeds per parameter set")
+    parser.add_argument("--engine", choices=list(ENGINES), default="numpy")
+    parser.add_argument("--workers", type=int, default=None, help="processes, all cores by default")
+    parser.add_argument("--out", default="sweep")
+    args = parser.parse_args(argv)
+
+    scene = args.scene[:-4] if args.scene.endswith(".txt") else args.scene
+    run_sweep(scene, dict(args.set), args.steps, args.out, args.every, args.equilibrate, args.engine, args.replicas, args.workers)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository; windows are drawn offscreen
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from balls import Ball
+from dumbbells import Dumbbell
+from scenegen import Species, generate, make_balls, polygon_borders
+
+SIDE = 400.
+SPECIES = [Species(1, 3), Species(4, 6)]
+
+
+@pytest.fixture
+def box():
+    return polygon_borders([(0, 0), (SIDE, 0), (SIDE, SIDE), (0, SIDE)])
+
+
+@pytest.fixture
+def mixed():
+    # balls and dumbbells interleaved, spinning dumbbells and a few moving towards each other
+    return [
+        Ball(1, 6, 60, 60, 25, 10),
+        Dumbbell(Ball(1, 5, 120, 100, 5, -20), Ball(2, 5, 145, 100, 5, 20)),
+        Ball(2, 8, 200, 200, -15, 5),
+        Ball(1, 6, 300, 80, -20, 15),
+        Dumbbell(Ball(1, 4, 280, 300, -10, 0), Ball(1, 4, 280, 322, 10, 5)),
+        Ball(3, 10, 100, 300, 10, -10),
+    ]
+
+
+@pytest.fixture
+def cloud():
+    # make(n, seed): a dense cloud of two species in the middle of a large box, so the balls collide
+    # with each other and not with the walls
+    def make(n=300, seed=0):
+        inner = polygon_borders([(900, 900), (1100, 900), (1100, 1100), (900, 1100)])
+        borders = polygon_borders([(0, 0), (2000, 0), (2000, 2000), (0, 2000)])
+        return borders, make_balls(generate(inner, SPECIES, n=n, temperature=200., rng=seed), SPECIES)
+    return make
+
+
+@pytest.fixture
+def conserved():
+    # check(sim, steps): kinetic energy and momentum stay put over the steps and no ball reaches a wall
+    def check(sim, steps):
+        obs = sim.observables
+        energy, p_x, p_y = obs["kinetic_energy_total"], obs["momentum_x"], obs["momentum_y"]
+        scale = float((obs["mass"] * obs["speed"]).sum())
+        sim.run(steps)
+        assert obs["kinetic_energy_total"] == pytest.approx(energy, rel=1e-9)
+        assert abs(obs["momentum_x"] - p_x) < 1e-9 * scale and abs(obs["momentum_y"] - p_y) < 1e-9 * scale
+        assert all(border.get_pressure() == 0 for border in sim.borders)
+    return check
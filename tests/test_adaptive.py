@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from BorderMolecules import Border
+from qtcompat import QPointF
+from simulation import Simulation, MAX_FAST_BALLS
+
+STEPS = 30
+FAST = 4
+SUBSTEPS = 8
+
+
+def test_substeps(cloud):
+    # a few balls a hundred times faster than the rest go in substeps, the others take the longer step
+    borders, balls = cloud(n=100)
+    for ball in balls[:FAST]:
+        ball.v_x, ball.v_y = 100 * ball.v_x, 100 * ball.v_y
+    sim = Simulation(borders, balls)
+    sim.set_engine("numpy")
+    sim.set_adaptive(True, substeps=SUBSTEPS)
+    state = sim.engine.balls
+    for _ in range(STEPS):
+        dt, fast, substeps = sim.plan_step()
+        speed, r = sim.speeds()
+        reach = sim.courant * min(float(r.min()), sim.engine.grid_cell())
+        assert fast is not None and 0 < len(fast) <= MAX_FAST_BALLS and 1 < substeps <= SUBSTEPS
+        assert dt > reach / speed.max()       # longer than the step without substeps
+        slow = np.ones(len(speed), dtype=bool)
+        slow[fast] = False
+        assert (speed[slow] * dt <= reach * (1 + 1e-9)).all()
+        assert (speed[fast] * dt / substeps <= reach * (1 + 1e-9)).all()
+
+        x, y = state.x.copy(), state.y.copy()
+        sim.step()
+        moved = np.hypot(state.x - x, state.y - y)
+        assert (moved[slow] <= reach * (1 + 1e-9)).all()
+        assert (moved[fast] <= substeps * reach * (1 + 1e-9)).all()
+        assert sim.last_dt == dt
+
+
+def test_pressure_of_varying_steps():
+    # a constant force per length on a border reads as that pressure whatever the steps are
+    stack_size, force = 10, 3.
+    border = Border(QPointF(0, 0), QPointF(4, 0), stack_size=stack_size)
+    rng = np.random.default_rng(0)
+    for dt in rng.uniform(0.001, 0.1, 5 * stack_size + 3).tolist():
+        border.current_momentum = force * border.length * dt
+        border.next_time(dt)
+        assert border.get_pressure() == pytest.approx(force, rel=1e-12)
+
+    # only the last stack_size steps count: the short ones weigh by their time
+    steps = [(0.01, 1.), (0.09, 5.)] * stack_size
+    for dt, step_force in steps:
+        border.current_momentum = step_force * border.length * dt
+        border.next_time(dt)
+    assert border.get_pressure() == pytest.approx((0.01 * 1. + 0.09 * 5.) / 0.1, rel=1e-12)
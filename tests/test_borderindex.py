@@ -0,0 +1,24 @@
+from balls import Ball
+from scenegen import polygon_borders
+from simulation import Simulation
+
+
+def test_borders_reassigned(box):
+    # a ball at the right wall of the box, then the box is swapped for a wider one
+    side = box[1].p1.x()
+    sim = Simulation(box, [Ball(1, 6, side - 8, side / 2, 20, 0)])
+    pairs = sim.border_pairs()
+    assert any(border is box[1] for _, border in pairs)
+    index = sim.border_index
+    assert index is not None and len(index) == len(box)
+
+    wide = polygon_borders([(0, 0), (2 * side, 0), (2 * side, side), (0, side)])
+    sim.borders = wide
+    assert sim.border_index is None
+    assert all(any(border is new for new in wide) for _, border in sim.border_pairs())
+    assert sim.border_index is not index and len(sim.border_index) == len(wide)
+
+    # the ball goes on past the old wall and comes back from the new one
+    sim.run(int(1.5 * side / 20 / sim.dt))
+    ball = sim.molecules[0]
+    assert side < ball.x < 2 * side and ball.v_x < 0
@@ -0,0 +1,34 @@
+import numpy as np
+
+from simulation import Simulation
+
+STEPS = 100
+
+
+def test_conservation(cloud, conserved):
+    sim = Simulation(*cloud())
+    sim.set_engine("numpy")
+    conserved(sim, STEPS)
+
+
+def test_collisions_happen(cloud):
+    # the conservation tests mean something only if the balls collide
+    sim = Simulation(*cloud())
+    sim.set_engine("numpy")
+    before = np.array([mol.v_x for mol in sim.molecules])
+    sim.run(STEPS)
+    assert not np.array_equal(before, [mol.v_x for mol in sim.molecules])
+
+
+def test_same_as_python(cloud):
+    # the array engine does the Ball math of the python engine; a sparse cloud, so no ball has two
+    # touches in one step (they are reflected in another order)
+    runs = []
+    for engine in ("python", "numpy"):
+        sim = Simulation(*cloud(n=30))
+        start = [(mol.v_x, mol.v_y) for mol in sim.molecules]
+        sim.set_engine(engine)
+        sim.run(20)
+        runs.append([(mol.x, mol.y, mol.v_x, mol.v_y) for mol in sim.molecules])
+    assert np.allclose(runs[0], runs[1], rtol=1e-9, atol=1e-9)
+    assert not np.allclose(np.array(runs[1])[:, 2:], start)
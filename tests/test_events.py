@@ -0,0 +1,23 @@
+from simulation import Simulation
+
+
+def test_conservation(cloud, conserved):
+    sim = Simulation(*cloud())
+    sim.set_engine("events")
+    conserved(sim, 100)
+    assert sim.engine.events > 0
+
+
+def test_no_overlaps(box, cloud):
+    # exact collision times: no two balls ever overlap, none leaves the box
+    _, balls = cloud(n=100)
+    for ball in balls:
+        ball.x, ball.y = ball.x - 800, ball.y - 800
+        ball.v_x, ball.v_y = 10 * ball.v_x, 10 * ball.v_y
+    sim = Simulation(box, balls)
+    sim.set_engine("events")
+    sim.run(50)
+    for k, a in enumerate(sim.molecules):
+        assert a.r - 1e-6 <= a.x <= 400 - a.r + 1e-6 and a.r - 1e-6 <= a.y <= 400 - a.r + 1e-6
+        for b in sim.molecules[k + 1:]:
+            assert (a.x - b.x) ** 2 + (a.y - b.y) ** 2 >= (a.r + b.r - 1e-6) ** 2
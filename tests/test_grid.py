@@ -0,0 +1,36 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from BorderMolecules import LevelGrid
+from balls import Ball
+
+
+def touching(balls) -> set:
+    return {frozenset((id(a), id(b))) for a, b in itertools.combinations(balls, 2)
+            if (a.x - b.x) ** 2 + (a.y - b.y) ** 2 <= (a.r + b.r) ** 2}
+
+
+@pytest.mark.parametrize("cell", [2., 5., 10.])
+def test_mixed_sizes(cell):
+    # every touching pair comes out, and once, whatever levels the sizes fall on
+    rng = np.random.default_rng(3)
+    n = 400
+    r = rng.choice([1., 2.5, 5., 12., 40.], size=n, p=[.5, .2, .2, .08, .02])
+    balls = [Ball(1, radius, x, y) for radius, x, y in zip(r, rng.uniform(-200, 300, n), rng.uniform(-100, 400, n))]
+    grid = LevelGrid(0, 0, cell)
+    for ball in balls:
+        grid.add_object(ball)
+    pairs = [frozenset((id(a), id(b))) for a, b in grid.get_possible_collisions()]
+    assert len(pairs) == len(set(pairs))
+    assert touching(balls) <= set(pairs)
+
+
+def test_diameter_cell():
+    # balls exactly a cell wide stay on the finest level despite rounding
+    balls = [Ball(1, 5, 0.1 * k + 1000.3, 0.7 * k + 2000.9) for k in range(100)]
+    grid = LevelGrid(0, 0, 10.)
+    for ball in balls:
+        grid.add_object(ball)
+    assert len(grid.levels[0].small) == 100 and all(not level.small for level in grid.levels[1:])
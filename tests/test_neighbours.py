@@ -0,0 +1,41 @@
+from BorderMolecules import NeighbourList
+from simulation import Simulation
+
+STEPS = 200
+SKIN = 2.
+FAST = 4
+
+
+def touching(pairs) -> set:
+    return {frozenset((id(a), id(b))) for a, b in pairs if a.touch(b)}
+
+
+def test_same_as_cell_list(cloud):
+    # slow balls wear their skin out after some steps, a few fast ones leave it in between (strays)
+    borders, balls = cloud(n=150)
+    for k, ball in enumerate(balls):
+        scale = 1. if k < FAST else 0.1
+        ball.v_x, ball.v_y = scale * ball.v_x, scale * ball.v_y
+    sim = Simulation(borders, balls)
+    sim.set_skin(SKIN)
+    assert isinstance(sim.grid, NeighbourList)
+    reference = Simulation(borders, sim.molecules)
+    assert not isinstance(reference.grid, NeighbourList)
+
+    # the pairs the step reflects, after the move
+    touches = []
+    candidates = sim.candidates
+
+    def checked():
+        pairs = list(candidates())
+        touches.append(touching(pairs))
+        assert touches[-1] == touching(reference.candidates())
+        return pairs
+    sim.candidates = checked
+
+    stray_steps = 0
+    for _ in range(STEPS):
+        sim.step()
+        stray_steps += bool(sim.grid.strays())
+    assert len(touches) == STEPS and sum(map(len, touches)) > 0
+    assert stray_steps > 0 and sim.grid.rebuilds > 1
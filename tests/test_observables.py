@@ -0,0 +1,42 @@
+import pytest
+
+from observables import OBSERVABLES
+from simulation import Simulation
+
+
+def test_cache(cloud, monkeypatch):
+    # an observable counting its computations
+    calls = []
+
+    def count(obs) -> int:
+        calls.append(obs.sim.steps)
+        return len(calls)
+    monkeypatch.setitem(OBSERVABLES, "calls", (count, "scene", ""))
+    borders, balls = cloud(n=50)
+    sim = Simulation(borders, balls)
+    obs = sim.observables
+
+    def computed() -> int:
+        # the count after two reads
+        assert obs["calls"] == obs["calls"]
+        return len(calls)
+
+    assert computed() == 1
+    sim.step()
+    assert computed() == 2
+    sim.set_engine("numpy")
+    assert computed() == 3
+    sim.set_molecules(sim.molecules[:-1])
+    assert computed() == 4
+    obs.invalidate()
+    assert computed() == 5
+
+    # values follow the state of the engine after a step, cached ones until invalidate()
+    sim.run(5)
+    energy = sum(mol.W() for mol in sim.molecules)
+    assert obs["kinetic_energy_total"] == pytest.approx(energy, rel=1e-12)
+    sim.molecules[0].v_x += 10
+    assert obs["kinetic_energy_total"] == pytest.approx(energy, rel=1e-12)
+    obs.invalidate()
+    assert obs["kinetic_energy_total"] == pytest.approx(sum(mol.W() for mol in sim.molecules), rel=1e-12)
+    assert obs["kinetic_energy_total"] != pytest.approx(energy, rel=1e-12)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from parallel import ParallelEngine
+from simulation import Simulation
+
+STEPS = 100
+
+
+def parallel(sim) -> ParallelEngine:
+    # two worker processes even for a small scene
+    sim.engine = ParallelEngine(sim.molecules, sim.borders, workers=2, min_balls=0)
+    assert sim.engine.pool is not None
+    return sim.engine
+
+
+def test_conservation(cloud, conserved):
+    sim = Simulation(*cloud())
+    parallel(sim)
+    try:
+        conserved(sim, STEPS)
+    finally:
+        sim.engine.release()
+
+
+def test_same_as_numpy(cloud):
+    runs = []
+    for workers in (False, True):
+        sim = Simulation(*cloud(seed=1))
+        if workers:
+            parallel(sim)
+        else:
+            sim.set_engine("numpy")
+        sim.run(STEPS)
+        state = sim.engine.balls
+        runs.append(np.stack([state.x, state.y, state.v_x, state.v_y]).copy())
+        sim.engine.release()
+    assert np.array_equal(runs[0], runs[1])
@@ -0,0 +1,46 @@
+import csv
+import json
+
+import pytest
+
+from profiling import PHASES, STEP_FIELDS
+from simulation import Simulation
+
+LENGTH = 20
+STEPS = 30
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_export(cloud, tmp_path, engine):
+    sim = Simulation(*cloud(n=50))
+    sim.set_engine(engine)
+    profiler = sim.start_profiling(LENGTH)
+    sim.run(STEPS)
+    profiler.record_frame(profiler.origin + 1., profiler.origin + 1.25)
+    profiler.save(str(tmp_path / "profile"))
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["profile.csv", "profile.json", "profile.trace.json"]
+
+    # the last LENGTH steps, one row of STEP_FIELDS each
+    with open(tmp_path / "profile.json") as file:
+        report = json.load(file)
+    assert report["fields"] == list(STEP_FIELDS)
+    steps = [dict(zip(STEP_FIELDS, row)) for row in report["steps"]]
+    assert [row["step"] for row in steps] == list(range(STEPS - LENGTH + 1, STEPS + 1))
+    assert all(row["molecules"] == 50 and row["move"] >= 0 and row["reflect"] >= 0 for row in steps)
+    assert report["frames"] == [[1., 0.25]]
+    summary = report["summary"]
+    assert summary["steps"] == LENGTH and summary["frames"] == 1 and summary["frame_ms"] == pytest.approx(250.)
+    assert all(name + "_ms" in summary for name in PHASES)
+
+    with open(tmp_path / "profile.csv", newline='') as file:
+        rows = list(csv.reader(file))
+    assert rows[0] == list(STEP_FIELDS) and len(rows) == LENGTH + 1
+    assert [int(row[0]) for row in rows[1:]] == [row["step"] for row in steps]
+
+    with open(tmp_path / "profile.trace.json") as file:
+        events = json.load(file)["traceEvents"]
+    phases = [event for event in events if event["ph"] == "X" and event.get("tid") == 1]
+    assert {event["name"] for event in phases} <= set(PHASES) and {"move", "reflect"} <= {event["name"] for event in phases}
+    assert len([event for event in events if event["name"] == "pairs"]) == LENGTH
+    assert [event["dur"] for event in events if event["name"] == "frame"] == [pytest.approx(0.25e6)]
+    sim.stop_profiling()
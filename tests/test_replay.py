@@ -0,0 +1,46 @@
+import numpy as np
+
+from dumbbells import Dumbbell
+from replay import Replay
+from simulation import Simulation
+
+
+def test_replay(tmp_path, box, mixed):
+    # the rigid engine turns the dumbbells; the replay puts every ball and dumbbell end back where it was
+    sim = Simulation(box, mixed)
+    sim.set_engine("rigid")
+    sim.start_recording(str(tmp_path), every=1, chunk_frames=8)
+    ends = []
+    for _ in range(30):
+        sim.step()
+        ends.append([(ball.x, ball.y) for mol in sim.molecules for ball in getattr(mol, "balls", [mol])])
+    sim.stop_recording()
+
+    replay = Replay(str(tmp_path))
+    assert [isinstance(mol, Dumbbell) for mol in replay.molecules] == [isinstance(mol, Dumbbell) for mol in mixed]
+    assert len(replay) == 31
+    for frame in (30, 7, 19):
+        replay.seek(frame)
+        replayed = [(ball.x, ball.y) for mol in replay.molecules for ball in getattr(mol, "balls", [mol])]
+        assert np.allclose(replayed, ends[frame - 1], atol=1e-3)
+    first, last = ends[0], ends[-1]
+    assert not np.allclose(np.subtract(first[2], first[1]), np.subtract(last[2], last[1]))     # a dumbbell has turned
+
+
+def test_advance(tmp_path, box, cloud):
+    # frames follow the clock at the replay speed; array-backed balls are written in place
+    _, balls = cloud(n=50)
+    for ball in balls:
+        ball.x, ball.y = ball.x - 800, ball.y - 800
+    sim = Simulation(box, balls)
+    sim.set_engine("numpy")
+    sim.start_recording(str(tmp_path), every=2)
+    sim.run(40)
+    sim.stop_recording()
+
+    replay = Replay(str(tmp_path), speed=2.)
+    assert replay.advance(0.25)        # 0.5 simulation seconds: 10 steps of 0.05, a frame every 2
+    assert replay.frame == 5
+    assert not replay.advance(0.01)
+    replay.seek(len(replay) - 1)
+    assert np.allclose([ball.x for ball in replay.molecules], [ball.x for ball in sim.molecules], atol=1e-3)
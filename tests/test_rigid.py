@@ -0,0 +1,20 @@
+import pytest
+
+from simulation import Simulation
+
+
+def test_conservation(cloud, conserved):
+    sim = Simulation(*cloud())
+    sim.set_engine("rigid")
+    conserved(sim, 100)
+
+
+def test_dumbbell_energy(box, mixed):
+    # walls and turning dumbbells: the energy with the rotation stays put
+    sim = Simulation(box, mixed)
+    sim.set_engine("rigid")
+    energy = sim.observables["kinetic_energy_total"]
+    sim.run(400)
+    assert sim.observables["kinetic_energy_total"] == pytest.approx(energy, rel=1e-9)
+    assert sim.engine.balls.kinetic_energy() == pytest.approx(energy, rel=1e-9)
+    assert all(0 < ball.x < 400 and 0 < ball.y < 400 for ball in sim.engine.balls.balls)
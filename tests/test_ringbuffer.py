@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from ringbuffer import RingBuffer
+
+CAPACITY = 5
+
+
+def test_wraparound():
+    buffer = RingBuffer(CAPACITY)
+    for value in range(3 * CAPACITY + 2):
+        buffer.append(float(value))
+        kept = list(range(value + 1))[-CAPACITY:]
+        assert buffer.view().tolist() == kept
+        assert len(buffer) == len(kept) and buffer[-1] == value
+    assert buffer.count == 3 * CAPACITY + 2
+
+
+def test_wraparound_points():
+    buffer = RingBuffer(CAPACITY, shape=(2,))
+    for value in range(2 * CAPACITY + 3):
+        buffer.append((value, -value))
+    assert np.array_equal(buffer.view(), [(v, -v) for v in range(CAPACITY + 3, 2 * CAPACITY + 3)])
+
+
+def test_mean():
+    buffer = RingBuffer(CAPACITY)
+    assert buffer.mean() == 0.
+    values = [0.1 * k * k for k in range(4 * CAPACITY)]
+    for k, value in enumerate(values):
+        buffer.append(value)
+        # before the buffer is full the mean is over the values so far, after it over the last CAPACITY
+        assert buffer.mean() == pytest.approx(np.mean(values[max(0, k + 1 - CAPACITY):k + 1]), rel=1e-12)
+    buffer.clear()
+    assert buffer.mean() == 0. and len(buffer) == 0
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from borderindex import segment_distance
+from scenegen import Species, border_arrays, generate, inside_polygon, polygon_area, polygon_borders
+
+MIXED = [Species(1, 3, fraction=3), Species(5, 7)]
+# an L-shaped container
+L_SHAPE = [(0, 0), (600, 0), (600, 250), (250, 250), (250, 600), (0, 600)]
+
+
+@pytest.mark.parametrize("method, packing, species", [("random", 0.3, MIXED), ("lattice", 0.3, MIXED),
+                                                      ("lattice", 0.6, MIXED[:1])])
+def test_generate(method, packing, species):
+    borders = polygon_borders(L_SHAPE)
+    columns = generate(borders, species, packing=packing, temperature=500., rng=1, method=method)
+    x, y, r, m = columns["x"], columns["y"], columns["r"], columns["m"]
+    assert len(x) > 100
+    fractions = np.array([s.fraction for s in species]) / sum(s.fraction for s in species)
+    assert np.bincount(columns["species"]).tolist() == pytest.approx((fractions * len(x)).tolist(), abs=1)
+    assert float((np.pi * r * r).sum()) / polygon_area(borders) == pytest.approx(packing, rel=0.01)
+
+    # no overlaps, every ball inside and clear of the walls
+    gap = np.hypot(x[:, None] - x, y[:, None] - y) - (r[:, None] + r)
+    np.fill_diagonal(gap, np.inf)
+    assert gap.min() >= 0
+    assert inside_polygon(x, y, borders).all()
+    for x1, y1, x2, y2 in zip(*border_arrays(borders)):
+        assert (segment_distance(x, y, x1, y1, x2, y2) >= r).all()
+
+    # zero net momentum, speeds of the temperature
+    scale = float((m * np.hypot(columns["v_x"], columns["v_y"])).sum())
+    assert abs(float((m * columns["v_x"]).sum())) < 1e-12 * scale
+    assert abs(float((m * columns["v_y"]).sum())) < 1e-12 * scale
+    kinetic = float((m * (columns["v_x"]**2 + columns["v_y"]**2)).sum()) / 2
+    assert kinetic / len(x) == pytest.approx(500., rel=0.15)
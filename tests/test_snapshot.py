@@ -0,0 +1,33 @@
+import numpy as np
+
+import snapshot
+from balls import Ball
+from dumbbells import Dumbbell
+from engine import BallViews
+
+
+def round_trip(tmp_path, borders, molecules):
+    path = str(tmp_path / ("scene" + snapshot.SNAPSHOT_SUFFIX))
+    snapshot.write_snapshot(path, snapshot.scene_columns(borders, molecules))
+    return snapshot.scene_from_columns(snapshot.read_snapshot(path))
+
+
+def test_molecule_order(tmp_path, box, mixed):
+    borders, molecules = round_trip(tmp_path, box, mixed)
+    assert [isinstance(mol, Dumbbell) for mol in molecules] == [isinstance(mol, Dumbbell) for mol in mixed]
+    for mol, old in zip(molecules, mixed):
+        assert (mol.x, mol.y, mol.v_x, mol.v_y) == (old.x, old.y, old.v_x, old.v_y)
+        for ball, old_ball in zip(getattr(mol, "balls", ()), getattr(old, "balls", ())):
+            assert (ball.m, ball.r, ball.x, ball.y) == (old_ball.m, old_ball.r, old_ball.x, old_ball.y)
+    assert [(b.p1.x(), b.p1.y(), b.p2.x(), b.p2.y()) for b in borders] == [(b.p1.x(), b.p1.y(), b.p2.x(), b.p2.y()) for b in box]
+
+
+def test_balls_load_as_views(tmp_path, box, mixed):
+    balls = [mol for mol in mixed if isinstance(mol, Ball)]
+    _, molecules = round_trip(tmp_path, box, balls)
+    assert isinstance(molecules, BallViews)
+    assert np.array_equal(molecules.state.x, [ball.x for ball in balls])
+    # and once more from the views
+    _, again = round_trip(tmp_path, box, molecules)
+    assert np.array_equal(again.state.v_y, [ball.v_y for ball in balls])
+    assert not any(isinstance(mol, Dumbbell) for mol in again)
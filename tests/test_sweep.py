@@ -0,0 +1,36 @@
+import csv
+
+from simulation import Simulation
+import sweep
+
+GRID = {"n": [20, 30], "radius": [3.]}
+STEPS = 20
+
+
+def rows(path) -> list[dict]:
+    with open(path, newline='') as file:
+        return list(csv.DictReader(file))
+
+
+def test_resume(box, tmp_path, capsys):
+    scene, out = str(tmp_path / "box"), str(tmp_path / "sweep")
+    Simulation(box, []).save_to_file(scene + ".txt")
+    sweep.run_sweep(scene, GRID, STEPS, out, every=5, workers=1)
+    results = tmp_path / "sweep" / "results.csv"
+    full = rows(results)
+    assert len(full) == 2
+
+    # the sweep stopped after its first run
+    lines = results.read_text().splitlines(keepends=True)
+    results.write_text("".join(lines[:2]))
+    capsys.readouterr()
+    sweep.run_sweep(scene, GRID, STEPS, out, every=5, workers=1)
+    assert "1 runs done, 1 to go" in capsys.readouterr().out
+    resumed = rows(results)
+    assert len(resumed) == 2
+    assert resumed[0] == full[0]
+    assert {row["run_id"] for row in resumed} == {sweep.run_id({**params, "replica": 0}) for params in sweep.expand_grid(GRID)}
+
+    sweep.run_sweep(scene, GRID, STEPS, out, every=5, workers=1)
+    assert "2 runs done, 0 to go" in capsys.readouterr().out
+    assert len(rows(results)) == 2
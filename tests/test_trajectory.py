@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from simulation import Simulation, ENGINES
+from trajectory import Trajectory, FIELDS, orientation
+
+
+@pytest.mark.parametrize("engine", list(ENGINES))
+def test_record_dumbbells(tmp_path, box, mixed, engine):
+    sim = Simulation(box, mixed)
+    try:
+        sim.set_engine(engine)
+    except ValueError:
+        pytest.skip(f"the {engine} engine takes only balls")
+    sim.start_recording(str(tmp_path), every=2, chunk_frames=4)
+    sim.run(20)
+    sim.stop_recording()
+
+    trajectory = Trajectory(str(tmp_path))
+    assert len(trajectory) == 11
+    frame = trajectory[-1]
+    assert frame.shape == (len(FIELDS), len(mixed))
+    assert np.allclose(frame[0], [mol.x for mol in sim.molecules], atol=1e-3)
+    assert np.allclose(frame[1], [mol.y for mol in sim.molecules], atol=1e-3)
+    phi = np.array([orientation(mol) for mol in sim.molecules])
+    assert np.allclose(np.cos(frame[4]), np.cos(phi), atol=1e-5) and np.allclose(np.sin(frame[4]), np.sin(phi), atol=1e-5)
@@ -0,0 +1,196 @@
+""" Trajectory recording: frames of x, y, v_x, v_y, phi every K steps, written in chunks by a background thread
+
+    a trajectory is a directory:
+        index.json      - ball count, chunk size, dtype, compression, record interval
+        scene.snap      - the scene at the start (snapshot.py)
+        time.bin        - float64 (step, time) of every written frame, appended chunk by chunk
+        chunk000000.npz - frames 0 .. chunk_frames-1, array "frames" (frames, 5, n), compressed
+        chunk000000.npy - the same uncompressed, memory-mapped on reading
+    phi is the angle of a dumbbell axis from its first end to the second (0 for balls); version 1 frames
+    have only x, y, v_x, v_y
+"""
+import json
+import math
+import os
+import queue
+import threading
+import numpy as np
+
+import snapshot
+from engine import BallViews
+
+VERSION = 2
+FIELDS = ("x", "y", "v_x", "v_y", "phi")
+MOTION = FIELDS[:4]
+INDEX_FILE = "index.json"
+SCENE_FILE = "scene.snap"
+TIME_FILE = "time.bin"
+
+
+def chunk_file(k: int, compress: bool) -> str:
+    return f"chunk{k:06d}" + (".npz" if compress else ".npy")
+
+
+def orientation(mol) -> float:
+    # phi of a dumbbell, 0 for a ball
+    balls = getattr(mol, "balls", None)
+    return math.atan2(balls[1].y - balls[0].y, balls[1].x - balls[0].x) if balls else 0.
+
+
+def frame_columns(sim) -> tuple:
+    # x, y, v_x, v_y, phi of all molecules, straight from the engine arrays when there are any
+    state = getattr(sim.engine, "balls", None)
+    if hasattr(state, "body_x"):
+        # rigid engine, a row per body: the rows of the state are the spheres, two of them per dumbbell
+        return tuple(getattr(state, "body_" + name) for name in FIELDS)
+    if state is None and isinstance(sim.molecules, BallViews):
+        state = sim.molecules.state
+    if state is not None:
+        return tuple(getattr(state, name) for name in MOTION) + (np.broadcast_to(0., (len(state),)),)
+    n = len(sim.molecules)
+    return tuple(np.fromiter((getattr(mol, name) for mol in sim.molecules), dtype=np.float64, count=n) for name in MOTION) + \
+        (np.fromiter((orientation(mol) for mol in sim.molecules), dtype=np.float64, count=n),)
+
+
+class TrajectoryWriter:
+    """ append frames of a Simulation to a trajectory directory; the tick only copies the frame into
+        the current chunk, full chunks go to a writer thread through a bounded queue """
+    def __init__(self, directory: str, sim, every=1, chunk_frames=256, compress=True, dtype=np.float32, max_chunks=4):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.every = every
+        self.chunk_frames = chunk_frames
+        self.compress = compress
+        self.n = len(sim.molecules)
+        self.dtype = np.dtype(dtype)
+        snapshot.write_snapshot(os.path.join(directory, SCENE_FILE), snapshot.scene_columns(sim.borders, sim.molecules))
+        with open(os.path.join(directory, INDEX_FILE), 'w') as file:
+            json.dump({"version": VERSION, "n": self.n, "fields": FIELDS, "dtype": self.dtype.str, "every": every,
+                       "dt": sim.dt, "chunk_frames": chunk_frames, "compress": compress}, file)
+        open(os.path.join(directory, TIME_FILE), 'wb').close()
+
+        self.chunks = 0
+        self.frames = 0
+        self.buffer = self.new_buffer()
+        self.queue = queue.Queue(maxsize=max_chunks)     # memory: at most max_chunks + 1 chunks
+        self.error = None
+        self.thread = threading.Thread(target=self.write_chunks, daemon=True)
+        self.thread.start()
+        self.add_frame(sim)
+
+    def new_buffer(self):
+        return (np.empty((self.chunk_frames, len(FIELDS), self.n), dtype=self.dtype),
+                np.empty((self.chunk_frames, 2), dtype=np.float64))
+
+    def __call__(self, sim):
+        if sim.steps % self.every == 0:
+            self.add_frame(sim)
+
+    def add_frame(self, sim):
+        if self.error:
+            raise self.error
+        frames, times = self.buffer
+        row = self.frames % self.chunk_frames
+        for k, column in enumerate(frame_columns(sim)):
+            frames[row, k] = column
+        times[row] = sim.steps, sim.time
+        self.frames += 1
+        if row == self.chunk_frames - 1:
+            self.flush()
+
+    def flush(self):
+        # hand the filled part of the current chunk to the writer thread; blocks only if it is max_chunks behind
+        rows = self.frames - self.chunks * self.chunk_frames
+        if rows == 0:
+            return
+        frames, times = self.buffer
+        self.queue.put((self.chunks, frames[:rows], times[:rows]))
+        self.chunks += 1
+        self.buffer = self.new_buffer()
+
+    def write_chunks(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            k, frames, times = item
+            try:
+                path = os.path.join(self.directory, chunk_file(k, self.compress))
+                if self.compress:
+                    np.savez_compressed(path, frames=frames)
+                else:
+                    np.save(path, frames)
+                # time.bin is written last: a frame counts once its chunk is on disk
+                with open(os.path.join(self.directory, TIME_FILE), 'ab') as file:
+                    file.write(times.tobytes())
+            except Exception as error:
+                self.error = error
+
+    def close(self):
+        if self.chunks * self.chunk_frames < self.frames:
+            self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+
+class Trajectory:
+    """ read side: len(), frame i as a (fields, n) array x, y, v_x, v_y, phi, steps and time of the frames """
+    def __init__(self, directory: str, cached_chunks=2):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            self.index = json.load(file)
+        if self.index["version"] > VERSION:
+            raise ValueError(f"{directory} has trajectory version {self.index['version']}, this version reads up to {VERSION}")
+        self.n = self.index["n"]
+        self.fields = tuple(self.index["fields"])
+        self.chunk_frames = self.index["chunk_frames"]
+        self.compress = self.index["compress"]
+        self.every = self.index["every"]
+        self.cached_chunks = cached_chunks
+        self.cache = {}
+        self.refresh()
+
+    def refresh(self):
+        # pick up frames written since opening, the trajectory may still be recording
+        path = os.path.join(self.directory, TIME_FILE)
+        count = os.path.getsize(path) // 16
+        times = np.memmap(path, dtype=np.float64, mode='r', shape=(count, 2)) if count else np.empty((0, 2))
+        self.steps, self.time = times[:, 0], times[:, 1]
+
+    def __len__(self):
+        return len(self.time)
+
+    def chunk(self, k: int) -> np.ndarray:
+        frames = self.cache.get(k)
+        if frames is None:
+            path = os.path.join(self.directory, chunk_file(k, self.compress))
+            if self.compress:
+                with np.load(path) as data:
+                    frames = data["frames"]
+            else:
+                frames = np.load(path, mmap_mode='r')
+            if len(self.cache) >= self.cached_chunks:
+                self.cache.pop(next(iter(self.cache)))
+            self.cache[k] = frames
+        return frames
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("frame index out of range")
+        return self.chunk(i // self.chunk_frames)[i % self.chunk_frames]
+
+    def frames(self, start=0, stop=None, step=1):
+        for i in range(start, len(self) if stop is None else min(stop, len(self)), step):
+            yield self[i]
+
+    def frame_at(self, t: float) -> int:
+        # index of the last frame not later than t
+        return max(int(np.searchsorted(self.time, t, side='right')) - 1, 0)
+
+    def scene(self) -> tuple:
+        # borders and molecules at the start of the recording
+        return snapshot.scene_from_columns(snapshot.read_snapshot(os.path.join(self.directory, SCENE_FILE)))
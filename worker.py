@@ -0,0 +1,81 @@
+""" Physics on a worker thread: steps as fast as possible or at a fixed simulation/real time ratio,
+    publishing scene captures that the GUI draws at its own frame rate """
+import threading
+import time
+
+from render import SceneCapture, merge_traces
+
+PUBLISH_INTERVAL = 1 / 120      # seconds between two captures
+MAX_SLEEP = 0.05
+
+
+class SimulationWorker(threading.Thread):
+    """ steps a Simulation while `running` is set. A step holds `lock`, so the GUI takes the same lock
+        to read or change the simulation consistently. The worker publishes a capture, the GUI takes it
+        and copies it into its own display state; an unread capture is replaced by the next one
+        (the traces are merged) """
+    def __init__(self, sim, ratio=None, publish_interval=PUBLISH_INTERVAL):
+        super().__init__(daemon=True)
+        self.sim = sim
+        self.ratio = ratio          # simulation seconds per real second, None - as fast as possible
+        self.publish_interval = publish_interval
+        self.lock = threading.RLock()
+        self.running = threading.Event()
+        self.stopped = False
+        self.capture = SceneCapture(sim)
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
+        self.steps_per_second = 0.
+        self.error = None
+
+    def run(self):
+        last_publish = 0.
+        while not self.stopped:
+            if not self.running.wait(0.1):
+                continue
+            # the clock restarts after every pause
+            wall_start, sim_start, steps_start = time.perf_counter(), self.sim.time, self.sim.steps
+            while self.running.is_set() and not self.stopped:
+                now = time.perf_counter()
+                if self.ratio:
+                    ahead = (self.sim.time - sim_start) / self.ratio - (now - wall_start)
+                    if ahead > 0:
+                        time.sleep(min(ahead, MAX_SLEEP))
+                        continue
+                try:
+                    with self.lock:
+                        self.sim.step()
+                except Exception as error:
+                    self.error = error
+                    self.running.clear()
+                    break
+                if now - last_publish >= self.publish_interval:
+                    last_publish = now
+                    self.publish()
+                    self.steps_per_second = (self.sim.steps - steps_start) / max(now - wall_start, 1e-9)
+            self.publish()
+
+    def publish(self):
+        with self.lock:
+            frame = self.capture.capture() + (self.sim.time, self.sim.steps)
+        with self.snapshot_lock:
+            if self.snapshot is not None:
+                frame = frame[:4] + (merge_traces(self.snapshot[4], frame[4]),) + frame[5:]
+            self.snapshot = frame
+
+    def take(self):
+        # the newest capture (x, y, v_x, v_y, traces, time, steps) or None if nothing new
+        with self.snapshot_lock:
+            snapshot, self.snapshot = self.snapshot, None
+        return snapshot
+
+    def reset(self):
+        # after the scene changed: call with the lock held
+        self.capture = SceneCapture(self.sim)
+        with self.snapshot_lock:
+            self.snapshot = None
+
+    def stop(self):
+        self.stopped = True
+        self.running.set()
+        self.join()